@@ -0,0 +1,25 @@
+import asyncio
+import os
+from fastapi import Header, Request
+from typing import AsyncIterator, Optional
+from client.llm.generation_deadline import GenerationDeadline
+
+# X-Request-Timeout もリクエストの timeout も指定されない場合の締め切り（秒、0 なら締め切りなし）
+REQUEST_TIMEOUT_SECONDS = float(os.getenv("REQUEST_TIMEOUT_SECONDS", "0"))
+
+
+async def request_deadline(
+    request: Request,
+    x_request_timeout: Optional[float] = Header(default=None, gt=0)
+) -> AsyncIterator[GenerationDeadline]:
+    """リクエストの締め切りを作成し、レスポンスを返し終えるまでクライアントの切断を監視する
+
+    yield を使う依存関係の後処理はストリーミングレスポンスの送信後に実行されるため、
+    SSEの途中で切断された場合も生成を打ち切れる。
+    """
+    deadline = GenerationDeadline(x_request_timeout or REQUEST_TIMEOUT_SECONDS or None)
+    watcher = asyncio.create_task(deadline.watch_disconnect(request.is_disconnected))
+    try:
+        yield deadline
+    finally:
+        watcher.cancel()
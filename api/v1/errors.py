@@ -0,0 +1,35 @@
+from contextlib import contextmanager
+from fastapi import HTTPException
+from typing import Iterator
+from client.llm.fair_scheduler import QuotaExceededError
+from client.llm.inference_executor import QueueFullError
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@contextmanager
+def generation_errors(action: str) -> Iterator[None]:
+    """生成処理の例外をHTTPエラーに変換する（予算超過は429、推論キューが満杯なら503、それ以外は500）
+
+    action はログと500のエラー詳細に使う処理名（例: "言い訳の生成"）。
+    """
+    try:
+        yield
+    except QuotaExceededError as e:
+        logger.warning(f"トークン予算の超過のため{action}を拒否: {str(e)}")
+        raise HTTPException(
+            status_code=429,
+            detail="トークンの使用量が上限に達しました。しばらくしてから再試行してください。",
+            headers=e.headers
+        )
+    except QueueFullError as e:
+        logger.warning(f"推論キューが満杯のため{action}を拒否: {str(e)}")
+        raise HTTPException(
+            status_code=503,
+            detail="サーバーが混雑しています。しばらくしてから再試行してください。",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    except Exception as e:
+        logger.error(f"{action}エラー: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"{action}に失敗しました: {str(e)}")
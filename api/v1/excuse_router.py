@@ -1,45 +1,121 @@
-from fastapi import APIRouter, HTTPException, Depends
-from models.request_models import ExcuseRequest, ExcuseResponse
+from fastapi import APIRouter, Depends
+from fastapi.responses import StreamingResponse
+from client.llm.fair_scheduler import Tenant
+from client.llm.generation_deadline import GenerationDeadline
+from api.v1.deadline import request_deadline
+from api.v1.errors import generation_errors
+from api.v1.sse import open_sse_stream
+from api.v1.readiness import require_model_ready, service_health
+from models.request_models import (
+    ExcuseAlternative,
+    ExcuseBatchItem,
+    ExcuseBatchRequest,
+    ExcuseBatchResponse,
+    ExcuseRequest,
+    ExcuseResponse
+)
 from service.excuse_generation.excuse_service import ExcuseService
+from typing import Iterator
 import logging
 
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/v1/excuse", tags=["excuse"])
 
 
-def get_excuse_service() -> ExcuseService:
-    return ExcuseService()
+def get_excuse_service(_: None = Depends(require_model_ready)) -> Iterator[ExcuseService]:
+    # モデル本体はレジストリで共有されるため、サービス生成は軽量
+    excuse_service = ExcuseService()
+    try:
+        yield excuse_service
+    finally:
+        excuse_service.close()
 
 
-@router.post("/generate", response_model=ExcuseResponse)
+@router.post("/generate", response_model=ExcuseResponse, response_model_exclude_none=True)
 async def generate_excuse(
     request: ExcuseRequest,
-    excuse_service: ExcuseService = Depends(get_excuse_service)
+    excuse_service: ExcuseService = Depends(get_excuse_service),
+    deadline: GenerationDeadline = Depends(request_deadline)
 ) -> ExcuseResponse:
-    try:
+    with generation_errors("言い訳の生成"):
         logger.info(f"質問を受信: {request.question}")
+        deadline.limit(request.timeout)
         
         excuse = await excuse_service.generate_excuse(
             question=request.question,
             max_length=request.max_length,
             temperature=request.temperature,
-            top_p=request.top_p
+            top_p=request.top_p,
+            use_cache=request.use_cache,
+            num_candidates=request.num_candidates,
+            deadline=deadline,
+            tenant=Tenant.of(request.userId, request.channel)
         )
         
         response = ExcuseResponse(
             question=request.question,
             excuse=excuse["text"],
-            confidence=excuse["confidence"]
+            confidence=excuse["confidence"],
+            partial=excuse.get("partial")
         )
+        if request.return_alternatives:
+            response.alternatives = [
+                ExcuseAlternative(excuse=alternative["text"], confidence=alternative["confidence"])
+                for alternative in excuse.get("alternatives", [])
+            ]
         
         logger.info(f"言い訳を生成: {excuse['text'][:50]}...")
         return response
+
+
+@router.post("/generate-batch", response_model=ExcuseBatchResponse, response_model_exclude_none=True)
+async def generate_excuses(
+    request: ExcuseBatchRequest,
+    excuse_service: ExcuseService = Depends(get_excuse_service),
+    deadline: GenerationDeadline = Depends(request_deadline)
+) -> ExcuseBatchResponse:
+    with generation_errors("言い訳のバッチ生成"):
+        logger.info(f"言い訳のバッチリクエストを受信: {len(request.items)} 件")
+        for timeout in [request.timeout] + [item.timeout for item in request.items]:
+            deadline.limit(timeout)
         
-    except Exception as e:
-        logger.error(f"言い訳生成エラー: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"言い訳の生成に失敗しました: {str(e)}")
+        excuses = await excuse_service.generate_excuses(request.items, deadline=deadline)
+        
+        results = [
+            ExcuseBatchItem(
+                question=item.question,
+                excuse=excuse["text"],
+                confidence=excuse["confidence"],
+                partial=excuse.get("partial"),
+                fallback=excuse.get("fallback", False)
+            )
+            for item, excuse in zip(request.items, excuses)
+        ]
+        
+        logger.info(f"言い訳をバッチ生成: {len(results)} 件 (フォールバック {sum(r.fallback for r in results)} 件)")
+        return ExcuseBatchResponse(results=results)
+
+
+@router.post("/generate/stream")
+async def stream_excuse(
+    request: ExcuseRequest,
+    excuse_service: ExcuseService = Depends(get_excuse_service),
+    deadline: GenerationDeadline = Depends(request_deadline)
+) -> StreamingResponse:
+    with generation_errors("言い訳生成の開始"):
+        logger.info(f"質問を受信 (ストリーミング): {request.question}")
+        deadline.limit(request.timeout)
+        
+        return await open_sse_stream(excuse_service.stream_excuse(
+            question=request.question,
+            max_length=request.max_length,
+            temperature=request.temperature,
+            top_p=request.top_p,
+            deadline=deadline,
+            tenant=Tenant.of(request.userId, request.channel)
+        ))
 
 
 @router.get("/health")
 async def health_check():
-    return {"status": "healthy", "service": "excuse_generation"}
\ No newline at end of file
+    return service_health("excuse_generation")
\ No newline at end of file
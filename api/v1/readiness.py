@@ -0,0 +1,31 @@
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+from service.readiness.readiness_service import ModelNotReadyError, get_readiness_service
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def require_model_ready():
+    """モデルのロードとウォームアップが終わるまでは、推論リクエストを待たせずに503で拒否する"""
+    try:
+        get_readiness_service().check_ready()
+    except ModelNotReadyError as e:
+        logger.info(f"モデル準備中のためリクエストを拒否: {e.state}")
+        raise HTTPException(
+            status_code=503,
+            detail="モデルを準備中です。しばらくしてから再試行してください。",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+
+
+def service_health(service: str):
+    """サービスのヘルスチェック（推論を受け付けられる状態でなければ503）"""
+    readiness = get_readiness_service()
+    if not readiness.is_ready:
+        return JSONResponse(
+            status_code=503,
+            content={"status": readiness.state, "service": service},
+            headers={"Retry-After": str(readiness.retry_after)}
+        )
+    return {"status": "healthy", "service": service}
@@ -1,44 +1,109 @@
-from fastapi import APIRouter, HTTPException, Depends
-from models.request_models import ReplyRequest, ReplyResponse
+from fastapi import APIRouter, Depends
+from fastapi.responses import StreamingResponse
+from client.llm.generation_deadline import GenerationDeadline
+from api.v1.deadline import request_deadline
+from api.v1.errors import generation_errors
+from api.v1.sse import open_sse_stream
+from api.v1.readiness import require_model_ready, service_health
+from models.request_models import (
+    ReplyAlternative,
+    ReplyBatchItem,
+    ReplyBatchRequest,
+    ReplyBatchResponse,
+    ReplyRequest,
+    ReplyResponse
+)
 from service.reply_generation.reply_service import ReplyService
+from typing import Iterator
 import logging
 
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/shatiku-ai", tags=["reply"])
 
 
-def get_reply_service() -> ReplyService:
-    return ReplyService()
+def get_reply_service(_: None = Depends(require_model_ready)) -> Iterator[ReplyService]:
+    # モデル本体はレジストリで共有されるため、サービス生成は軽量
+    reply_service = ReplyService()
+    try:
+        yield reply_service
+    finally:
+        reply_service.close()
 
 
-@router.post("/generate-reply", response_model=ReplyResponse)
+@router.post("/generate-reply", response_model=ReplyResponse, response_model_exclude_none=True)
 async def generate_reply(
     request: ReplyRequest,
-    reply_service: ReplyService = Depends(get_reply_service)
+    reply_service: ReplyService = Depends(get_reply_service),
+    deadline: GenerationDeadline = Depends(request_deadline)
 ) -> ReplyResponse:
-    try:
+    with generation_errors("自動返信の生成"):
         logger.info(f"自動返信リクエストを受信: ユーザー {request.settings.userId}, チャンネル {request.settings.channel}")
+        deadline.limit(request.timeout)
         
         result = await reply_service.generate_reply(
             request=request,
             max_length=512,
             temperature=0.7,
-            top_p=0.9
+            top_p=0.9,
+            use_cache=request.use_cache,
+            num_candidates=request.num_candidates,
+            deadline=deadline
         )
         
         response = ReplyResponse(
             reply=result["reply"],
-            replyAt=result["replyAt"]
+            replyAt=result["replyAt"],
+            partial=result.get("partial")
         )
+        if request.return_alternatives:
+            response.alternatives = [
+                ReplyAlternative(**alternative) for alternative in result.get("alternatives", [])
+            ]
         
         logger.info(f"自動返信を生成: {result['reply'][:50]}...")
         return response
+
+
+@router.post("/generate-replies", response_model=ReplyBatchResponse, response_model_exclude_none=True)
+async def generate_replies(
+    request: ReplyBatchRequest,
+    reply_service: ReplyService = Depends(get_reply_service),
+    deadline: GenerationDeadline = Depends(request_deadline)
+) -> ReplyBatchResponse:
+    with generation_errors("自動返信のバッチ生成"):
+        logger.info(f"自動返信のバッチリクエストを受信: {len(request.items)} 件")
+        for timeout in [request.timeout] + [item.timeout for item in request.items]:
+            deadline.limit(timeout)
+        
+        replies = await reply_service.generate_replies(request.items, deadline=deadline)
+        
+        results = [
+            ReplyBatchItem(
+                reply=reply["reply"],
+                replyAt=reply["replyAt"],
+                partial=reply.get("partial"),
+                fallback=reply.get("fallback", False)
+            )
+            for reply in replies
+        ]
+        
+        logger.info(f"自動返信をバッチ生成: {len(results)} 件 (フォールバック {sum(r.fallback for r in results)} 件)")
+        return ReplyBatchResponse(results=results)
+
+
+@router.post("/generate-reply/stream")
+async def stream_reply(
+    request: ReplyRequest,
+    reply_service: ReplyService = Depends(get_reply_service),
+    deadline: GenerationDeadline = Depends(request_deadline)
+) -> StreamingResponse:
+    with generation_errors("自動返信生成の開始"):
+        logger.info(f"自動返信ストリーミングリクエストを受信: ユーザー {request.settings.userId}, チャンネル {request.settings.channel}")
+        deadline.limit(request.timeout)
         
-    except Exception as e:
-        logger.error(f"自動返信生成エラー: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"自動返信の生成に失敗しました: {str(e)}")
+        return await open_sse_stream(reply_service.stream_reply(request, deadline=deadline))
 
 
 @router.get("/health")
 async def health_check():
-    return {"status": "healthy", "service": "reply_generation"}
\ No newline at end of file
+    return service_health("reply_generation")
\ No newline at end of file
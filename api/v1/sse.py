@@ -0,0 +1,37 @@
+import json
+from datetime import datetime
+from fastapi.responses import StreamingResponse
+from typing import Any, AsyncIterator, Dict
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no"
+}
+
+
+def _json_default(value: Any) -> str:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def format_sse(event: str, data: Dict[str, Any]) -> str:
+    """Server-Sent Eventsの1イベント分の文字列を作成"""
+    payload = json.dumps(data, ensure_ascii=False, default=_json_default)
+    return f"event: {event}\ndata: {payload}\n\n"
+
+
+async def open_sse_stream(events: AsyncIterator[Dict[str, Any]]) -> StreamingResponse:
+    """最初のイベントまで進めてからSSEレスポンスを返す
+
+    推論キューが満杯の場合などはレスポンス開始前に例外が送出されるため、
+    ルーター側で通常のエラーレスポンスに変換できる。
+    """
+    first_event = await events.__anext__()
+
+    async def body() -> AsyncIterator[str]:
+        yield format_sse(first_event["event"], first_event["data"])
+        async for event in events:
+            yield format_sse(event["event"], event["data"])
+
+    return StreamingResponse(body(), media_type="text/event-stream", headers=SSE_HEADERS)
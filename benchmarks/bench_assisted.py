@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+ドラフトモデルによる投機的デコード（assisted generation）のベンチマーク
+
+返信生成のワークロード（短く定型的な出力）を1件ずつ生成し、ドラフトモデルあり/なしで
+レイテンシ、tokens/sec、本体モデルのforward 1回あたりの生成トークン数を比較する。
+貪欲法では出力が一致することも確認する。
+
+    DRAFT_MODEL_NAME=<ドラフトモデル> python benchmarks/bench_assisted.py --runs 3
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+
+# プロジェクトのルートディレクトリを追加
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from client.llm.model_client import ModelClient
+from models.request_models import ReplyRequest, ReplySettings, ReplyMission, ReplyMessage
+from service.reply_generation.reply_service import ReplyService
+
+REPLY_SCENARIOS = [
+    ("やんわりと断る", "角が立たないように断る", "明日の飲み会に参加しませんか？"),
+    ("共感を示す", "相手の気持ちに寄り添う", "最近忙しくて疲れています"),
+    ("適切な距離を保つ", "プロフェッショナルな関係を維持", "今度一緒にランチしませんか？"),
+    ("やんわりと断る", "角を立てずにやんわり断ること", "今日、飲みに行かない？"),
+]
+
+
+def run_workload(client: ModelClient, prompts, max_new_tokens: int, do_sample: bool, assistant_model, runs: int):
+    forward_calls = 0
+
+    def count_forward(module, inputs, output):
+        nonlocal forward_calls
+        forward_calls += 1
+
+    hook = client.model.register_forward_hook(count_forward)
+    latencies, outputs = [], []
+    total_tokens = 0
+    try:
+        for _ in range(runs):
+            for prompt in prompts:
+                input_ids = client.tokenizer.encode(prompt, add_special_tokens=False)
+                generation_config = {
+                    "max_new_tokens": max_new_tokens,
+                    "do_sample": do_sample,
+                    "temperature": 0.8,
+                    "top_p": 0.9,
+                    "pad_token_id": client.tokenizer.pad_token_id,
+                    "eos_token_id": client.tokenizer.eos_token_id
+                }
+                start = time.perf_counter()
+                output_ids = client._generate_ids(
+                    input_ids,
+                    generation_config,
+                    constraints=ReplyService.GENERATION_CONSTRAINTS,
+                    assistant_model=assistant_model
+                )
+                latencies.append(time.perf_counter() - start)
+                total_tokens += output_ids.shape[1]
+                outputs.append(client.tokenizer.decode(output_ids[0], skip_special_tokens=True))
+    finally:
+        hook.remove()
+
+    return {
+        "mean_latency_ms": statistics.mean(latencies) * 1000,
+        "tokens_per_second": total_tokens / sum(latencies),
+        "tokens_per_forward": total_tokens / max(forward_calls, 1),
+        "outputs": outputs,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="投機的デコードのベンチマーク")
+    parser.add_argument("--max-new-tokens", type=int, default=80)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    client = ModelClient()
+    if client.draft_model is None:
+        print("ドラフトモデルがロードされていません。DRAFT_MODEL_NAME を設定してください。")
+        return
+
+    reply_service = ReplyService(model_client=client)
+    prompts = [
+        reply_service._create_reply_prompt(ReplyRequest(
+            settings=ReplySettings(userId="bench", channel="bench", replyTo="田中さん"),
+            mission=ReplyMission(instruction=instruction, goal=goal),
+            message=ReplyMessage(content=content, timestamp=datetime.now(timezone.utc))
+        ))
+        for instruction, goal, content in REPLY_SCENARIOS
+    ]
+    print(f"モデル: {client.model_name} / ドラフト: {client.draft_model_name} (提案トークン数: {client.draft_num_tokens})")
+
+    for do_sample in (False, True):
+        baseline = run_workload(client, prompts, args.max_new_tokens, do_sample, None, args.runs)
+        assisted = run_workload(client, prompts, args.max_new_tokens, do_sample, client.draft_model, args.runs)
+
+        print(f"\n=== 返信生成 ({'サンプリング' if do_sample else '貪欲法'}, {len(baseline['outputs'])} リクエスト) ===")
+        for name, result in (("通常デコード", baseline), ("投機的デコード", assisted)):
+            print(
+                f"{name}: 平均 {result['mean_latency_ms']:.0f}ms, {result['tokens_per_second']:.1f} tok/s, "
+                f"forward 1回あたり {result['tokens_per_forward']:.2f} トークン"
+            )
+        print(f"高速化率: {baseline['mean_latency_ms'] / assisted['mean_latency_ms']:.2f}x")
+        if not do_sample:
+            identical = sum(a == b for a, b in zip(baseline["outputs"], assisted["outputs"]))
+            print(f"出力の一致: {identical}/{len(baseline['outputs'])}")
+
+    client.unload()
+
+
+if __name__ == "__main__":
+    main()
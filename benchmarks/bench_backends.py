@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+推論バックエンド（INFERENCE_BACKEND）のレイテンシ比較ベンチマーク
+
+PyTorch / ONNX Runtime（fp32・int8）のバックエンドで同じプロンプトを貪欲法で生成し、
+prefill時間、1トークンあたりのデコード時間、生成全体のレイテンシと tokens/sec を比較する。
+貪欲法の出力が PyTorch fp32 と一致するかも表示する。
+
+    python benchmarks/bench_backends.py --runs 3 --output backends.json
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+
+# プロジェクトのルートディレクトリを追加
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from client.llm.inference_backend import create_backend
+from client.llm.precision import PRECISION_DTYPES
+from models.request_models import ReplyRequest, ReplySettings, ReplyMission, ReplyMessage
+from service.excuse_generation.excuse_service import ExcuseService
+from service.reply_generation.reply_service import ReplyService
+
+REPLY_SCENARIOS = [
+    ("やんわりと断る", "角が立たないように断る", "明日の飲み会に参加しませんか？"),
+    ("共感を示す", "相手の気持ちに寄り添う", "最近忙しくて疲れています"),
+]
+
+EXCUSE_QUESTIONS = [
+    "なぜ遅刻したのですか？",
+    "なぜ会議に参加しなかったのですか？",
+]
+
+
+def build_prompts():
+    # プロンプト作成だけを使うためモデルは取得しない
+    reply_service = ReplyService.__new__(ReplyService)
+    prompts = [
+        reply_service._create_reply_prompt(ReplyRequest(
+            settings=ReplySettings(userId="bench", channel="bench", replyTo="田中さん"),
+            mission=ReplyMission(instruction=instruction, goal=goal),
+            message=ReplyMessage(content=content, timestamp=datetime.now(timezone.utc))
+        ))
+        for instruction, goal, content in REPLY_SCENARIOS
+    ]
+    excuse_service = ExcuseService.__new__(ExcuseService)
+    return prompts + [excuse_service._create_excuse_prompt(question) for question in EXCUSE_QUESTIONS]
+
+
+def measure(backend, prompts, max_new_tokens: int, runs: int) -> dict:
+    prefill_times, decode_times, latencies, outputs = [], [], [], []
+    total_tokens = 0
+    for _ in range(runs):
+        outputs = []
+        for prompt in prompts:
+            input_ids = backend.tokenizer.encode(prompt, add_special_tokens=False)
+
+            start = time.perf_counter()
+            logits, past = backend.prefill(input_ids)
+            prefill_times.append(time.perf_counter() - start)
+
+            # デコードステップ単体の時間（生成内容に依存しないよう最頻トークンを入力し続ける）
+            token_id = int(logits.argmax())
+            start = time.perf_counter()
+            for _ in range(max_new_tokens):
+                logits, past = backend.decode_step(token_id, past)
+            decode_times.append((time.perf_counter() - start) / max_new_tokens)
+
+            start = time.perf_counter()
+            generated = backend.generate(input_ids, max_new_tokens, do_sample=False)[0]
+            latencies.append(time.perf_counter() - start)
+            total_tokens += len(generated)
+            outputs.append(generated)
+
+    return {
+        "prefill_ms": statistics.mean(prefill_times) * 1000,
+        "decode_ms_per_token": statistics.mean(decode_times) * 1000,
+        "mean_latency_ms": statistics.mean(latencies) * 1000,
+        "tokens_per_second": total_tokens / sum(latencies),
+        "outputs": outputs,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="推論バックエンドのベンチマーク")
+    parser.add_argument("--backends", nargs="+", default=["torch:fp32", "onnx:fp32", "onnx:int8"],
+                        help="バックエンド:精度 の組み合わせ")
+    parser.add_argument("--max-new-tokens", type=int, default=32)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--output", help="結果をJSONで保存するパス")
+    args = parser.parse_args()
+
+    model_name = os.getenv("MODEL_NAME", "microsoft/DialoGPT-medium")
+    model_path = os.getenv("MODEL_PATH", "./data/models")
+    prompts = build_prompts()
+
+    results = []
+    for spec in args.backends:
+        backend_name, precision = spec.split(":")
+        start = time.perf_counter()
+        backend = create_backend(backend_name, model_name, model_path, "cpu", PRECISION_DTYPES[precision], precision)
+        backend.load()
+        load_seconds = time.perf_counter() - start
+
+        # ウォームアップ
+        backend.generate(backend.tokenizer.encode(prompts[0], add_special_tokens=False), 4, do_sample=False)
+        result = measure(backend, prompts, args.max_new_tokens, args.runs)
+        results.append({"backend": spec, "load_seconds": load_seconds, **result})
+        backend.unload()
+
+    baseline = results[0]
+    print(f"\nモデル: {model_name} ({len(prompts)} プロンプト x {args.runs} 回, max_new_tokens={args.max_new_tokens})")
+    print(f"{'バックエンド':<12} {'ロード(s)':>9} {'prefill(ms)':>11} {'decode(ms/tok)':>14} {'生成(ms)':>9} {'tok/s':>8} {'出力一致':>8}")
+    for r in results:
+        identical = sum(a == b for a, b in zip(r["outputs"], baseline["outputs"]))
+        r["identical_outputs"] = identical
+        print(
+            f"{r['backend']:<12} {r['load_seconds']:>9.1f} {r['prefill_ms']:>11.1f} {r['decode_ms_per_token']:>14.2f} "
+            f"{r['mean_latency_ms']:>9.0f} {r['tokens_per_second']:>8.1f} {identical:>4}/{len(r['outputs'])}"
+        )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
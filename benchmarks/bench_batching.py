@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+連続バッチングのベンチマーク
+
+同時実行数ごとに、1件ずつの逐次生成と連続バッチングエンジンの tokens/sec を比較する。
+CPUでの計測を想定しており、MODEL_NAME / MODEL_PATH で対象モデルを指定する。
+
+    python benchmarks/bench_batching.py --concurrency 1 2 4 8 --max-new-tokens 32
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+# プロジェクトのルートディレクトリを追加
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from client.llm.model_client import ModelClient
+from client.llm.batching_engine import ContinuousBatchingEngine
+
+PROMPTS = [
+    "「明日の飲み会に参加しませんか？」という田中さんからのメッセージに対して、やんわりと断るという方針で返信してください。\n\n返信:",
+    "「最近忙しくて疲れています」という同僚からのメッセージに対して、共感を示すという方針で返信してください。\n\n返信:",
+    "質問: なぜ遅刻したのですか？\n\n以下は上記の質問に対する丁寧で説得力のある言い訳です:\n\n",
+    "質問: なぜ会議に参加しなかったのですか？\n\n以下は上記の質問に対する丁寧で説得力のある言い訳です:\n\n",
+]
+
+
+async def run_sequential(client: ModelClient, concurrency: int, max_new_tokens: int) -> int:
+    """エンジンを使わずに1件ずつ model.generate() で生成"""
+    total_tokens = 0
+    for i in range(concurrency):
+        result = await client.generate_text(
+            PROMPTS[i % len(PROMPTS)],
+            max_new_tokens=max_new_tokens,
+            do_sample=True,
+            temperature=0.8,
+            top_p=0.9,
+            endpoint="bench"
+        )
+        total_tokens += result["generated_tokens"]
+    return total_tokens
+
+
+async def run_batched(engine: ContinuousBatchingEngine, client: ModelClient, concurrency: int, max_new_tokens: int) -> int:
+    """同時リクエストを連続バッチングエンジンに投入"""
+    results = await asyncio.gather(*[
+        engine.generate(
+            client.tokenizer.encode(PROMPTS[i % len(PROMPTS)]),
+            max_new_tokens=max_new_tokens,
+            temperature=0.8,
+            top_p=0.9
+        )
+        for i in range(concurrency)
+    ])
+    return sum(result["generated_tokens"] for result in results)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="連続バッチングのベンチマーク")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--max-new-tokens", type=int, default=32)
+    parser.add_argument("--max-batch-size", type=int, default=8)
+    args = parser.parse_args()
+
+    os.environ["INFERENCE_BATCHING"] = "false"
+    client = ModelClient()
+    engine = ContinuousBatchingEngine(client.model, client.tokenizer, max_batch_size=args.max_batch_size)
+    engine.start()
+
+    print(f"モデル: {client.model_name} (デバイス: {client.device}, スレッド数: {os.cpu_count()})")
+    print(f"{'同時実行数':>10} | {'逐次 tok/s':>12} | {'連続バッチ tok/s':>16} | {'倍率':>6}")
+    print("-" * 56)
+
+    try:
+        for concurrency in args.concurrency:
+            start = time.perf_counter()
+            sequential_tokens = await run_sequential(client, concurrency, args.max_new_tokens)
+            sequential_tps = sequential_tokens / (time.perf_counter() - start)
+
+            start = time.perf_counter()
+            batched_tokens = await run_batched(engine, client, concurrency, args.max_new_tokens)
+            batched_tps = batched_tokens / (time.perf_counter() - start)
+
+            print(f"{concurrency:>10} | {sequential_tps:>12.1f} | {batched_tps:>16.1f} | {batched_tps / sequential_tps:>5.2f}x")
+    finally:
+        engine.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+best-of-n 生成のベンチマーク
+
+同じプロンプトから n 個の候補を得る場合に、1回のバッチデコード（num_return_sequences、
+prefillは1回だけ）と n 回の逐次呼び出しのレイテンシを比較する。
+
+    python benchmarks/bench_best_of_n.py --candidates 4 --runs 5
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+# プロジェクトのルートディレクトリを追加
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from client.llm.model_client import ModelClient
+from config.llm.prompt_templates import EXCUSE_PROMPT_PREFIX
+from service.excuse_generation.excuse_service import ExcuseService
+
+QUESTIONS = [
+    "なぜ遅刻したのですか？",
+    "なぜ宿題を忘れたのですか？",
+    "なぜ会議に参加しなかったのですか？",
+]
+
+
+async def best_of_n(client: ModelClient, prompt: str, candidates: int, max_new_tokens: int):
+    result = await client.generate_text(
+        prompt,
+        max_new_tokens=max_new_tokens,
+        num_return_sequences=candidates,
+        constraints=ExcuseService.GENERATION_CONSTRAINTS,
+        prefix=EXCUSE_PROMPT_PREFIX
+    )
+    return result["generated_texts"]
+
+
+async def sequential(client: ModelClient, prompt: str, candidates: int, max_new_tokens: int):
+    texts = []
+    for _ in range(candidates):
+        result = await client.generate_text(
+            prompt,
+            max_new_tokens=max_new_tokens,
+            constraints=ExcuseService.GENERATION_CONSTRAINTS,
+            prefix=EXCUSE_PROMPT_PREFIX
+        )
+        texts.append(result["generated_text"])
+    return texts
+
+
+async def measure(fn, client, prompts, candidates, max_new_tokens, runs):
+    latencies = []
+    for _ in range(runs):
+        for prompt in prompts:
+            start = time.perf_counter()
+            texts = await fn(client, prompt, candidates, max_new_tokens)
+            latencies.append(time.perf_counter() - start)
+            assert len(texts) == candidates
+    return latencies
+
+
+async def run(args):
+    client = ModelClient()
+    service = ExcuseService(model_client=client)
+    prompts = [service._create_excuse_prompt(question) for question in QUESTIONS]
+    print(f"モデル: {client.model_name} (デバイス: {client.device}, 連続バッチング: {client.engine is not None})")
+
+    # ウォームアップ（プレフィックスのKVキャッシュ作成を含む）
+    await best_of_n(client, prompts[0], args.candidates, 8)
+    await sequential(client, prompts[0], 1, 8)
+
+    batched = await measure(best_of_n, client, prompts, args.candidates, args.max_new_tokens, args.runs)
+    looped = await measure(sequential, client, prompts, args.candidates, args.max_new_tokens, args.runs)
+
+    print(f"\n=== best-of-{args.candidates} ({len(batched)} リクエスト, max_new_tokens={args.max_new_tokens}) ===")
+    for name, latencies in (("バッチデコード", batched), (f"{args.candidates}回の逐次呼び出し", looped)):
+        print(
+            f"{name}: 平均 {statistics.mean(latencies) * 1000:.0f}ms, "
+            f"中央値 {statistics.median(latencies) * 1000:.0f}ms"
+        )
+    print(f"高速化率: {statistics.mean(looped) / statistics.mean(batched):.2f}x")
+
+    client.unload()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="best-of-n 生成のベンチマーク")
+    parser.add_argument("--candidates", type=int, default=4)
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--runs", type=int, default=3)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
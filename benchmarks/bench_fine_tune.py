@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+ファインチューニングの学習経路のベンチマーク
+
+従来の経路（全例を max_length までパディング、fp32、長さによるグループ化・勾配チェックポイントなし）と
+CPU向けの経路（バッチごとの動的パディング、長さの近い例のグループ化、bf16/fp32 の autocast、勾配チェックポイント）を
+別プロセスで同じステップ数だけ学習し、tokens/sec（パディングを除く）、パディングの割合、ピークRSSを表にする。
+従来の経路の fp16 はGPUが必要なため、CPUでは fp32 で比較する。
+
+    python benchmarks/bench_fine_tune.py --model ./data/models/base --max-steps 20 --threads 4
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+# プロジェクトのルートディレクトリを追加
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+MODES = {
+    "current": {
+        "dynamic_padding": False,
+        "group_by_length": False,
+        "precision": "fp32",
+        "gradient_checkpointing": False
+    },
+    "cpu": {
+        "dynamic_padding": True,
+        "group_by_length": True,
+        "precision": "auto",
+        "gradient_checkpointing": True
+    },
+}
+
+
+def run_worker(mode: str, args: argparse.Namespace) -> dict:
+    """1つの学習経路を計測して結果を返す（ピークRSSを分離するため子プロセスで実行される）"""
+    from config.llm.fine_tune_config import DatasetConfig, FineTuneConfig
+    from scripts.fine_tuning.fine_tune import ExcuseFineTuner
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        config = FineTuneConfig(
+            model_name=args.model,
+            dataset_path=args.dataset,
+            output_dir=output_dir,
+            logging_dir=os.path.join(output_dir, "logs"),
+            per_device_train_batch_size=args.batch_size,
+            max_steps=args.max_steps,
+            warmup_steps=0,
+            evaluation_strategy="no",
+            save_steps=args.max_steps + 1,
+            dataloader_num_workers=0,
+            num_threads=args.threads,
+            **MODES[mode]
+        )
+        fine_tuner = ExcuseFineTuner(config)
+        fine_tuner.setup_model_and_tokenizer()
+        fine_tuner.prepare_dataset(DatasetConfig())
+        report = fine_tuner.train()
+    return {"mode": mode, **report}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ファインチューニングの学習経路のベンチマーク")
+    parser.add_argument("--model", default="microsoft/DialoGPT-medium")
+    parser.add_argument("--dataset", default="./data/training/excuses.jsonl")
+    parser.add_argument("--modes", nargs="+", choices=list(MODES), default=list(MODES))
+    parser.add_argument("--max-steps", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=0, help="PyTorchのスレッド数（0 なら変更しない）")
+    parser.add_argument("--output", help="結果をJSONで保存するパス")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(args.worker, args), ensure_ascii=False))
+        return
+
+    results = []
+    for mode in args.modes:
+        completed = subprocess.run(
+            [
+                sys.executable, os.path.abspath(__file__), "--worker", mode,
+                "--model", args.model, "--dataset", args.dataset, "--max-steps", str(args.max_steps),
+                "--batch-size", str(args.batch_size), "--threads", str(args.threads)
+            ],
+            capture_output=True,
+            text=True,
+            check=True
+        )
+        results.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+
+    baseline = next((r for r in results if r["mode"] == "current"), results[0])
+    print(f"\n{'経路':<8} {'精度':<6} {'スレッド':>8} {'ステップ':>8} {'学習(s)':>8} {'tok/s':>9} {'パディング':>10} {'ピークRSS(MB)':>13} {'速度比':>7}")
+    for r in results:
+        r["speedup"] = r["tokens_per_second"] / baseline["tokens_per_second"] if baseline["tokens_per_second"] else 0.0
+        print(
+            f"{r['mode']:<8} {r['precision']:<6} {r['num_threads']:>8} {r['steps']:>8} {r['train_seconds']:>8.1f} "
+            f"{r['tokens_per_second']:>9.1f} {r['padding_ratio']:>10.1%} {r['peak_rss_mb']:>13.0f} {r['speedup']:>6.2f}x"
+        )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+生成経路のオーバーヘッドのベンチマーク
+
+以前の経路（ログ用にトークン化した後、text-generation パイプラインが同じプロンプトを再度トークン化し、
+独自の前処理・後処理と return_full_text の切り出しを行う）と、現在の generate_text の経路
+（一度だけトークン化したIDで model.generate() を直接呼び出し、新たに生成したIDだけをデコードする）を、
+スタブモデルで同じトークン数を生成して比べる。model.generate() の直接呼び出しを下限として併記する。
+
+    python benchmarks/bench_generation_path.py --tokens 1 16 --output generation_path.json
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+
+# スタブモデルはローカルのファイルだけでロードする（transformersのインポート前に設定する）
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+# 連続バッチングエンジンを通さず、単一リクエストの生成経路だけを比べる
+os.environ["INFERENCE_BATCHING"] = "false"
+
+# プロジェクトのルートディレクトリを追加
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.micro.harness import format_seconds, run_benchmark, save_results
+from benchmarks.micro.stub_model import DEFAULT_STUB_DIR, STUB_CONFIG, use_stub_model
+
+
+def build_cases(client, prompt: str, tokens: int, loop):
+    import torch
+    from transformers import pipeline
+
+    text_generation = pipeline("text-generation", model=client.model, tokenizer=client.tokenizer)
+    input_tensor = torch.tensor([client._encode_prompt(prompt)], device=client.model.device)
+
+    def pipeline_path():
+        # 以前の generate_text と同じく、トークン数の確認とパイプラインの内部で2回トークン化する
+        client.tokenizer.encode(prompt, add_special_tokens=False)
+        return text_generation(
+            prompt,
+            max_new_tokens=tokens,
+            do_sample=False,
+            pad_token_id=client.tokenizer.pad_token_id,
+            eos_token_id=client.tokenizer.eos_token_id,
+            return_full_text=False
+        )[0]["generated_text"]
+
+    def direct_path():
+        return loop.run_until_complete(client.generate_text(
+            prompt,
+            max_new_tokens=tokens,
+            do_sample=False,
+            endpoint="bench"
+        ))["generated_text"]
+
+    @torch.inference_mode()
+    def raw_generate():
+        return client.model.generate(
+            input_tensor,
+            attention_mask=torch.ones_like(input_tensor),
+            max_new_tokens=tokens,
+            do_sample=False,
+            pad_token_id=client.tokenizer.pad_token_id,
+            eos_token_id=client.tokenizer.eos_token_id
+        )
+
+    # 貪欲法なので、どの経路も同じテキストを生成していることを確認してから計測する
+    if pipeline_path() != direct_path():
+        raise RuntimeError("パイプラインと直接生成の出力が一致しません")
+
+    return [
+        (f"generation_path/pipeline_{tokens}tokens", pipeline_path),
+        (f"generation_path/direct_{tokens}tokens", direct_path),
+        (f"generation_path/raw_generate_{tokens}tokens", raw_generate),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="パイプライン経由と model.generate() 直接呼び出しの生成オーバーヘッドの比較")
+    parser.add_argument("--tokens", type=int, nargs="+", default=[1, 16], help="生成するトークン数")
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--stub-dir", default=DEFAULT_STUB_DIR, help="スタブモデルの保存先（作成済みなら再利用する）")
+    parser.add_argument("--output", help="結果をJSONで保存するパス")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level)
+    model_dir = use_stub_model(args.stub_dir)
+    print(f"スタブモデル: {model_dir} ({STUB_CONFIG})")
+
+    from client.llm.model_client import ModelClient
+    from service.reply_generation.reply_service import ReplyService
+    from benchmarks.micro.cases import REPLY_REQUEST
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    client = ModelClient()
+    prefix, suffix = ReplyService(model_client=client)._create_reply_prompt_parts(REPLY_REQUEST)
+    prompt = prefix + suffix
+    print(f"プロンプト: {len(client._encode_prompt(prompt))} トークン")
+
+    benchmarks = []
+    for tokens in args.tokens:
+        for name, fn in build_cases(client, prompt, tokens, loop):
+            benchmarks.append(run_benchmark(name, "generation_path", fn, rounds=args.rounds))
+    client.unload()
+
+    medians = {bench["name"]: bench["stats"]["median"] for bench in benchmarks}
+    print(f"\n{'生成トークン数':>14} {'パイプライン':>12} {'直接生成':>12} {'model.generate':>15} {'削減':>12} {'残り':>12}")
+    print("-" * 84)
+    summary = {}
+    for tokens in args.tokens:
+        pipeline_median = medians[f"generation_path/pipeline_{tokens}tokens"]
+        direct_median = medians[f"generation_path/direct_{tokens}tokens"]
+        raw_median = medians[f"generation_path/raw_generate_{tokens}tokens"]
+        summary[tokens] = {
+            "removed_overhead": pipeline_median - direct_median,
+            "remaining_overhead": direct_median - raw_median
+        }
+        print(
+            f"{tokens:>14} {format_seconds(pipeline_median):>12} {format_seconds(direct_median):>12} "
+            f"{format_seconds(raw_median):>15} {format_seconds(pipeline_median - direct_median):>12} "
+            f"{format_seconds(direct_median - raw_median):>12}"
+        )
+    print("\n削減: パイプライン経由からリクエストあたり削減された時間 / 残り: model.generate() の直接呼び出しとの差")
+
+    if args.output:
+        save_results(args.output, benchmarks, extra={"stub_model": STUB_CONFIG, "overhead": summary})
+        print(f"\n結果を保存: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
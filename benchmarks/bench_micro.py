@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+オフラインのマイクロベンチマーク
+
+実モデルの代わりにランダム初期化した小さなGPT-2形式のスタブモデル（benchmarks/micro/stub_model.py）を
+ローカルに作成し、ネットワークなしでホットパスの処理時間を計測する。CIでの性能回帰の検出を想定している。
+
+- prompt: 返信・言い訳のプロンプト作成
+- tokenization: プロンプトのトークン化
+- generate: generate_text と model.generate() の直接呼び出しの比較（オーバーヘッド）
+- postprocess: _format_reply / _format_excuse / _calculate_confidence
+- e2e: インプロセスのFastAPIクライアントでのリクエストのレイテンシ
+
+    python benchmarks/bench_micro.py --output micro.json
+    python benchmarks/bench_micro.py --compare micro.json --max-regression 1.5
+"""
+import argparse
+import asyncio
+import atexit
+import logging
+import os
+import shutil
+import sys
+import tempfile
+
+from dotenv import load_dotenv
+
+# スタブモデルはローカルのファイルだけでロードする（transformersのインポート前に設定する）
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+
+# キャッシュの保存先は一時ディレクトリに差し替え、.env の設定のままリポジトリ内に書き込まないようにする
+# （キャッシュのモジュールが読み込まれる前に .env を読み込んでおき、保存先だけを上書きする）
+load_dotenv()
+CACHE_DIR = tempfile.mkdtemp(prefix="shachiku_bench_cache_")
+atexit.register(shutil.rmtree, CACHE_DIR, True)
+os.environ["SEMANTIC_CACHE_PATH"] = os.path.join(CACHE_DIR, "semantic_cache.npz")
+if os.getenv("RESPONSE_CACHE_SQLITE_PATH"):
+    os.environ["RESPONSE_CACHE_SQLITE_PATH"] = os.path.join(CACHE_DIR, "responses.sqlite3")
+
+# プロジェクトのルートディレクトリを追加
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.micro.harness import compare_results, format_seconds, load_results, run_benchmark, save_results
+from benchmarks.micro.stub_model import DEFAULT_STUB_DIR, STUB_CONFIG, use_stub_model
+
+GROUPS = ("prompt", "tokenization", "generate", "postprocess", "e2e")
+
+# 計測結果に記録する、ホットパスの挙動を変える設定
+RECORDED_ENV = (
+    "INFERENCE_BATCHING",
+    "PREFIX_CACHE_ENABLED",
+    "RESPONSE_CACHE_ENABLED",
+    "SEMANTIC_CACHE_ENABLED",
+    "MODEL_PRECISION",
+)
+
+
+def collect_cases(groups, loop):
+    # 環境変数（MODEL_NAME等）を設定してからモデルを使うモジュールを読み込む
+    from client.llm.model_client import ModelClient
+    from service.excuse_generation.excuse_service import ExcuseService
+    from service.reply_generation.reply_service import ReplyService
+    from benchmarks.micro import cases
+
+    client = ModelClient()
+    reply_service = ReplyService(model_client=client)
+    excuse_service = ExcuseService(model_client=client)
+
+    selected = []
+    if "prompt" in groups:
+        selected += cases.prompt_cases(reply_service, excuse_service)
+    if "tokenization" in groups:
+        selected += cases.tokenization_cases(client, reply_service, excuse_service)
+    if "generate" in groups:
+        selected += cases.generate_cases(client, reply_service, loop)
+    if "postprocess" in groups:
+        selected += cases.postprocess_cases(reply_service, excuse_service)
+    return client, selected
+
+
+def print_results(benchmarks):
+    print(f"{'ベンチマーク':<44} {'中央値':>11} {'平均':>11} {'標準偏差':>11} {'ops':>10}")
+    print("-" * 92)
+    for bench in benchmarks:
+        stats = bench["stats"]
+        print(
+            f"{bench['name']:<44} {format_seconds(stats['median']):>11} {format_seconds(stats['mean']):>11} "
+            f"{format_seconds(stats['stddev']):>11} {stats['ops']:>10.1f}"
+        )
+
+
+def generate_overhead(benchmarks) -> dict:
+    """generate_text と model.generate() の中央値の差（generate_text 側の追加コスト）"""
+    medians = {bench["name"]: bench["stats"]["median"] for bench in benchmarks}
+    overhead = {}
+    for tokens in ("1token", "16tokens"):
+        wrapped, raw = medians.get(f"generate/generate_text_{tokens}"), medians.get(f"generate/raw_generate_{tokens}")
+        if wrapped is not None and raw is not None:
+            overhead[tokens] = wrapped - raw
+    return overhead
+
+
+def main():
+    parser = argparse.ArgumentParser(description="スタブモデルを使ったオフラインのマイクロベンチマーク")
+    parser.add_argument("--groups", nargs="+", choices=GROUPS, default=list(GROUPS))
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--e2e-rounds", type=int, default=10)
+    parser.add_argument("--stub-dir", default=DEFAULT_STUB_DIR, help="スタブモデルの保存先（作成済みなら再利用する）")
+    parser.add_argument("--output", help="結果をJSONで保存するパス")
+    parser.add_argument("--compare", help="比較対象の結果JSON（別コミットで --output したもの）")
+    parser.add_argument("--max-regression", type=float, help="中央値がこの倍率を超えて遅くなったら終了コード1で終了する")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level)
+    model_dir = use_stub_model(args.stub_dir)
+    print(f"スタブモデル: {model_dir} ({STUB_CONFIG})")
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    client, selected = collect_cases(args.groups, loop)
+
+    benchmarks = []
+    for case in selected:
+        benchmarks.append(run_benchmark(case.name, case.group, case.fn, rounds=args.rounds))
+    client.unload()
+
+    if "e2e" in args.groups:
+        # 計測用のモデルとは別に、APIのライフサイクル（バックグラウンドロード・ウォームアップ）どおりにロードする
+        from fastapi.testclient import TestClient
+        from benchmarks.micro.cases import e2e_cases
+        import main as api
+
+        with TestClient(api.app) as test_client:
+            for case in e2e_cases(test_client):
+                benchmarks.append(run_benchmark(case.name, case.group, case.fn, rounds=args.e2e_rounds))
+
+    print_results(benchmarks)
+    overhead = generate_overhead(benchmarks)
+    for tokens, seconds in overhead.items():
+        print(f"generate_text のオーバーヘッド ({tokens}): {format_seconds(seconds)}")
+
+    if args.output:
+        save_results(args.output, benchmarks, extra={
+            "stub_model": STUB_CONFIG,
+            "env": {name: os.getenv(name) for name in RECORDED_ENV},
+            "generate_text_overhead": overhead
+        })
+        print(f"\n結果を保存: {args.output}")
+
+    if args.compare:
+        comparisons = compare_results(load_results(args.compare), benchmarks)
+        print(f"\n=== {args.compare} との比較（中央値） ===")
+        regressions = []
+        for item in comparisons:
+            flag = ""
+            if args.max_regression and item["ratio"] is not None and item["ratio"] > args.max_regression:
+                flag = "  ← 悪化"
+                regressions.append(item["name"])
+            print(
+                f"{item['name']:<44} {format_seconds(item['before']):>11} -> {format_seconds(item['after']):>11} "
+                f"({item['ratio']:.2f}x){flag}"
+            )
+        if regressions:
+            print(f"\n{len(regressions)} 件のベンチマークが {args.max_regression}x を超えて遅くなりました")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+推論精度モード（MODEL_PRECISION）のベンチマーク
+
+fp32 / bf16 / int8 ごとに別プロセスでモデルをロードし、固定のプロンプト集合を貪欲法で生成して
+レイテンシ、tokens/sec、常駐メモリ(RSS)と、既存の _calculate_confidence による品質スコアの
+fp32 からの差分を表にする。
+
+    python benchmarks/bench_precision.py --precisions fp32 bf16 int8
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+# プロジェクトのルートディレクトリを追加
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+REPLY_SCENARIOS = [
+    ("やんわりと断る", "角が立たないように断る", "明日の飲み会に参加しませんか？"),
+    ("共感を示す", "相手の気持ちに寄り添う", "最近忙しくて疲れています"),
+    ("適切な距離を保つ", "プロフェッショナルな関係を維持", "今度一緒にランチしませんか？"),
+]
+
+EXCUSE_QUESTIONS = [
+    "なぜ遅刻したのですか？",
+    "なぜ宿題を忘れたのですか？",
+    "なぜ会議に参加しなかったのですか？",
+]
+
+
+def read_rss_mb() -> float:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def run_worker(precision: str, max_new_tokens: int) -> dict:
+    """1つの精度モードを計測して結果を返す（RSSを分離するため子プロセスで実行される）"""
+    import torch
+
+    from client.llm.model_client import ModelClient
+    from models.request_models import ReplyRequest, ReplySettings, ReplyMission, ReplyMessage
+    from service.excuse_generation.excuse_service import ExcuseService
+    from service.reply_generation.reply_service import ReplyService
+
+    rss_before = read_rss_mb()
+    start = time.perf_counter()
+    client = ModelClient(precision=precision)
+    load_seconds = time.perf_counter() - start
+    rss_loaded = read_rss_mb()
+
+    reply_service = ReplyService(model_client=client)
+    excuse_service = ExcuseService(model_client=client)
+    workloads = [
+        (
+            reply_service._create_reply_prompt(ReplyRequest(
+                settings=ReplySettings(userId="bench", channel="bench", replyTo="田中さん"),
+                mission=ReplyMission(instruction=instruction, goal=goal),
+                message=ReplyMessage(content=content, timestamp=datetime.now(timezone.utc))
+            )),
+            reply_service._format_reply,
+            reply_service._calculate_confidence
+        )
+        for instruction, goal, content in REPLY_SCENARIOS
+    ] + [
+        (excuse_service._create_excuse_prompt(question), excuse_service._format_excuse, excuse_service._calculate_confidence)
+        for question in EXCUSE_QUESTIONS
+    ]
+
+    latencies, outputs, confidences = [], [], []
+    total_tokens = 0
+    for prompt, formatter, scorer in workloads:
+        input_ids = client.tokenizer.encode(prompt, add_special_tokens=False)
+        generation_config = {
+            "max_new_tokens": max_new_tokens,
+            "do_sample": False,
+            "pad_token_id": client.tokenizer.pad_token_id,
+            "eos_token_id": client.tokenizer.eos_token_id
+        }
+        start = time.perf_counter()
+        output_ids = client._generate_ids(input_ids, generation_config)
+        latencies.append(time.perf_counter() - start)
+        total_tokens += output_ids.shape[1]
+
+        text = formatter(client.tokenizer.decode(output_ids[0], skip_special_tokens=True))
+        outputs.append(text)
+        confidences.append(scorer(text))
+
+    return {
+        "precision": precision,
+        "torch_threads": torch.get_num_threads(),
+        "load_seconds": load_seconds,
+        "rss_model_mb": rss_loaded - rss_before,
+        "rss_peak_mb": read_rss_mb(),
+        "mean_latency_ms": statistics.mean(latencies) * 1000,
+        "tokens_per_second": total_tokens / sum(latencies),
+        "mean_confidence": statistics.mean(confidences),
+        "outputs": outputs,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="推論精度モードのベンチマーク")
+    parser.add_argument("--precisions", nargs="+", default=["fp32", "bf16", "int8"])
+    parser.add_argument("--max-new-tokens", type=int, default=48)
+    parser.add_argument("--output", help="結果をJSONで保存するパス")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(args.worker, args.max_new_tokens), ensure_ascii=False))
+        return
+
+    results = []
+    for precision in args.precisions:
+        completed = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--worker", precision, "--max-new-tokens", str(args.max_new_tokens)],
+            env={**os.environ, "INFERENCE_BATCHING": "false"},
+            capture_output=True,
+            text=True,
+            check=True
+        )
+        results.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+
+    baseline = next((r for r in results if r["precision"] == "fp32"), results[0])
+    print(f"\n{'精度':<6} {'ロード(s)':>9} {'RSS(MB)':>9} {'レイテンシ(ms)':>14} {'tok/s':>8} {'信頼度':>7} {'差分':>7} {'出力一致':>8}")
+    for r in results:
+        identical = sum(a == b for a, b in zip(r["outputs"], baseline["outputs"]))
+        r["confidence_delta"] = r["mean_confidence"] - baseline["mean_confidence"]
+        r["identical_outputs"] = identical
+        print(
+            f"{r['precision']:<6} {r['load_seconds']:>9.1f} {r['rss_model_mb']:>9.0f} {r['mean_latency_ms']:>14.0f} "
+            f"{r['tokens_per_second']:>8.1f} {r['mean_confidence']:>7.3f} {r['confidence_delta']:>+7.3f} "
+            f"{identical:>4}/{len(r['outputs'])}"
+        )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
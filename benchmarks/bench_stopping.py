@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+停止条件（GenerationConstraints）のベンチマーク
+
+固定のプロンプト集合を貪欲法で生成し、停止条件あり/なしで生成トークン数・レイテンシと
+後処理（_format_reply / _format_excuse）後の結果が一致するかを比較する。
+
+    python benchmarks/bench_stopping.py
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+# プロジェクトのルートディレクトリを追加
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import torch
+
+from client.llm.model_client import ModelClient
+from models.request_models import ReplyRequest, ReplySettings, ReplyMission, ReplyMessage
+from service.excuse_generation.excuse_service import ExcuseService
+from service.reply_generation.reply_service import ReplyService
+
+REPLY_SCENARIOS = [
+    ("やんわりと断る", "角が立たないように断る", "明日の飲み会に参加しませんか？"),
+    ("共感を示す", "相手の気持ちに寄り添う", "最近忙しくて疲れています"),
+    ("適切な距離を保つ", "プロフェッショナルな関係を維持", "今度一緒にランチしませんか？"),
+    ("相手の意見に共感しつつ距離を取る返信を作ってください。", "角を立てずにやんわり断ること", "今日、飲みに行かない？"),
+]
+
+EXCUSE_QUESTIONS = [
+    "なぜ遅刻したのですか？",
+    "なぜ宿題を忘れたのですか？",
+    "なぜ会議に参加しなかったのですか？",
+    "なぜ約束を破ったのですか？",
+]
+
+
+def generate(client: ModelClient, prompt: str, max_new_tokens: int, constraints=None):
+    input_ids = client.tokenizer.encode(prompt, add_special_tokens=False)
+    input_tensor = torch.tensor([input_ids], device=client.model.device)
+
+    start = time.perf_counter()
+    with torch.inference_mode():
+        output = client.model.generate(
+            input_tensor,
+            attention_mask=torch.ones_like(input_tensor),
+            max_new_tokens=max_new_tokens,
+            do_sample=False,
+            pad_token_id=client.tokenizer.pad_token_id,
+            eos_token_id=client.tokenizer.eos_token_id,
+            **client._constraint_kwargs(constraints, len(input_ids))
+        )
+    elapsed = time.perf_counter() - start
+
+    new_ids = output[0, len(input_ids):]
+    return client.tokenizer.decode(new_ids, skip_special_tokens=True), len(new_ids), elapsed
+
+
+def run_workload(name, client, prompts, formatter, constraints, max_new_tokens):
+    baseline_tokens = constrained_tokens = 0
+    baseline_time = constrained_time = 0.0
+    identical = 0
+
+    for prompt in prompts:
+        text, tokens, elapsed = generate(client, prompt, max_new_tokens)
+        baseline_tokens += tokens
+        baseline_time += elapsed
+
+        constrained_text, tokens, elapsed = generate(client, prompt, max_new_tokens, constraints)
+        constrained_tokens += tokens
+        constrained_time += elapsed
+
+        identical += formatter(text) == formatter(constrained_text)
+
+    count = len(prompts)
+    print(f"\n=== {name} ({count} リクエスト, max_new_tokens={max_new_tokens}) ===")
+    print(f"平均生成トークン数: {baseline_tokens / count:.1f} -> {constrained_tokens / count:.1f}")
+    print(f"リクエストあたりの削減トークン数: {(baseline_tokens - constrained_tokens) / count:.1f}")
+    print(f"平均レイテンシ: {baseline_time / count * 1000:.0f}ms -> {constrained_time / count * 1000:.0f}ms")
+    print(f"後処理結果の一致: {identical}/{count}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="停止条件のベンチマーク")
+    parser.add_argument("--reply-max-new-tokens", type=int, default=80)
+    parser.add_argument("--excuse-max-new-tokens", type=int, default=256)
+    args = parser.parse_args()
+
+    client = ModelClient()
+    reply_service = ReplyService(model_client=client)
+    excuse_service = ExcuseService(model_client=client)
+    print(f"モデル: {client.model_name} (デバイス: {client.device})")
+
+    reply_prompts = [
+        reply_service._create_reply_prompt(ReplyRequest(
+            settings=ReplySettings(userId="bench", channel="bench", replyTo="田中さん"),
+            mission=ReplyMission(instruction=instruction, goal=goal),
+            message=ReplyMessage(content=content, timestamp=datetime.now(timezone.utc))
+        ))
+        for instruction, goal, content in REPLY_SCENARIOS
+    ]
+    excuse_prompts = [excuse_service._create_excuse_prompt(question) for question in EXCUSE_QUESTIONS]
+
+    run_workload(
+        "返信生成", client, reply_prompts, reply_service._format_reply,
+        ReplyService.GENERATION_CONSTRAINTS, args.reply_max_new_tokens
+    )
+    run_workload(
+        "言い訳生成", client, excuse_prompts, excuse_service._format_excuse,
+        ExcuseService.GENERATION_CONSTRAINTS, args.excuse_max_new_tokens
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""
+マイクロベンチマークのケース
+
+各ケースは (名前, グループ, 計測する関数) で、グループは
+prompt / tokenization / generate / postprocess / e2e。モデルを使うケースはスタブモデルで計測する。
+"""
+import asyncio
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, List, NamedTuple
+
+import torch
+
+from client.llm.model_client import ModelClient
+from models.request_models import ReplyRequest, ReplySettings, ReplyMission, ReplyMessage
+from service.excuse_generation.excuse_service import ExcuseService
+from service.reply_generation.reply_service import ReplyService
+
+REPLY_REQUEST = ReplyRequest(
+    settings=ReplySettings(userId="bench", channel="bench", replyTo="田中さん"),
+    mission=ReplyMission(instruction="やんわりと断る", goal="角が立たないように断る"),
+    message=ReplyMessage(content="明日の飲み会に参加しませんか？", timestamp=datetime(2025, 8, 5, tzinfo=timezone.utc)),
+    use_cache=False
+)
+EXCUSE_QUESTION = "なぜ遅刻したのですか？"
+
+# 整形・信頼度計算の入力に使う生成テキスト（実モデルの出力に近い形）
+GENERATED_REPLIES = [
+    "お誘いいただきありがとうございます。あいにく明日は先約があり、参加が難しいです。また別の機会にぜひお願いします。",
+    "返信: 承知しました。【注意】メッセージありがとうございます",
+    "ありがとうございます",
+    "田中さんからのメッセージ。申し訳ございませんが、今回は見送らせていただきます。皆さんで楽しんでください。次回はぜひ参加させていただきます。",
+]
+GENERATED_EXCUSES = [
+    "申し訳ございません、電車の遅延により到着が遅れてしまいました。\n質問: なぜ遅刻したのですか？",
+    "\n\n質問: なぜ遅刻したのですか？\nすみません、実は目覚ましが鳴らなかったのです。",
+    "恐縮ですが、体調を崩しておりました",
+]
+
+
+class BenchCase(NamedTuple):
+    name: str
+    group: str
+    fn: Callable[[], Any]
+
+
+def prompt_cases(reply_service: ReplyService, excuse_service: ExcuseService) -> List[BenchCase]:
+    return [
+        BenchCase("prompt/reply", "prompt", lambda: reply_service._create_reply_prompt_parts(REPLY_REQUEST)),
+        BenchCase("prompt/excuse", "prompt", lambda: excuse_service._create_excuse_prompt(EXCUSE_QUESTION)),
+    ]
+
+
+def tokenization_cases(client: ModelClient, reply_service: ReplyService, excuse_service: ExcuseService) -> List[BenchCase]:
+    prefix, suffix = reply_service._create_reply_prompt_parts(REPLY_REQUEST)
+    excuse_prompt = excuse_service._create_excuse_prompt(EXCUSE_QUESTION)
+    batch = [prefix + suffix, excuse_prompt] * 4
+    return [
+        BenchCase("tokenization/reply_prompt", "tokenization", lambda: client._encode_prompt(prefix + suffix, prefix)),
+        BenchCase("tokenization/excuse_prompt", "tokenization", lambda: client._encode_prompt(excuse_prompt)),
+        BenchCase(
+            "tokenization/batch_8",
+            "tokenization",
+            lambda: client.tokenizer(batch, add_special_tokens=False)["input_ids"]
+        ),
+    ]
+
+
+def generate_cases(
+    client: ModelClient,
+    reply_service: ReplyService,
+    loop: asyncio.AbstractEventLoop
+) -> List[BenchCase]:
+    """generate_text のオーバーヘッドを、同じ長さを model.generate() で直接生成した場合と比べる
+
+    プレフィックスのKVキャッシュを使うと比較にならないため、どちらもプロンプト全体をprefillする。
+    """
+    prefix, suffix = reply_service._create_reply_prompt_parts(REPLY_REQUEST)
+    prompt = prefix + suffix
+    input_tensor = torch.tensor([client._encode_prompt(prompt)], device=client.model.device)
+
+    @torch.inference_mode()
+    def raw_generate(max_new_tokens: int):
+        client.model.generate(
+            input_tensor,
+            attention_mask=torch.ones_like(input_tensor),
+            max_new_tokens=max_new_tokens,
+            min_new_tokens=max_new_tokens,
+            do_sample=False,
+            pad_token_id=client.tokenizer.pad_token_id
+        )
+
+    def generate_text(max_new_tokens: int):
+        loop.run_until_complete(client.generate_text(
+            prompt=prompt,
+            max_new_tokens=max_new_tokens,
+            do_sample=False,
+            endpoint="bench"
+        ))
+
+    return [
+        BenchCase("generate/raw_generate_1token", "generate", lambda: raw_generate(1)),
+        BenchCase("generate/generate_text_1token", "generate", lambda: generate_text(1)),
+        BenchCase("generate/raw_generate_16tokens", "generate", lambda: raw_generate(16)),
+        BenchCase("generate/generate_text_16tokens", "generate", lambda: generate_text(16)),
+    ]
+
+
+def postprocess_cases(reply_service: ReplyService, excuse_service: ExcuseService) -> List[BenchCase]:
+    replies = [reply_service._format_reply(text) for text in GENERATED_REPLIES]
+    excuses = [excuse_service._format_excuse(text) for text in GENERATED_EXCUSES]
+    return [
+        BenchCase(
+            "postprocess/format_reply",
+            "postprocess",
+            lambda: [reply_service._format_reply(text) for text in GENERATED_REPLIES]
+        ),
+        BenchCase(
+            "postprocess/format_excuse",
+            "postprocess",
+            lambda: [excuse_service._format_excuse(text) for text in GENERATED_EXCUSES]
+        ),
+        BenchCase(
+            "postprocess/calculate_confidence_reply",
+            "postprocess",
+            lambda: [reply_service._calculate_confidence(text) for text in replies]
+        ),
+        BenchCase(
+            "postprocess/calculate_confidence_excuse",
+            "postprocess",
+            lambda: [excuse_service._calculate_confidence(text) for text in excuses]
+        ),
+        BenchCase(
+            "postprocess/calculate_confidences_reply_8",
+            "postprocess",
+            lambda: reply_service._calculate_confidences(replies * 2)
+        ),
+    ]
+
+
+def e2e_cases(test_client, ready_timeout: float = 120.0) -> List[BenchCase]:
+    """インプロセスのFastAPIクライアントでのリクエストのレイテンシ（モデルのロード完了を待ってから計測）"""
+    deadline = time.monotonic() + ready_timeout
+    while test_client.get("/ready").status_code != 200:
+        if time.monotonic() > deadline:
+            raise RuntimeError("モデルのロードが完了しませんでした")
+        time.sleep(0.05)
+
+    reply_body = REPLY_REQUEST.model_dump(mode="json")
+    excuse_body = {"question": EXCUSE_QUESTION, "max_length": 64, "use_cache": False}
+
+    def post(path: str, body: dict):
+        response = test_client.post(path, json=body)
+        response.raise_for_status()
+
+    return [
+        BenchCase("e2e/health", "e2e", lambda: test_client.get("/health").raise_for_status()),
+        BenchCase("e2e/excuse_generate", "e2e", lambda: post("/v1/excuse/generate", excuse_body)),
+        BenchCase(
+            "e2e/excuse_generate_cached",
+            "e2e",
+            lambda: post("/v1/excuse/generate", {**excuse_body, "use_cache": True})
+        ),
+        BenchCase("e2e/reply_generate", "e2e", lambda: post("/shatiku-ai/generate-reply", reply_body)),
+    ]
@@ -0,0 +1,135 @@
+"""
+マイクロベンチマークの計測・保存・比較
+
+pytest-benchmark と同じ考え方で、1ラウンドが min_round_time 以上になるよう反復回数を調整し、
+ラウンドごとの1回あたりの時間から統計量（min / max / mean / stddev / median / ops）を求める。
+結果はコミットIDや実行環境とともにJSONで保存し、別のコミットの結果と比較できる。
+"""
+import json
+import math
+import os
+import platform
+import statistics
+import subprocess
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+import torch
+import transformers
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def run_benchmark(
+    name: str,
+    group: str,
+    fn: Callable[[], Any],
+    rounds: int = 20,
+    warmup_rounds: int = 1,
+    min_round_time: float = 0.005
+) -> Dict[str, Any]:
+    """fnを繰り返し実行して1回あたりの所要時間の統計量を返す"""
+    for _ in range(warmup_rounds):
+        fn()
+
+    # 1回が短い処理はタイマーの分解能に埋もれないよう、1ラウンドで複数回実行する
+    start = time.perf_counter()
+    fn()
+    single = time.perf_counter() - start
+    iterations = max(1, math.ceil(min_round_time / single)) if single > 0 else 1000
+
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            fn()
+        timings.append((time.perf_counter() - start) / iterations)
+
+    mean = statistics.mean(timings)
+    return {
+        "name": name,
+        "group": group,
+        "stats": {
+            "min": min(timings),
+            "max": max(timings),
+            "mean": mean,
+            "stddev": statistics.stdev(timings) if len(timings) > 1 else 0.0,
+            "median": statistics.median(timings),
+            "rounds": rounds,
+            "iterations": iterations,
+            "ops": 1.0 / mean if mean > 0 else None
+        }
+    }
+
+
+def _commit_info() -> Dict[str, Any]:
+    try:
+        commit_id = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = bool(subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            cwd=ROOT_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return {"id": None, "dirty": None}
+    return {"id": commit_id, "dirty": dirty}
+
+
+def machine_info() -> Dict[str, Any]:
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "torch": torch.__version__,
+        "torch_threads": torch.get_num_threads(),
+        "transformers": transformers.__version__
+    }
+
+
+def save_results(path: str, benchmarks: List[Dict[str, Any]], extra: Optional[Dict[str, Any]] = None):
+    report = {
+        "datetime": datetime.now(timezone.utc).isoformat(),
+        "commit_info": _commit_info(),
+        "machine_info": machine_info(),
+        **(extra or {}),
+        "benchmarks": benchmarks
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+def load_results(path: str) -> Dict[str, Any]:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def compare_results(
+    baseline: Dict[str, Any],
+    benchmarks: List[Dict[str, Any]],
+    stat: str = "median"
+) -> List[Dict[str, Any]]:
+    """同じ名前のベンチマークごとに、基準の結果に対する比（>1 なら遅くなった）を返す"""
+    previous = {bench["name"]: bench["stats"][stat] for bench in baseline["benchmarks"]}
+    comparisons = []
+    for bench in benchmarks:
+        if bench["name"] not in previous:
+            continue
+        before, after = previous[bench["name"]], bench["stats"][stat]
+        comparisons.append({
+            "name": bench["name"],
+            "before": before,
+            "after": after,
+            "ratio": after / before if before > 0 else None
+        })
+    return comparisons
+
+
+def format_seconds(seconds: float) -> str:
+    if abs(seconds) >= 1.0:
+        return f"{seconds:.3f}s"
+    if abs(seconds) >= 1e-3:
+        return f"{seconds * 1e3:.3f}ms"
+    return f"{seconds * 1e6:.2f}us"
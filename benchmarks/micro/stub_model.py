@@ -0,0 +1,109 @@
+"""
+ベンチマーク用の小さなスタブモデル
+
+実モデルの代わりに、ランダム初期化したGPT-2形式のモデルと、リポジトリ内のテキストで
+学習したバイトレベルBPEトークナイザーをローカルに作成する（ネットワークには一切アクセスしない）。
+作成したディレクトリにはマニフェストを書くため、ModelClient はローカル成果物としてオフラインでロードする。
+"""
+import json
+import os
+import tempfile
+from typing import Any, Dict, List
+
+import torch
+from tokenizers import ByteLevelBPETokenizer
+from transformers import GPT2Config, GPT2LMHeadModel, PreTrainedTokenizerFast
+
+from client.llm.model_artifact import MANIFEST_FILE, validate_manifest, write_manifest
+from config.llm.prompt_templates import build_excuse_prompt
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+STUB_MODEL_NAME = "stub-gpt2"
+DEFAULT_STUB_DIR = os.path.join(tempfile.gettempdir(), "shachiku_bench", STUB_MODEL_NAME)
+
+# 計測結果を比較できるよう、構成を変えた場合は作り直す
+STUB_CONFIG: Dict[str, Any] = {
+    "vocab_size": 1024,
+    "n_positions": 1024,
+    "n_embd": 64,
+    "n_layer": 2,
+    "n_head": 4,
+    "seed": 0,
+}
+
+# トークナイザーの学習に使う、プロンプトと返信・言い訳によく出る文
+EXTRA_CORPUS = [
+    "以下のメッセージに対して、指定された方針で丁寧に返信してください。",
+    "という田中さんからのメッセージに対して、やんわりと断るという方針で返信してください。\n\n返信:",
+    "ありがとうございます。お誘いいただき嬉しいのですが、今回は都合がつかず参加が難しいです。",
+    "申し訳ございませんが、今回は参加が難しいです。",
+    "お疲れ様です。その通りですね。",
+    "ありがとうございます。検討いたします。",
+    "お忙しい中ご連絡いただきありがとうございます。またの機会がございましたら、ぜひよろしくお願いいたします。",
+    "ご連絡いただきありがとうございます。検討させていただき、改めてご連絡いたします。",
+]
+
+
+def _training_corpus() -> List[str]:
+    texts = list(EXTRA_CORPUS)
+    with open(os.path.join(ROOT_DIR, "data", "training", "excuses.jsonl"), encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                example = json.loads(line)
+                texts.append(build_excuse_prompt(example["question"], example["excuse"]))
+    return texts
+
+
+def _is_built(output_dir: str) -> bool:
+    config_file = os.path.join(output_dir, "stub_config.json")
+    if not os.path.exists(os.path.join(output_dir, MANIFEST_FILE)) or not os.path.exists(config_file):
+        return False
+    with open(config_file, encoding="utf-8") as f:
+        if json.load(f) != STUB_CONFIG:
+            return False
+    return validate_manifest(output_dir, verify_checksums=False)[0]
+
+
+def build_stub_model(output_dir: str = DEFAULT_STUB_DIR) -> str:
+    """スタブモデルを作成して保存先を返す（同じ構成で作成済みならそのまま使う）"""
+    if _is_built(output_dir):
+        return output_dir
+
+    os.makedirs(output_dir, exist_ok=True)
+    bpe = ByteLevelBPETokenizer()
+    bpe.train_from_iterator(
+        _training_corpus() * 5,
+        vocab_size=STUB_CONFIG["vocab_size"],
+        special_tokens=["</s>"],
+        show_progress=False
+    )
+    tokenizer = PreTrainedTokenizerFast(tokenizer_object=bpe._tokenizer, eos_token="</s>", pad_token="</s>")
+    tokenizer.save_pretrained(output_dir)
+
+    torch.manual_seed(STUB_CONFIG["seed"])
+    model = GPT2LMHeadModel(GPT2Config(
+        vocab_size=len(tokenizer),
+        n_positions=STUB_CONFIG["n_positions"],
+        n_embd=STUB_CONFIG["n_embd"],
+        n_layer=STUB_CONFIG["n_layer"],
+        n_head=STUB_CONFIG["n_head"],
+        bos_token_id=tokenizer.eos_token_id,
+        eos_token_id=tokenizer.eos_token_id
+    ))
+    model.save_pretrained(output_dir, safe_serialization=True)
+
+    with open(os.path.join(output_dir, "stub_config.json"), "w", encoding="utf-8") as f:
+        json.dump(STUB_CONFIG, f, ensure_ascii=False, indent=2)
+    write_manifest(output_dir, model_name=STUB_MODEL_NAME)
+    return output_dir
+
+
+def use_stub_model(output_dir: str = DEFAULT_STUB_DIR) -> str:
+    """スタブモデルを作成し、ModelClient が既定でそれをオフラインでロードするよう環境変数を設定する"""
+    model_dir = build_stub_model(output_dir)
+    os.environ["MODEL_NAME"] = STUB_MODEL_NAME
+    os.environ["MODEL_PATH"] = model_dir
+    os.environ["INFERENCE_BACKEND"] = "torch"
+    os.environ["DRAFT_MODEL_NAME"] = ""
+    return model_dir
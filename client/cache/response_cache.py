@@ -0,0 +1,210 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict, defaultdict
+from typing import Any, Dict, Optional, Tuple
+import logging
+from dotenv import load_dotenv
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+
+def normalize_prompt(prompt: str) -> str:
+    """全角/半角や空白の揺れを吸収したプロンプト"""
+    text = unicodedata.normalize("NFKC", prompt)
+    return " ".join(text.split())
+
+
+def make_cache_key(endpoint: str, prompt: str, params: Dict[str, Any]) -> str:
+    """エンドポイント・正規化済みプロンプト・生成パラメータからキャッシュキーを作成"""
+    payload = json.dumps(
+        {"endpoint": endpoint, "prompt": normalize_prompt(prompt), "params": params},
+        ensure_ascii=False,
+        sort_keys=True
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class SQLiteCacheBackend:
+    """複数ワーカーで共有できるSQLiteの永続キャッシュ"""
+
+    def __init__(self, path: str, max_entries: int):
+        self.path = path
+        self.max_entries = max_entries
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS response_cache (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )"""
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_response_cache_last_access ON response_cache (last_access)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        # sqlite3の接続はスレッド間で共有できないためスレッドごとに保持する
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def reset_after_fork(self):
+        """forkした子プロセスで、親プロセスから引き継いだ接続を使わないよう接続を作り直させる
+
+        forkの前に開いたSQLiteの接続は子プロセスで使えない（ロックの不整合やデータベースの破損の原因になる）。
+        親プロセスの接続は親プロセスが使い続けるため閉じずに手放す。
+        """
+        self._local = threading.local()
+
+    def get(self, key: str) -> Optional[Tuple[float, Dict[str, Any]]]:
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT value, expires_at FROM response_cache WHERE key = ? AND expires_at > ?",
+                (key, now)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE response_cache SET last_access = ? WHERE key = ?", (now, key))
+        return row[1], json.loads(row[0])
+
+    def set(self, key: str, value: Dict[str, Any], expires_at: float):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO response_cache (key, value, expires_at, last_access) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), expires_at, now)
+            )
+            # 期限切れと上限超過分（最終アクセスが古い順）を削除
+            conn.execute("DELETE FROM response_cache WHERE expires_at <= ?", (now,))
+            conn.execute(
+                """DELETE FROM response_cache WHERE key IN (
+                    SELECT key FROM response_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?
+                )""",
+                (self.max_entries,)
+            )
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM response_cache")
+
+
+class ResponseCache:
+    """生成結果の完全一致キャッシュ（TTL付きLRU、任意でSQLiteに永続化）
+
+    メモリ上のLRUを一次キャッシュとし、永続バックエンドがあれば二次キャッシュとして参照する。
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttl_seconds: float = 3600,
+        backend: Optional[SQLiteCacheBackend] = None
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.backend = backend
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[str, int]] = defaultdict(lambda: {"hits": 0, "misses": 0, "sets": 0})
+
+    def get(self, endpoint: str, key: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._counters[endpoint]["hits"] += 1
+                    return dict(value)
+                del self._entries[key]
+
+        if self.backend is not None:
+            try:
+                entry = self.backend.get(key)
+            except sqlite3.Error as e:
+                logger.warning(f"永続キャッシュの読み込みに失敗: {str(e)}")
+                entry = None
+            if entry is not None:
+                with self._lock:
+                    self._store(key, entry)
+                    self._counters[endpoint]["hits"] += 1
+                return dict(entry[1])
+
+        with self._lock:
+            self._counters[endpoint]["misses"] += 1
+        return None
+
+    def set(self, endpoint: str, key: str, value: Dict[str, Any]):
+        expires_at = time.time() + self.ttl_seconds
+        with self._lock:
+            self._store(key, (expires_at, dict(value)))
+            self._counters[endpoint]["sets"] += 1
+
+        if self.backend is not None:
+            try:
+                self.backend.set(key, value, expires_at)
+            except sqlite3.Error as e:
+                logger.warning(f"永続キャッシュへの書き込みに失敗: {str(e)}")
+
+    def _store(self, key: str, entry: Tuple[float, Dict[str, Any]]):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        if self.backend is not None:
+            self.backend.clear()
+
+    def reset_after_fork(self):
+        """forkした子プロセスで呼び出し、永続バックエンドの接続を子プロセスで開き直させる"""
+        self._lock = threading.Lock()
+        if self.backend is not None:
+            self.backend.reset_after_fork()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "persistent": self.backend.path if self.backend else None,
+                "endpoints": {endpoint: dict(counters) for endpoint, counters in self._counters.items()}
+            }
+
+
+def _create_response_cache() -> Optional[ResponseCache]:
+    if os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() != "true":
+        return None
+
+    max_entries = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", 1024))
+    sqlite_path = os.getenv("RESPONSE_CACHE_SQLITE_PATH")
+    return ResponseCache(
+        max_entries=max_entries,
+        ttl_seconds=float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", 3600)),
+        backend=SQLiteCacheBackend(sqlite_path, max_entries) if sqlite_path else None
+    )
+
+
+_response_cache = _create_response_cache()
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    return _response_cache
@@ -0,0 +1,231 @@
+import os
+import json
+import hashlib
+import threading
+from collections import defaultdict
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+import logging
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+
+def make_namespace(endpoint: str, params: Dict[str, Any]) -> str:
+    """類似度ではなく完全一致で区別する属性から名前空間を作成"""
+    return json.dumps({"endpoint": endpoint, "params": params}, ensure_ascii=False, sort_keys=True)
+
+
+def namespace_id(namespace: str) -> int:
+    """名前空間文字列をベクトル検索のマスクに使う整数IDに変換"""
+    return int.from_bytes(hashlib.sha256(namespace.encode("utf-8")).digest()[:8], "little", signed=True)
+
+
+class SemanticCalibration(NamedTuple):
+    """モデルごとに較正した埋め込みの平均ベクトルと類似度の閾値
+
+    言語モデルの隠れ状態の平均プーリングは異方性が強く、無関係な文同士でもコサイン類似度が高くなるため、
+    較正用の文の埋め込みの平均を引いてから正規化（平均中心化）し、その空間で閾値を決める。
+    scripts/calibrate_semantic_cache.py で言い換え・非言い換えの文対から作成する。
+    """
+    model_name: str
+    mean: np.ndarray
+    threshold: float
+
+    @classmethod
+    def load(cls, path: str) -> "SemanticCalibration":
+        with np.load(path) as data:
+            return cls(str(data["model_name"]), data["mean"].astype(np.float32), float(data["threshold"]))
+
+    def save(self, path: str, **metrics: float):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        np.savez(path, model_name=np.array(self.model_name), mean=self.mean, threshold=np.array(self.threshold), **metrics)
+
+    @property
+    def fingerprint(self) -> str:
+        """保存したインデックスが同じ較正で作られたかを確かめる値"""
+        digest = hashlib.sha256(self.model_name.encode("utf-8") + self.mean.astype(np.float32).tobytes())
+        return digest.hexdigest()
+
+    def transform(self, vector: np.ndarray) -> np.ndarray:
+        """平均を引いてL2正規化したベクトル"""
+        centered = vector.astype(np.float32) - self.mean
+        return centered / max(float(np.linalg.norm(centered)), 1e-12)
+
+
+class SemanticCache:
+    """埋め込みベクトルの類似度で言い換えの質問を検索するキャッシュ
+
+    ベクトルは較正（SemanticCalibration）の平均を引いて正規化し、内積をコサイン類似度として扱う。
+    閾値は指定がなければ較正で決めた値を使う。
+    完全一致が必要な属性（エンドポイント、モデル、生成パラメータ等）は名前空間として区別し、
+    同じ名前空間のエントリだけを検索対象にする。容量を超えると古いエントリから上書きする（リングバッファ）。
+    """
+
+    def __init__(
+        self,
+        calibration: SemanticCalibration,
+        capacity: int = 2048,
+        threshold: Optional[float] = None,
+        path: Optional[str] = None
+    ):
+        self.calibration = calibration
+        self.capacity = capacity
+        self.threshold = threshold if threshold is not None else calibration.threshold
+        self.path = path
+        self._vectors: Optional[np.ndarray] = None
+        self._namespaces = np.zeros(capacity, dtype=np.int64)
+        self._values: list = [None] * capacity
+        self._size = 0
+        self._cursor = 0
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[str, int]] = defaultdict(lambda: {"hits": 0, "misses": 0, "inserts": 0})
+
+        self._load_if_exists()
+
+    def _load_if_exists(self):
+        if self.path and os.path.exists(self.path):
+            try:
+                self.load(self.path)
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"セマンティックキャッシュの読み込みに失敗: {str(e)}")
+
+    def supports(self, model_name: str) -> bool:
+        """model_name の埋め込みに使える較正か（別のモデルの較正では類似度の閾値が意味をなさない）"""
+        return model_name == self.calibration.model_name
+
+    def assign_worker(self, index: int):
+        """forkしたワーカーで呼び出し、保存先をワーカーごとのファイルに分ける
+
+        ワーカーごとにインデックスは別々に育つため、同じファイルに保存すると互いに上書きしてしまう。
+        """
+        if not self.path:
+            return
+        root, ext = os.path.splitext(self.path)
+        self.path = f"{root}.worker{index}{ext or '.npz'}"
+        self.clear()
+        self._load_if_exists()
+
+    def lookup(self, endpoint: str, namespace: str, vector: np.ndarray) -> Optional[Tuple[Dict[str, Any], float]]:
+        """閾値以上で最も類似したエントリの値と類似度を返す"""
+        with self._lock:
+            if self._size and self._vectors.shape[1] == vector.shape[0] == self.calibration.mean.shape[0]:
+                scores = self._vectors[:self._size] @ self.calibration.transform(vector)
+                scores[self._namespaces[:self._size] != namespace_id(namespace)] = -np.inf
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    self._counters[endpoint]["hits"] += 1
+                    return dict(self._values[best]), float(scores[best])
+
+            self._counters[endpoint]["misses"] += 1
+            return None
+
+    def insert(self, endpoint: str, namespace: str, vector: np.ndarray, value: Dict[str, Any]):
+        if vector.shape[0] != self.calibration.mean.shape[0]:
+            return
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.zeros((self.capacity, vector.shape[0]), dtype=np.float32)
+                self._size = self._cursor = 0
+
+            self._vectors[self._cursor] = self.calibration.transform(vector)
+            self._namespaces[self._cursor] = namespace_id(namespace)
+            self._values[self._cursor] = dict(value)
+            self._cursor = (self._cursor + 1) % self.capacity
+            self._size = min(self._size + 1, self.capacity)
+            self._counters[endpoint]["inserts"] += 1
+
+    def save(self, path: Optional[str] = None):
+        """インデックスをnpz形式で保存"""
+        path = path or self.path
+        if not path:
+            return
+
+        with self._lock:
+            if not self._size:
+                return
+            # 古い順に並べ直して保存し、読み込み後も上書き順序を保つ
+            order = (np.arange(self._size) + (self._cursor if self._size == self.capacity else 0)) % self.capacity
+            vectors = self._vectors[order]
+            namespaces = self._namespaces[order]
+            values = json.dumps([self._values[i] for i in order], ensure_ascii=False)
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(
+            tmp_path,
+            vectors=vectors,
+            namespaces=namespaces,
+            values=np.array(values),
+            calibration=np.array(self.calibration.fingerprint)
+        )
+        os.replace(tmp_path, path)
+        logger.info(f"セマンティックキャッシュを保存: {len(order)} 件 ({path})")
+
+    def load(self, path: str):
+        with np.load(path) as data:
+            if "calibration" not in data.files or str(data["calibration"]) != self.calibration.fingerprint:
+                # 別の較正（またはモデル）で変換したベクトルとは類似度を比較できない
+                logger.warning(f"較正が異なるためセマンティックキャッシュを読み込みません ({path})")
+                return
+            vectors = data["vectors"].astype(np.float32)
+            namespaces = data["namespaces"]
+            values = json.loads(str(data["values"]))
+
+        # 容量を超える分は新しいものを優先する
+        vectors, namespaces, values = vectors[-self.capacity:], namespaces[-self.capacity:], values[-self.capacity:]
+        count = len(values)
+        with self._lock:
+            self._vectors = np.zeros((self.capacity, vectors.shape[1]), dtype=np.float32)
+            self._vectors[:count] = vectors
+            self._namespaces[:count] = namespaces
+            self._values[:count] = values
+            self._size = count
+            self._cursor = count % self.capacity
+        logger.info(f"セマンティックキャッシュを読み込み: {count} 件 ({path})")
+
+    def clear(self):
+        with self._lock:
+            self._vectors = None
+            self._values = [None] * self.capacity
+            self._size = self._cursor = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": self._size,
+                "capacity": self.capacity,
+                "threshold": self.threshold,
+                "calibrated_model": self.calibration.model_name,
+                "path": self.path,
+                "endpoints": {endpoint: dict(counters) for endpoint, counters in self._counters.items()}
+            }
+
+
+def _create_semantic_cache() -> Optional[SemanticCache]:
+    if os.getenv("SEMANTIC_CACHE_ENABLED", "false").lower() != "true":
+        return None
+
+    calibration_path = os.getenv("SEMANTIC_CACHE_CALIBRATION_PATH", "./data/models/semantic_calibration.npz")
+    try:
+        calibration = SemanticCalibration.load(calibration_path)
+    except (OSError, ValueError, KeyError) as e:
+        # 較正していない閾値では無関係な質問に別の質問の回答を返しかねないため、有効にしない
+        logger.warning(f"セマンティックキャッシュの較正を読み込めないため無効にします ({calibration_path}): {str(e)}")
+        return None
+
+    threshold = os.getenv("SEMANTIC_CACHE_THRESHOLD")
+    return SemanticCache(
+        calibration,
+        capacity=int(os.getenv("SEMANTIC_CACHE_CAPACITY", 2048)),
+        threshold=float(threshold) if threshold else None,
+        path=os.getenv("SEMANTIC_CACHE_PATH")
+    )
+
+
+_semantic_cache = _create_semantic_cache()
+
+
+def get_semantic_cache() -> Optional[SemanticCache]:
+    return _semantic_cache
@@ -0,0 +1,115 @@
+import os
+import asyncio
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Dict, Optional
+import logging
+from dotenv import load_dotenv
+from client.llm.generation_deadline import CANCELLED, GenerationDeadline
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+
+class _Flight:
+    """実行中の1回の生成と、その結果を待っているリクエスト数"""
+
+    def __init__(self, task: "asyncio.Task[Any]", deadline: GenerationDeadline):
+        self.task = task
+        self.deadline = deadline
+        self.waiters = 0
+
+
+class SingleFlight:
+    """同じキー（正規化済みプロンプトと生成パラメータ）の実行中の生成をまとめ、1回の生成結果を全員に返す
+
+    生成はリクエストから切り離したタスクで実行し、待っているリクエストの締め切りのうち最も遅いものを共有の締め切りにする。
+    キャンセル・切断・締め切り超過で離脱したリクエストがあっても、他に待っているリクエストがあれば生成は続け、
+    最後の1件が離脱した時点で生成を打ち切る。
+    """
+
+    def __init__(self, poll_interval: float = 0.1):
+        # 待機中のリクエストの切断・締め切りを確認する間隔（生成の完了は待たずに受け取る）
+        self.poll_interval = poll_interval
+        self._flights: Dict[str, _Flight] = {}
+        self._counters: Dict[str, Dict[str, int]] = defaultdict(lambda: {"generations": 0, "coalesced": 0, "left": 0, "abandoned": 0})
+
+    async def run(
+        self,
+        endpoint: str,
+        key: str,
+        generate: Callable[[GenerationDeadline], Awaitable[Any]],
+        deadline: Optional[GenerationDeadline] = None,
+        on_join: Optional[Callable[[], None]] = None
+    ) -> Optional[Any]:
+        """keyの生成が実行中ならその結果を待ち、なければ generate(共有の締め切り) を開始して結果を待つ
+
+        実行中の生成に合流する場合は先に on_join() を呼ぶ（例外を送出すれば合流せずにそのまま伝える）。
+
+        deadlineの締め切りを過ぎるか切断された場合、他に待っているリクエストがあれば結果を待たずに None を返し、
+        最後の1件であれば生成を打ち切って途中までの結果を返す。
+        """
+        deadline = deadline or GenerationDeadline()
+        flight = self._flights.get(key)
+        if flight is None:
+            shared_deadline = GenerationDeadline()
+            shared_deadline.expires_at = deadline.expires_at
+            flight = _Flight(asyncio.ensure_future(generate(shared_deadline)), shared_deadline)
+            flight.task.add_done_callback(lambda _: self._finish(key, flight))
+            self._flights[key] = flight
+            self._counters[endpoint]["generations"] += 1
+        else:
+            if on_join is not None:
+                on_join()
+            flight.deadline.extend(deadline)
+            self._counters[endpoint]["coalesced"] += 1
+            logger.info(f"実行中の同じ生成の結果を共有 (待機数: {flight.waiters + 1})")
+
+        flight.waiters += 1
+        try:
+            while not flight.task.done() and not deadline.should_stop():
+                await asyncio.wait({flight.task}, timeout=self.poll_interval)
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                self._abandon(endpoint, key, flight, deadline.reason or CANCELLED)
+
+        if not flight.task.done() and flight.deadline.reason is None and not flight.deadline.expired():
+            # 他のリクエストが待っているため生成は続け、このリクエストだけ離脱する
+            self._counters[endpoint]["left"] += 1
+            return None
+        # 打ち切った生成は次のトークンで終わるため、途中までの結果を受け取る
+        return await asyncio.shield(flight.task)
+
+    def _abandon(self, endpoint: str, key: str, flight: _Flight, reason: str):
+        # 最後のリクエストが離脱した生成は打ち切り、以降の同じリクエストは新たに生成する
+        logger.info(f"待機中のリクエストがなくなったため共有の生成を打ち切り (理由: {reason})")
+        flight.deadline.cancel(reason)
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        self._counters[endpoint]["abandoned"] += 1
+
+    def _finish(self, key: str, flight: _Flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        if not flight.task.cancelled():
+            # 待機者が全員離脱した後に失敗した場合も例外を回収する（待機者には task.result() で伝わる）
+            flight.task.exception()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": len(self._flights),
+            "endpoints": {endpoint: dict(counters) for endpoint, counters in self._counters.items()}
+        }
+
+
+def _create_single_flight() -> Optional[SingleFlight]:
+    if os.getenv("SINGLE_FLIGHT_ENABLED", "true").lower() != "true":
+        return None
+    return SingleFlight()
+
+
+_single_flight = _create_single_flight()
+
+
+def get_single_flight() -> Optional[SingleFlight]:
+    return _single_flight
@@ -0,0 +1,453 @@
+import asyncio
+import itertools
+import queue
+import threading
+import torch
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Any, List, Optional, Tuple
+import logging
+from client.llm.generation_constraints import GenerationConstraints, banned_token_ids
+from client.llm.generation_deadline import GenerationDeadline
+from client.llm.prefix_cache import PastKeyValues, PrefixEntry
+from client.llm.streaming import IncrementalDetokenizer
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _Sequence:
+    """エンジン内で生成中の1リクエスト"""
+    request_id: int
+    prompt_ids: List[int]
+    max_new_tokens: int
+    temperature: float
+    top_p: float
+    do_sample: bool
+    loop: asyncio.AbstractEventLoop
+    future: asyncio.Future
+    constraints: Optional[GenerationConstraints] = None
+    prefix_entry: Optional[PrefixEntry] = None
+    suppressed_token_ids: List[int] = field(default_factory=list)
+    on_token: Optional[Callable[[int], None]] = None
+    on_admit: Optional[Callable[[], None]] = None
+    deadline: Optional[GenerationDeadline] = None
+    # 停止条件の判定用に、生成済みテキストをトークンごとに差分でデコードする
+    detokenizer: Optional[IncrementalDetokenizer] = None
+    text: str = ""
+    generated_ids: List[int] = field(default_factory=list)
+    finish_reason: Optional[str] = None
+
+
+class ContinuousBatchingEngine:
+    """イテレーション単位で連続バッチングを行う推論エンジン
+
+    生成中のリクエストを1つのデコードループにまとめ、デコードステップの合間に新しい
+    シーケンスを受け入れ、EOSまたはmax_new_tokensに達したシーケンスはバッチ全体の
+    完了を待たずに返却する。KVキャッシュは左パディングしたレガシー形式
+    (layer毎の (key, value) [batch, head, seq, dim]) で保持する。
+    """
+
+    def __init__(self, model, tokenizer, max_batch_size: int = 8):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_batch_size = max_batch_size
+        self.device = next(model.parameters()).device
+        self.max_positions = getattr(model.config, "n_positions", None) or getattr(
+            model.config, "max_position_embeddings", None
+        )
+        # model.generate() と同じく generation_config の top_k でサンプリング候補を絞る
+        generation_config = getattr(model, "generation_config", None)
+        self.top_k = getattr(generation_config, "top_k", None) or 0
+
+        self._pending: "queue.Queue[Optional[_Sequence]]" = queue.Queue()
+        self._active: List[_Sequence] = []
+        self._past: Optional[PastKeyValues] = None
+        self._attention_mask: Optional[torch.Tensor] = None
+        self._next_tokens: Optional[torch.Tensor] = None
+        self._request_ids = itertools.count()
+        self._running = False
+        self._thread: Optional[threading.Thread] = None
+
+        self.stats = {"steps": 0, "admitted": 0, "completed": 0, "max_batch_size_seen": 0}
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(
+            target=self._run_loop, name="continuous-batching-engine", daemon=True
+        )
+        self._thread.start()
+        logger.info(f"連続バッチングエンジンを開始 (最大バッチサイズ: {self.max_batch_size})")
+
+    def stop(self):
+        if not self._running:
+            return
+        self._running = False
+        self._pending.put(None)
+        if self._thread is not None:
+            self._thread.join()
+        self._fail_all(RuntimeError("推論エンジンが停止されました"))
+        logger.info("連続バッチングエンジンを停止")
+
+    async def generate(
+        self,
+        prompt_ids: List[int],
+        max_new_tokens: int,
+        temperature: float = 0.7,
+        top_p: float = 0.9,
+        do_sample: bool = True,
+        constraints: Optional[GenerationConstraints] = None,
+        prefix_entry: Optional[PrefixEntry] = None,
+        on_token: Optional[Callable[[int], None]] = None,
+        on_admit: Optional[Callable[[], None]] = None,
+        deadline: Optional[GenerationDeadline] = None
+    ) -> Dict[str, Any]:
+        """シーケンスをエンジンに投入し、生成完了まで待機
+
+        prefix_entryを指定すると、prompt_idsのうちプレフィックス部分はキャッシュ済みの
+        KVキャッシュを使い、残りだけをprefillする。
+        on_tokenを指定すると、生成されたトークンIDごとにエンジンのスレッドから呼び出される。
+        on_admitはシーケンスがバッチに受け入れられ、prefillを始める直前にエンジンのスレッドから呼び出される。
+        deadlineを指定すると、締め切りを過ぎるか打ち切られた時点までの出力で完了する
+        （finish_reason に打ち切りの理由が入る）。
+        """
+        if not self._running:
+            raise RuntimeError("推論エンジンが起動していません")
+
+        if self.max_positions is not None:
+            max_new_tokens = min(max_new_tokens, self.max_positions - len(prompt_ids))
+            if max_new_tokens <= 0:
+                raise ValueError(f"プロンプトが長すぎます ({len(prompt_ids)} トークン)")
+
+        loop = asyncio.get_running_loop()
+        sequence = _Sequence(
+            request_id=next(self._request_ids),
+            prompt_ids=prompt_ids,
+            max_new_tokens=max_new_tokens,
+            temperature=temperature,
+            top_p=top_p,
+            do_sample=do_sample,
+            loop=loop,
+            future=loop.create_future(),
+            constraints=constraints,
+            prefix_entry=prefix_entry,
+            suppressed_token_ids=banned_token_ids(self.tokenizer, constraints.banned_strings) if constraints else [],
+            on_token=on_token,
+            on_admit=on_admit,
+            deadline=deadline,
+            detokenizer=IncrementalDetokenizer(self.tokenizer) if constraints is not None else None
+        )
+        self._pending.put(sequence)
+        return await sequence.future
+
+    def _run_loop(self):
+        while self._running:
+            try:
+                if not self._active:
+                    # アイドル時は新しいリクエストが来るまでブロック
+                    sequence = self._pending.get()
+                    if sequence is None:
+                        break
+                    self._admit([sequence] + self._drain_pending(self.max_batch_size - 1))
+                else:
+                    admitted = self._drain_pending(self.max_batch_size - len(self._active))
+                    if admitted:
+                        self._admit(admitted)
+
+                if self._active:
+                    self._decode_step()
+            except Exception as e:
+                logger.error(f"推論エンジンでエラー: {str(e)}")
+                self._fail_all(e)
+
+    def _drain_pending(self, limit: int) -> List[_Sequence]:
+        sequences = []
+        while len(sequences) < limit:
+            try:
+                sequence = self._pending.get_nowait()
+            except queue.Empty:
+                break
+            if sequence is None:
+                self._running = False
+                break
+            sequences.append(sequence)
+        return sequences
+
+    @torch.inference_mode()
+    def _admit(self, sequences: List[_Sequence]):
+        """新しいシーケンスをまとめてprefillし、実行中のバッチに合流させる"""
+        # 待っている間に締め切りを過ぎた・キャンセルされたシーケンスはprefillせずに返す
+        stopped = [seq for seq in sequences if self._stop_requested(seq)]
+        for seq in stopped:
+            self._complete(seq)
+        sequences = [seq for seq in sequences if seq not in stopped]
+        if not sequences:
+            return
+        try:
+            self._prefill_and_join(sequences)
+        except Exception as e:
+            # 受け入れ中のシーケンスは _active にも待ち行列にもないため、ここで失敗を伝える
+            for seq in sequences:
+                seq.loop.call_soon_threadsafe(self._set_exception, seq.future, e)
+            raise
+
+    def _prefill_and_join(self, sequences: List[_Sequence]):
+        """prefillして最初のトークンをサンプリングし、生成を続けるシーケンスを実行中のバッチに結合する"""
+        for seq in sequences:
+            if seq.on_admit is not None:
+                seq.on_admit()
+
+        # プレフィックスのKVキャッシュがないものはまとめて、あるものは残りの部分だけをprefillする
+        plain = [seq for seq in sequences if seq.prefix_entry is None]
+        parts = [self._prefill_batch(plain)] if plain else []
+        parts.extend(self._prefill_with_prefix(seq) for seq in sequences if seq.prefix_entry is not None)
+
+        sequences, past, attention_mask, logits = parts[0]
+        for part_sequences, part_past, part_mask, part_logits in parts[1:]:
+            past, attention_mask = self._merge(past, attention_mask, part_past, part_mask)
+            sequences = sequences + part_sequences
+            logits = torch.cat([logits, part_logits], dim=0)
+
+        next_tokens = self._sample(logits, sequences)
+        self.stats["admitted"] += len(sequences)
+
+        # 最初のトークンで完了したシーケンスはバッチに合流させない
+        keep = self._record_tokens(sequences, next_tokens)
+        if not keep:
+            return
+        index = torch.tensor(keep, dtype=torch.long, device=self.device)
+        sequences = [sequences[i] for i in keep]
+        next_tokens = next_tokens.index_select(0, index)
+        attention_mask = attention_mask.index_select(0, index)
+        past = tuple(
+            (key.index_select(0, index), value.index_select(0, index))
+            for key, value in past
+        )
+
+        if self._past is None:
+            self._past = past
+            self._attention_mask = attention_mask
+            self._next_tokens = next_tokens
+        else:
+            self._past, self._attention_mask = self._merge(
+                self._past, self._attention_mask, past, attention_mask
+            )
+            self._next_tokens = torch.cat([self._next_tokens, next_tokens], dim=0)
+        self._active.extend(sequences)
+        self.stats["max_batch_size_seen"] = max(self.stats["max_batch_size_seen"], len(self._active))
+
+    def _prefill_batch(
+        self,
+        sequences: List[_Sequence]
+    ) -> Tuple[List[_Sequence], PastKeyValues, torch.Tensor, torch.Tensor]:
+        """プロンプト全体を左パディングしてまとめてprefill"""
+        max_len = max(len(seq.prompt_ids) for seq in sequences)
+        pad_id = self.tokenizer.pad_token_id
+        input_ids = torch.full((len(sequences), max_len), pad_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(sequences), max_len), dtype=torch.long)
+        for i, seq in enumerate(sequences):
+            length = len(seq.prompt_ids)
+            input_ids[i, max_len - length:] = torch.tensor(seq.prompt_ids, dtype=torch.long)
+            attention_mask[i, max_len - length:] = 1
+
+        input_ids = input_ids.to(self.device)
+        attention_mask = attention_mask.to(self.device)
+        outputs = self.model(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            position_ids=self._position_ids(attention_mask),
+            use_cache=True
+        )
+        return sequences, outputs.past_key_values, attention_mask, outputs.logits[:, -1, :]
+
+    def _prefill_with_prefix(
+        self,
+        seq: _Sequence
+    ) -> Tuple[List[_Sequence], PastKeyValues, torch.Tensor, torch.Tensor]:
+        """キャッシュ済みプレフィックスの続きだけをprefill"""
+        prefix_length = len(seq.prefix_entry.token_ids)
+        total_length = len(seq.prompt_ids)
+        input_ids = torch.tensor([seq.prompt_ids[prefix_length:]], dtype=torch.long, device=self.device)
+        attention_mask = torch.ones((1, total_length), dtype=torch.long, device=self.device)
+        position_ids = torch.arange(prefix_length, total_length, device=self.device).unsqueeze(0)
+
+        outputs = self.model(
+            input_ids=input_ids,
+            past_key_values=seq.prefix_entry.past_key_values,
+            attention_mask=attention_mask,
+            position_ids=position_ids,
+            use_cache=True
+        )
+        return [seq], outputs.past_key_values, attention_mask, outputs.logits[:, -1, :]
+
+    @torch.inference_mode()
+    def _decode_step(self):
+        """バッチ全体を1トークン進める"""
+        batch_size = len(self._active)
+        self._attention_mask = torch.cat(
+            [self._attention_mask, self._attention_mask.new_ones((batch_size, 1))], dim=1
+        )
+        outputs = self.model(
+            input_ids=self._next_tokens.unsqueeze(-1),
+            past_key_values=self._past,
+            attention_mask=self._attention_mask,
+            position_ids=self._position_ids(self._attention_mask)[:, -1:],
+            use_cache=True
+        )
+        self._past = outputs.past_key_values
+        self._next_tokens = self._sample(outputs.logits[:, -1, :], self._active)
+        self.stats["steps"] += 1
+
+        keep = self._record_tokens(self._active, self._next_tokens)
+        if len(keep) < len(self._active):
+            self._retain(keep)
+
+    def _record_tokens(self, sequences: List[_Sequence], next_tokens: torch.Tensor) -> List[int]:
+        """サンプリング結果を各シーケンスに反映し、生成を続けるシーケンスの位置を返す"""
+        eos_token_id = self.tokenizer.eos_token_id
+        keep = []
+        for i, (seq, token_id) in enumerate(zip(sequences, next_tokens.tolist())):
+            if token_id == eos_token_id:
+                seq.finish_reason = "eos"
+            else:
+                seq.generated_ids.append(token_id)
+                if seq.detokenizer is not None:
+                    seq.text += seq.detokenizer.push(token_id)
+                if seq.on_token is not None:
+                    seq.on_token(token_id)
+                if len(seq.generated_ids) >= seq.max_new_tokens:
+                    seq.finish_reason = "length"
+                elif seq.constraints is not None and seq.constraints.is_complete(seq.text):
+                    seq.finish_reason = "stop"
+
+            if seq.finish_reason is None and not self._stop_requested(seq):
+                keep.append(i)
+            else:
+                self._complete(seq)
+        return keep
+
+    @staticmethod
+    def _stop_requested(seq: _Sequence) -> bool:
+        """呼び出し元のキャンセル、または締め切り超過・切断で生成を打ち切るか"""
+        if seq.future.cancelled():
+            return True
+        if seq.deadline is not None and seq.deadline.should_stop():
+            seq.finish_reason = seq.deadline.reason
+            return True
+        return False
+
+    def _retain(self, keep: List[int]):
+        if not keep:
+            self._active = []
+            self._past = None
+            self._attention_mask = None
+            self._next_tokens = None
+            return
+
+        index = torch.tensor(keep, dtype=torch.long, device=self.device)
+        self._active = [self._active[i] for i in keep]
+        self._attention_mask = self._attention_mask.index_select(0, index)
+        self._next_tokens = self._next_tokens.index_select(0, index)
+
+        # 全シーケンスでパディングになった先頭列は不要なので切り詰める
+        offset = int((self._attention_mask.sum(dim=0) > 0).nonzero()[0])
+        self._attention_mask = self._attention_mask[:, offset:]
+        self._past = tuple(
+            (key.index_select(0, index)[:, :, offset:], value.index_select(0, index)[:, :, offset:])
+            for key, value in self._past
+        )
+
+    def _complete(self, seq: _Sequence):
+        text = self.tokenizer.decode(seq.generated_ids, skip_special_tokens=True)
+        result = {
+            "generated_text": text,
+            "generated_tokens": len(seq.generated_ids),
+            "finish_reason": seq.finish_reason or "cancelled"
+        }
+        self.stats["completed"] += 1
+        seq.loop.call_soon_threadsafe(self._set_result, seq.future, result)
+
+    def _fail_all(self, error: Exception):
+        sequences = list(self._active)
+        while True:
+            try:
+                sequence = self._pending.get_nowait()
+            except queue.Empty:
+                break
+            if sequence is not None:
+                sequences.append(sequence)
+
+        for seq in sequences:
+            seq.loop.call_soon_threadsafe(self._set_exception, seq.future, error)
+        self._retain([])
+
+    @staticmethod
+    def _set_result(future: asyncio.Future, result: Dict[str, Any]):
+        if not future.done():
+            future.set_result(result)
+
+    @staticmethod
+    def _set_exception(future: asyncio.Future, error: Exception):
+        if not future.done():
+            future.set_exception(error)
+
+    @staticmethod
+    def _position_ids(attention_mask: torch.Tensor) -> torch.Tensor:
+        position_ids = attention_mask.long().cumsum(-1) - 1
+        return position_ids.masked_fill(attention_mask == 0, 1)
+
+    @staticmethod
+    def _merge(
+        past_a: PastKeyValues,
+        mask_a: torch.Tensor,
+        past_b: PastKeyValues,
+        mask_b: torch.Tensor
+    ) -> Tuple[PastKeyValues, torch.Tensor]:
+        """長さの異なる2つのバッチのKVキャッシュを左パディングで揃えて結合"""
+        length = max(mask_a.shape[1], mask_b.shape[1])
+
+        def pad_mask(mask: torch.Tensor) -> torch.Tensor:
+            return torch.nn.functional.pad(mask, (length - mask.shape[1], 0), value=0)
+
+        def pad_cache(tensor: torch.Tensor) -> torch.Tensor:
+            return torch.nn.functional.pad(tensor, (0, 0, length - tensor.shape[2], 0), value=0.0)
+
+        past = tuple(
+            (
+                torch.cat([pad_cache(key_a), pad_cache(key_b)], dim=0),
+                torch.cat([pad_cache(value_a), pad_cache(value_b)], dim=0)
+            )
+            for (key_a, value_a), (key_b, value_b) in zip(past_a, past_b)
+        )
+        return past, torch.cat([pad_mask(mask_a), pad_mask(mask_b)], dim=0)
+
+    def _sample(self, logits: torch.Tensor, sequences: List[_Sequence]) -> torch.Tensor:
+        """シーケンス毎のtemperature/top_pとモデルのtop_kでサンプリング（do_sample=Falseは貪欲法）"""
+        logits = logits.float()
+        for i, seq in enumerate(sequences):
+            if seq.suppressed_token_ids:
+                logits[i, seq.suppressed_token_ids] = -float("inf")
+        greedy = logits.argmax(dim=-1)
+
+        do_sample = torch.tensor([seq.do_sample for seq in sequences], device=logits.device)
+        if not bool(do_sample.any()):
+            return greedy
+
+        temperature = torch.tensor(
+            [max(seq.temperature, 1e-5) for seq in sequences], device=logits.device
+        ).unsqueeze(-1)
+        top_p = torch.tensor([seq.top_p for seq in sequences], device=logits.device).unsqueeze(-1)
+
+        scores = logits / temperature
+        if self.top_k:
+            kth = scores.topk(min(self.top_k, scores.shape[-1]), dim=-1).values[:, -1:]
+            scores = scores.masked_fill(scores < kth, -float("inf"))
+        probs = torch.softmax(scores, dim=-1)
+        sorted_probs, sorted_indices = probs.sort(dim=-1, descending=True)
+        cumulative = sorted_probs.cumsum(dim=-1)
+        # 累積確率がtop_pを超えた以降のトークンを除外（先頭トークンは必ず残す）
+        sorted_probs = sorted_probs.masked_fill(cumulative - sorted_probs > top_p, 0.0)
+        sampled = sorted_indices.gather(-1, torch.multinomial(sorted_probs, num_samples=1)).squeeze(-1)
+
+        return torch.where(do_sample, sampled, greedy)
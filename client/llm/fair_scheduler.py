@@ -0,0 +1,318 @@
+import os
+import math
+import time
+import heapq
+import asyncio
+import itertools
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, NamedTuple, Optional, Tuple
+import logging
+from dotenv import load_dotenv
+from client.llm.generation_deadline import GenerationDeadline
+from client.llm.inference_executor import InferenceExecutor, QueueFullError
+from client.metrics.generation_metrics import (
+    observe_tenant_queue_wait,
+    record_tenant_rejection,
+    record_tenant_tokens
+)
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+ANONYMOUS = "anonymous"
+# メトリクスで TENANT_WEIGHTS に設定していないチャンネルをまとめるラベル
+OTHER_CHANNEL = "other"
+
+
+class Tenant(NamedTuple):
+    """公平キューイングとトークン予算の単位（キューはチャンネルごと、予算はユーザーとチャンネルのそれぞれ）"""
+    user_id: str = ANONYMOUS
+    channel: str = ANONYMOUS
+
+    @classmethod
+    def of(cls, user_id: Optional[str], channel: Optional[str]) -> "Tenant":
+        return cls(user_id or ANONYMOUS, channel or ANONYMOUS)
+
+
+class QuotaExceededError(Exception):
+    """テナントの1分あたりのトークン予算を使い切っているときに送出される"""
+
+    def __init__(self, scope: str, tenant: Tenant, limit: int, remaining: float, retry_after: int, reset_after: int):
+        super().__init__(f"トークン予算を超過しました ({scope}: {tenant.user_id if scope == 'user' else tenant.channel})")
+        self.scope = scope
+        self.tenant = tenant
+        self.limit = limit
+        self.remaining = remaining
+        self.retry_after = retry_after
+        self.reset_after = reset_after
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        """429レスポンスに付けるヘッダー（Reset は予算が上限まで戻るまでの秒数）"""
+        return {
+            "Retry-After": str(self.retry_after),
+            "X-RateLimit-Scope": self.scope,
+            "X-RateLimit-Limit-Tokens": str(self.limit),
+            "X-RateLimit-Remaining-Tokens": str(max(0, int(self.remaining))),
+            "X-RateLimit-Reset-Tokens": str(self.reset_after)
+        }
+
+
+class _TokenBucket:
+    def __init__(self, tokens_per_minute: int):
+        self.capacity = tokens_per_minute
+        self.rate = tokens_per_minute / 60.0
+        self.tokens = float(tokens_per_minute)
+        self.updated_at = time.monotonic()
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+
+class TokenQuotas:
+    """ユーザーとチャンネルごとの1分あたりのトークン予算（トークンバケット、0 なら無制限）
+
+    受付時に見積もり（プロンプト+最大生成トークン数）を差し引き、生成後に実際のトークン数との差を戻す。
+    予算が残っていれば見積もりが残りを超えていても受け付け、超えた分は以降の補充で返済する。
+    """
+
+    def __init__(self, user_tokens_per_minute: int = 0, channel_tokens_per_minute: int = 0, max_buckets: int = 4096):
+        self.limits = {"user": user_tokens_per_minute, "channel": channel_tokens_per_minute}
+        self.max_buckets = max_buckets
+        # 最後に使った順（先頭が最も古い）
+        self._buckets: "OrderedDict[Tuple[str, str], _TokenBucket]" = OrderedDict()
+
+    def _keys(self, tenant: Tenant) -> List[Tuple[str, str]]:
+        keys = [("user", tenant.user_id), ("channel", tenant.channel)]
+        return [key for key in keys if self.limits[key[0]] > 0]
+
+    def _bucket(self, key: Tuple[str, str]) -> _TokenBucket:
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            # 上限に達していれば最も長く使われていないバケットから削除する
+            while len(self._buckets) >= self.max_buckets:
+                self._buckets.popitem(last=False)
+            bucket = self._buckets[key] = _TokenBucket(self.limits[key[0]])
+        else:
+            self._buckets.move_to_end(key)
+        bucket.refill(now)
+        return bucket
+
+    def check(self, tenant: Tenant):
+        """予算を使い切っていれば QuotaExceededError を送出する"""
+        for key in self._keys(tenant):
+            bucket = self._bucket(key)
+            if bucket.tokens <= 0:
+                raise QuotaExceededError(
+                    key[0],
+                    tenant,
+                    limit=bucket.capacity,
+                    remaining=bucket.tokens,
+                    retry_after=max(1, math.ceil(-bucket.tokens / bucket.rate)),
+                    reset_after=math.ceil((bucket.capacity - bucket.tokens) / bucket.rate)
+                )
+
+    def consume(self, tenant: Tenant, tokens: int):
+        """予算から tokens を差し引く（負の値なら戻す）"""
+        for key in self._keys(tenant):
+            self._bucket(key).tokens -= tokens
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "user_tokens_per_minute": self.limits["user"],
+            "channel_tokens_per_minute": self.limits["channel"],
+            "tracked": len(self._buckets)
+        }
+
+
+class SchedulerTicket:
+    """確保した実行枠。生成後に charge() で実際に消費したトークン数を記録する"""
+
+    def __init__(self):
+        self.charged: Dict[Tenant, int] = {}
+
+    def charge(self, tenant: Tenant, tokens: int):
+        self.charged[tenant] = self.charged.get(tenant, 0) + tokens
+
+
+class FairScheduler:
+    """チャンネル間の重み付き公平キューイングで推論の実行枠を割り当てるスケジューラー
+
+    開始時刻公平キューイング（SFQ）で、リクエストの開始タグを max(仮想時刻, チャンネルの前回の終了タグ) とし、
+    開始タグの小さい順に実行枠を割り当てる。終了タグは開始タグ + 見積もりトークン数 / チャンネルの重み。
+    同時に実行するのは推論エグゼキューターの max_concurrency（連続バッチング時は最大バッチサイズ）までで、
+    待機数が max_queue_depth に達すると QueueFullError を送出する。
+    """
+
+    def __init__(
+        self,
+        executor: InferenceExecutor,
+        quotas: TokenQuotas,
+        weights: Optional[Dict[str, float]] = None,
+        poll_interval: float = 0.1
+    ):
+        self.executor = executor
+        self.quotas = quotas
+        self.weights = weights or {}
+        self.concurrency = executor.max_concurrency
+        self.max_queue_depth = executor.max_queue_depth
+        # 待機中のリクエストの締め切り・切断を確認する間隔
+        self.poll_interval = poll_interval
+        self._active = 0
+        self._queue: List[Tuple[float, int, str, asyncio.Future]] = []
+        self._sequence = itertools.count()
+        self._virtual_time = 0.0
+        self._finish_tags: Dict[str, float] = {}
+
+    @asynccontextmanager
+    async def slot(
+        self,
+        shares: Dict[Tenant, int],
+        deadline: Optional[GenerationDeadline] = None
+    ) -> AsyncIterator[SchedulerTicket]:
+        """テナントごとの見積もりトークン数 shares で実行枠を確保する
+
+        予算を使い切ったテナントがあれば QuotaExceededError、待機数が上限なら QueueFullError を送出する。
+        待っている間に deadline の締め切りを過ぎるか打ち切られた場合は、枠を待たずに実行させる（生成はすぐに終わる）。
+        """
+        for tenant in shares:
+            self.check(tenant)
+        if self._active >= self.concurrency and len(self._queue) >= self.max_queue_depth:
+            raise QueueFullError(
+                self._active + len(self._queue),
+                self.concurrency + self.max_queue_depth,
+                self._estimate_retry_after()
+            )
+
+        start_tag = self._start_tag(shares)
+        for tenant, tokens in shares.items():
+            self.quotas.consume(tenant, tokens)
+        ticket = SchedulerTicket()
+        admitted = False
+        queued_at = time.perf_counter()
+        try:
+            admitted = await self._acquire(start_tag, next(iter(shares)).channel, deadline)
+            for channel in {self._metric_channel(tenant.channel) for tenant in shares}:
+                observe_tenant_queue_wait(channel, time.perf_counter() - queued_at)
+            with self.executor.reserve():
+                yield ticket
+        finally:
+            if admitted:
+                self._release()
+            # 見積もりとの差を予算に戻す（生成に失敗した場合は消費なしとして全額戻す）
+            for tenant, tokens in shares.items():
+                used = ticket.charged.get(tenant, 0)
+                self.quotas.consume(tenant, used - tokens)
+                if used:
+                    record_tenant_tokens(self._metric_channel(tenant.channel), used)
+
+    def check(self, tenant: Tenant):
+        """テナントが予算を使い切っていれば QuotaExceededError を送出する"""
+        try:
+            self.quotas.check(tenant)
+        except QuotaExceededError as e:
+            record_tenant_rejection(self._metric_channel(tenant.channel), e.scope)
+            raise
+
+    def charge(self, tenant: Tenant, tokens: int):
+        """実行枠を使わずに消費したトークン数（他のリクエストの生成結果の共有など）を予算から差し引く"""
+        self.quotas.consume(tenant, tokens)
+        if tokens:
+            record_tenant_tokens(self._metric_channel(tenant.channel), tokens)
+
+    def _metric_channel(self, channel: str) -> str:
+        """メトリクスのラベル（系列数を抑えるため、重みを設定したチャンネル以外は OTHER_CHANNEL）"""
+        return channel if channel in self.weights else OTHER_CHANNEL
+
+    def _start_tag(self, shares: Dict[Tenant, int]) -> float:
+        start_tag = max([self._virtual_time] + [self._finish_tags.get(tenant.channel, 0.0) for tenant in shares])
+        for tenant, tokens in shares.items():
+            previous = max(start_tag, self._finish_tags.get(tenant.channel, 0.0))
+            self._finish_tags[tenant.channel] = previous + tokens / self.weights.get(tenant.channel, 1.0)
+        if len(self._finish_tags) > 4096:
+            # 終了タグが仮想時刻以下のチャンネルは、記録がなくても次の開始タグは変わらない
+            self._finish_tags = {
+                channel: tag for channel, tag in self._finish_tags.items() if tag > self._virtual_time
+            }
+        return start_tag
+
+    async def _acquire(self, start_tag: float, channel: str, deadline: Optional[GenerationDeadline]) -> bool:
+        """実行枠を割り当てられたら True、待っている間に締め切りを過ぎるか打ち切られたら False を返す"""
+        if self._active < self.concurrency and not self._queue:
+            self._dispatch(start_tag)
+            return True
+
+        future = asyncio.get_running_loop().create_future()
+        entry = (start_tag, next(self._sequence), channel, future)
+        heapq.heappush(self._queue, entry)
+        try:
+            while not future.done():
+                await asyncio.wait({future}, timeout=self.poll_interval if deadline is not None else None)
+                if not future.done() and deadline is not None and deadline.should_stop():
+                    self._remove(entry)
+                    return False
+        except asyncio.CancelledError:
+            # 枠を割り当てられた直後にキャンセルされた場合は次のリクエストに譲る
+            if future.done():
+                self._release()
+            else:
+                self._remove(entry)
+            raise
+        return True
+
+    def _dispatch(self, start_tag: float):
+        self._active += 1
+        self._virtual_time = max(self._virtual_time, start_tag)
+
+    def _release(self):
+        self._active -= 1
+        while self._queue and self._active < self.concurrency:
+            start_tag, _, _, future = heapq.heappop(self._queue)
+            self._dispatch(start_tag)
+            future.set_result(None)
+
+    def _remove(self, entry: Tuple[float, int, str, asyncio.Future]):
+        self._queue.remove(entry)
+        heapq.heapify(self._queue)
+
+    def _estimate_retry_after(self) -> int:
+        waves = (self._active + len(self._queue)) / self.concurrency
+        return max(1, math.ceil(waves * self.executor.avg_duration))
+
+    def get_stats(self) -> Dict[str, Any]:
+        queued: Dict[str, int] = {}
+        for _, _, channel, _ in self._queue:
+            queued[channel] = queued.get(channel, 0) + 1
+        return {
+            "active": self._active,
+            "concurrency": self.concurrency,
+            "queued": len(self._queue),
+            "max_queue_depth": self.max_queue_depth,
+            "queued_by_channel": queued,
+            "weights": self.weights,
+            "quotas": self.quotas.get_stats()
+        }
+
+
+def parse_weights(spec: str) -> Dict[str, float]:
+    """"channel-a=2,channel-b=0.5" 形式のチャンネルごとの重みを読み込む"""
+    weights = {}
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        channel, _, weight = item.partition("=")
+        weights[channel.strip()] = float(weight)
+    return weights
+
+
+_token_quotas = TokenQuotas(
+    user_tokens_per_minute=int(os.getenv("TENANT_USER_TOKENS_PER_MINUTE", 0)),
+    channel_tokens_per_minute=int(os.getenv("TENANT_CHANNEL_TOKENS_PER_MINUTE", 0))
+)
+
+
+def get_token_quotas() -> TokenQuotas:
+    return _token_quotas
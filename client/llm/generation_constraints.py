@@ -0,0 +1,91 @@
+import torch
+from dataclasses import dataclass
+from transformers import (
+    LogitsProcessorList,
+    StoppingCriteria,
+    StoppingCriteriaList,
+    SuppressTokensLogitsProcessor
+)
+from typing import Dict, List, Optional, Tuple
+
+
+@dataclass(frozen=True)
+class GenerationConstraints:
+    """生成の早期停止条件と禁止文字列
+
+    各サービスの後処理（_format_reply / _format_excuse）が実際に使う範囲を超えた
+    トークンを生成しないための条件。is_complete() が True になった時点で、
+    それ以降に生成されるテキストは後処理の結果に影響しない。
+    """
+    # 文の区切り文字で数えた文数に達したら停止
+    max_sentences: Optional[int] = None
+    sentence_delimiter: str = "。"
+    # 空でない行が1行完成したら停止（ignored_line_prefixesで始まる行は数えない）
+    stop_at_line_end: bool = False
+    ignored_line_prefixes: Tuple[str, ...] = ()
+    # 生成文字数の上限
+    max_chars: Optional[int] = None
+    # 生成させない文字列（この文字列を含む語彙トークンを抑制する）
+    banned_strings: Tuple[str, ...] = ()
+
+    def is_complete(self, text: str) -> bool:
+        """生成済みテキストが停止条件を満たしているか"""
+        if self.max_chars is not None and len(text.strip()) >= self.max_chars:
+            return True
+
+        if self.max_sentences is not None and text.count(self.sentence_delimiter) >= self.max_sentences:
+            return True
+
+        if self.stop_at_line_end:
+            # 最後の要素は書きかけの行なので除外する
+            for line in text.lstrip().split("\n")[:-1]:
+                line = line.strip()
+                if line and not line.startswith(self.ignored_line_prefixes):
+                    return True
+
+        return False
+
+    def stopping_criteria(self, tokenizer, prompt_length: int) -> StoppingCriteriaList:
+        return StoppingCriteriaList([TextStoppingCriteria(self, tokenizer, prompt_length)])
+
+    def logits_processors(self, tokenizer) -> LogitsProcessorList:
+        suppressed = banned_token_ids(tokenizer, self.banned_strings)
+        if not suppressed:
+            return LogitsProcessorList()
+        return LogitsProcessorList([SuppressTokensLogitsProcessor(suppressed)])
+
+
+class TextStoppingCriteria(StoppingCriteria):
+    """生成済みテキストをデコードして GenerationConstraints の停止条件を判定する"""
+
+    def __init__(self, constraints: GenerationConstraints, tokenizer, prompt_length: int):
+        self.constraints = constraints
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> bool:
+        # 複数シーケンスの場合はすべてが条件を満たしたときだけ停止する
+        texts = self.tokenizer.batch_decode(input_ids[:, self.prompt_length:], skip_special_tokens=True)
+        return all(self.constraints.is_complete(text) for text in texts)
+
+
+_banned_token_cache: Dict[Tuple[int, Tuple[str, ...]], List[int]] = {}
+
+
+def banned_token_ids(tokenizer, banned_strings: Tuple[str, ...]) -> List[int]:
+    """禁止文字列を含む語彙トークンのIDを取得（トークナイザーごとにキャッシュ）
+
+    バイトフォールバックのトークン単体は禁止文字列としてデコードされないため対象外。
+    """
+    if not banned_strings:
+        return []
+
+    key = (id(tokenizer), banned_strings)
+    if key not in _banned_token_cache:
+        vocab_size = len(tokenizer)
+        pieces = tokenizer.batch_decode([[token_id] for token_id in range(vocab_size)])
+        _banned_token_cache[key] = [
+            token_id for token_id, piece in enumerate(pieces)
+            if any(banned in piece for banned in banned_strings)
+        ]
+    return _banned_token_cache[key]
@@ -0,0 +1,84 @@
+import asyncio
+import threading
+import time
+import torch
+from transformers import StoppingCriteria
+from typing import Awaitable, Callable, Optional
+
+# 打ち切りの理由
+DEADLINE = "deadline"
+DISCONNECTED = "disconnected"
+CANCELLED = "cancelled"
+
+
+class GenerationDeadline:
+    """リクエストの締め切りと、クライアントの切断などによる生成の打ち切り
+
+    推論スレッドのデコードループが毎ステップ should_stop() を確認し、締め切りを過ぎるか cancel() された時点で
+    それまでの出力で生成を終える。推論スレッドの順番待ちの間に締め切りを過ぎた場合はprefillもしない。
+    """
+
+    def __init__(self, timeout: Optional[float] = None):
+        self.expires_at = time.monotonic() + timeout if timeout else None
+        self.reason: Optional[str] = None
+        # デコードループが実際に生成を打ち切ったか（生成完了後の切断は含まない）
+        self.interrupted = False
+        self._cancelled = threading.Event()
+
+    def limit(self, timeout: Optional[float]):
+        """締め切りを timeout 秒後までに早める（既に早い締め切りがあればそのまま）"""
+        if not timeout:
+            return
+        expires_at = time.monotonic() + timeout
+        if self.expires_at is None or expires_at < self.expires_at:
+            self.expires_at = expires_at
+
+    def extend(self, other: "GenerationDeadline"):
+        """other の締め切りまでは打ち切らないよう締め切りを延ばす（other に締め切りがなければ締め切りをなくす）"""
+        if other.expires_at is None:
+            self.expires_at = None
+        elif self.expires_at is not None and other.expires_at > self.expires_at:
+            self.expires_at = other.expires_at
+
+    def remaining(self) -> Optional[float]:
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def cancel(self, reason: str = CANCELLED):
+        if self.reason is None:
+            self.reason = reason
+        self._cancelled.set()
+
+    def expired(self) -> bool:
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
+
+    def should_stop(self) -> bool:
+        """デコードループから呼び出し、生成を打ち切るべきかを返す"""
+        if not self._cancelled.is_set() and self.expired():
+            self.cancel(DEADLINE)
+        if self._cancelled.is_set():
+            self.interrupted = True
+            return True
+        return False
+
+    def stopping_criteria(self) -> "DeadlineStoppingCriteria":
+        return DeadlineStoppingCriteria(self)
+
+    async def watch_disconnect(self, is_disconnected: Callable[[], Awaitable[bool]], interval: float = 0.1):
+        """クライアントの切断を監視し、切断されたら生成を打ち切る（締め切りを過ぎたら監視をやめる）"""
+        while not self._cancelled.is_set() and not self.expired():
+            if await is_disconnected():
+                self.cancel(DISCONNECTED)
+                return
+            await asyncio.sleep(interval)
+
+
+class DeadlineStoppingCriteria(StoppingCriteria):
+    """generate() のステップごとに締め切りと切断を確認する"""
+
+    def __init__(self, deadline: GenerationDeadline):
+        self.deadline = deadline
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> bool:
+        return self.deadline.should_stop()
@@ -0,0 +1,297 @@
+import os
+import time
+import numpy as np
+import torch
+from abc import ABC, abstractmethod
+from transformers import (
+    AutoTokenizer,
+    AutoModelForCausalLM,
+    LogitsProcessorList,
+    TemperatureLogitsWarper,
+    TopKLogitsWarper,
+    TopPLogitsWarper
+)
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+import logging
+from client.llm.generation_constraints import GenerationConstraints
+from client.llm.generation_deadline import GenerationDeadline
+from client.llm.model_artifact import MANIFEST_FILE, validate_manifest, weights_format
+from client.llm.precision import apply_precision
+from client.llm.streaming import IncrementalDetokenizer
+
+logger = logging.getLogger(__name__)
+
+# INFERENCE_BACKEND で指定できる推論バックエンド
+INFERENCE_BACKENDS = ("torch", "onnx")
+
+
+class ModelSource(NamedTuple):
+    """from_pretrained() に渡すモデルの場所"""
+    path: str
+    # True の場合はネットワークにアクセスせずローカルのファイルだけでロードする
+    local: bool
+
+
+def resolve_model_source(model_name: str, model_path: str) -> ModelSource:
+    """ローカルに保存済みのモデル成果物があればそのパス、なければHugging Faceのモデル名を返す
+
+    マニフェストの検証に成功したローカル成果物はネットワークにアクセスせずにロードする。
+    マニフェストのない既存のローカルモデルもそのまま使い、検証に失敗した場合はHugging Faceから取得する。
+    """
+    weights = weights_format(model_path)
+    if weights is None:
+        logger.info(f"Hugging Faceからモデルをダウンロード: {model_name}")
+        return ModelSource(model_name, local=False)
+
+    if not os.path.exists(os.path.join(model_path, MANIFEST_FILE)):
+        logger.warning(f"ローカルモデルを使用: {model_path} ({weights}, マニフェストなしのため未検証)")
+        return ModelSource(model_path, local=True)
+
+    verify_checksums = os.getenv("MODEL_ARTIFACT_VERIFY", "checksum").lower() == "checksum"
+    start = time.perf_counter()
+    valid, reason = validate_manifest(model_path, verify_checksums=verify_checksums)
+    if valid:
+        logger.info(
+            f"ローカルモデルを使用: {model_path} ({weights}, マニフェスト検証済み {time.perf_counter() - start:.2f}s)"
+        )
+        return ModelSource(model_path, local=True)
+
+    logger.warning(f"ローカルモデルの検証に失敗したためHugging Faceから取得します: {reason}")
+    return ModelSource(model_name, local=False)
+
+
+def build_logits_processors(
+    tokenizer,
+    temperature: float,
+    top_p: float,
+    do_sample: bool,
+    constraints: Optional[GenerationConstraints] = None,
+    top_k: int = 0
+) -> LogitsProcessorList:
+    """生成制約のロジット処理と、サンプリング時の温度・top-k・top-p を適用するプロセッサ列
+
+    model.generate() と同じ順序（温度 → top-k → top-p）で適用する。top_k=0 の場合は絞らない。
+    """
+    processors = constraints.logits_processors(tokenizer) if constraints is not None else LogitsProcessorList()
+    if do_sample:
+        processors.append(TemperatureLogitsWarper(max(temperature, 1e-5)))
+        if top_k > 0:
+            processors.append(TopKLogitsWarper(top_k))
+        processors.append(TopPLogitsWarper(top_p))
+    return processors
+
+
+class InferenceBackend(ABC):
+    """推論バックエンドの共通インターフェース
+
+    バックエンドはトークナイザーとモデルのロード、prefill（プロンプト全体の入力）、
+    1トークンずつのデコード、埋め込み計算を実装する。KVキャッシュの形式はバックエンドごとに異なり、
+    呼び出し側は prefill / decode_step が返した値をそのまま次の decode_step に渡す。
+    generate() はこれらを使った共通のデコードループで、生成制約とサンプリング設定を適用する。
+    """
+
+    name = "base"
+
+    def __init__(self, model_name: str, model_path: str, device: str, torch_dtype: str, precision: str):
+        self.model_name = model_name
+        self.model_path = model_path
+        self.device = device
+        self.torch_dtype = torch_dtype
+        self.precision = precision
+        self.tokenizer = None
+        # model.generate() と同じくモデルの generation_config の top_k でサンプリング候補を絞る（0は無効）
+        self.top_k = 0
+        # ロード処理のフェーズごとの所要時間（秒）
+        self.load_timings: Dict[str, float] = {}
+
+    @abstractmethod
+    def load(self):
+        """トークナイザーとモデルをロード"""
+
+    @abstractmethod
+    def prefill(self, input_ids: List[int]) -> Tuple[torch.Tensor, Any]:
+        """プロンプトを入力し、最後の位置のロジット (vocab,) とKVキャッシュを返す"""
+
+    @abstractmethod
+    def decode_step(self, token_id: int, past: Any) -> Tuple[torch.Tensor, Any]:
+        """1トークンを入力し、次のトークンのロジット (vocab,) と更新後のKVキャッシュを返す"""
+
+    @abstractmethod
+    def embed(self, token_ids: List[int]) -> np.ndarray:
+        """最終層の隠れ状態を平均プーリングしたL2正規化済みの埋め込みベクトル"""
+
+    @torch.inference_mode()
+    def generate(
+        self,
+        input_ids: List[int],
+        max_new_tokens: int,
+        temperature: float = 0.7,
+        top_p: float = 0.9,
+        do_sample: bool = True,
+        num_return_sequences: int = 1,
+        constraints: Optional[GenerationConstraints] = None,
+        on_token: Optional[Callable[[int], None]] = None,
+        deadline: Optional[GenerationDeadline] = None
+    ) -> List[List[int]]:
+        """新たに生成したトークンID（EOSは含まない）を系列ごとに返す
+
+        複数系列を生成する場合もprefillは1回だけ行い、そのKVキャッシュから各系列をデコードする。
+        deadlineで打ち切った場合は、その時点までに生成したトークンを返す。
+        """
+        if deadline is not None and deadline.should_stop():
+            return [[] for _ in range(num_return_sequences)]
+        eos_token_id = self.tokenizer.eos_token_id
+        processors = build_logits_processors(self.tokenizer, temperature, top_p, do_sample, constraints, self.top_k)
+        prompt_logits, prompt_past = self.prefill(input_ids)
+
+        results = []
+        for _ in range(num_return_sequences):
+            if deadline is not None and deadline.interrupted:
+                # 打ち切った後の系列は生成しない
+                results.append([])
+                continue
+            logits, past = prompt_logits, prompt_past
+            sequence = list(input_ids)
+            generated: List[int] = []
+            # 生成制約の完了判定用に、生成済みのテキストを1トークンずつ差分でデコードする
+            detokenizer = IncrementalDetokenizer(self.tokenizer) if constraints is not None else None
+            text = ""
+            while len(generated) < max_new_tokens:
+                scores = processors(torch.tensor([sequence]), logits[None].float())[0]
+                if do_sample:
+                    token_id = int(torch.multinomial(torch.softmax(scores, dim=-1), num_samples=1))
+                else:
+                    token_id = int(scores.argmax())
+                if token_id == eos_token_id:
+                    break
+
+                sequence.append(token_id)
+                generated.append(token_id)
+                if on_token is not None:
+                    on_token(token_id)
+                if detokenizer is not None:
+                    text += detokenizer.push(token_id)
+                if len(generated) >= max_new_tokens or (
+                    constraints is not None and constraints.is_complete(text)
+                ) or (deadline is not None and deadline.should_stop()):
+                    break
+                logits, past = self.decode_step(token_id, past)
+            results.append(generated)
+        return results
+
+    def _record_timing(self, phase: str, start: float):
+        self.load_timings[phase] = round(time.perf_counter() - start, 3)
+
+    def model_info(self) -> Dict[str, Any]:
+        return {
+            "backend": self.name,
+            "device": self.device,
+            "precision": self.precision
+        }
+
+    def unload(self):
+        self.tokenizer = None
+
+
+class TorchBackend(InferenceBackend):
+    """transformers のPyTorchモデルで推論するバックエンド"""
+
+    name = "torch"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.model = None
+
+    def load(self):
+        start = time.perf_counter()
+        model_source = resolve_model_source(self.model_name, self.model_path)
+        self._record_timing("resolve", start)
+
+        start = time.perf_counter()
+        self.tokenizer = AutoTokenizer.from_pretrained(
+            model_source.path,
+            padding_side="left",
+            local_files_only=model_source.local
+        )
+
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        self._record_timing("tokenizer", start)
+
+        # safetensorsはメモリマップで読み込み、low_cpu_mem_usageで重みの一時コピーを作らずに配置する
+        start = time.perf_counter()
+        self.model = AutoModelForCausalLM.from_pretrained(
+            model_source.path,
+            torch_dtype=getattr(torch, self.torch_dtype),
+            device_map="auto" if self.device == "cuda" else None,
+            low_cpu_mem_usage=True,
+            local_files_only=model_source.local,
+            trust_remote_code=True
+        )
+
+        if self.device == "cpu":
+            self.model = self.model.to(self.device)
+        self._record_timing("weights", start)
+
+        start = time.perf_counter()
+        self.model = apply_precision(self.model, self.precision)
+        self._record_timing("precision", start)
+        self.top_k = getattr(self.model.generation_config, "top_k", None) or 0
+
+    @torch.inference_mode()
+    def prefill(self, input_ids: List[int]) -> Tuple[torch.Tensor, Any]:
+        outputs = self.model(
+            input_ids=torch.tensor([input_ids], device=self.model.device),
+            use_cache=True
+        )
+        return outputs.logits[0, -1], outputs.past_key_values
+
+    @torch.inference_mode()
+    def decode_step(self, token_id: int, past: Any) -> Tuple[torch.Tensor, Any]:
+        outputs = self.model(
+            input_ids=torch.tensor([[token_id]], device=self.model.device),
+            past_key_values=past,
+            use_cache=True
+        )
+        return outputs.logits[0, -1], outputs.past_key_values
+
+    @torch.inference_mode()
+    def embed(self, token_ids: List[int]) -> np.ndarray:
+        outputs = self.model(
+            input_ids=torch.tensor([token_ids], device=self.model.device),
+            output_hidden_states=True,
+            use_cache=False
+        )
+        embedding = outputs.hidden_states[-1][0].float().mean(dim=0)
+        embedding = torch.nn.functional.normalize(embedding, dim=0)
+        return embedding.cpu().numpy()
+
+    def model_info(self) -> Dict[str, Any]:
+        return {
+            **super().model_info(),
+            "torch_dtype": self.torch_dtype,
+            "parameters": self.model.num_parameters() if self.model else None
+        }
+
+    def unload(self):
+        super().unload()
+        self.model = None
+
+
+def create_backend(
+    backend: str,
+    model_name: str,
+    model_path: str,
+    device: str,
+    torch_dtype: str,
+    precision: str
+) -> InferenceBackend:
+    """INFERENCE_BACKEND の値からバックエンドを作成（ロードは呼び出し側で load() を呼ぶ）"""
+    backend = backend.lower()
+    if backend == "torch":
+        return TorchBackend(model_name, model_path, device, torch_dtype, precision)
+    if backend == "onnx":
+        # onnxruntime は任意の依存関係のため、ONNXバックエンドを選んだ場合のみ読み込む
+        from client.llm.onnx_backend import OnnxRuntimeBackend
+        return OnnxRuntimeBackend(model_name, model_path, device, torch_dtype, precision)
+    raise ValueError(f"未対応のINFERENCE_BACKENDです: {backend} (指定可能: {', '.join(INFERENCE_BACKENDS)})")
@@ -0,0 +1,94 @@
+import asyncio
+import functools
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """推論キューが上限に達したときに送出される"""
+
+    def __init__(self, in_flight: int, capacity: int, retry_after: int):
+        super().__init__(f"推論キューが満杯です ({in_flight}/{capacity})")
+        self.in_flight = in_flight
+        self.capacity = capacity
+        self.retry_after = retry_after
+
+
+class InferenceExecutor:
+    """推論専用スレッドで同期的な生成処理を実行し、受付数を制限するエグゼキューター
+
+    実行中と待機中を合わせたリクエスト数が max_concurrency + max_queue_depth に達すると、
+    待たせずに QueueFullError を送出する。
+    """
+
+    def __init__(
+        self,
+        max_workers: int = 1,
+        max_queue_depth: int = 16,
+        max_concurrency: Optional[int] = None
+    ):
+        self.max_workers = max_workers
+        self.max_queue_depth = max_queue_depth
+        self.max_concurrency = max_concurrency or max_workers
+        self.capacity = self.max_concurrency + max_queue_depth
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="inference")
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        # 1リクエストあたりの処理時間の指数移動平均（Retry-Afterの見積もりに使用）
+        self._avg_duration = 1.0
+
+    @contextmanager
+    def reserve(self) -> Iterator[None]:
+        """受付枠を1つ確保する（満杯ならQueueFullError）"""
+        with self._lock:
+            if self._in_flight >= self.capacity:
+                raise QueueFullError(self._in_flight, self.capacity, self._estimate_retry_after())
+            self._in_flight += 1
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            with self._lock:
+                self._in_flight -= 1
+                self._avg_duration = 0.8 * self._avg_duration + 0.2 * duration
+
+    def submit(self, fn: Callable[..., Any], *args, **kwargs) -> asyncio.Future:
+        """同期関数を推論スレッドに投入する（呼び出し側で reserve() 済みであること）"""
+        loop = asyncio.get_running_loop()
+        return loop.run_in_executor(self._executor, functools.partial(fn, *args, **kwargs))
+
+    async def run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """同期関数を推論スレッドで実行し、イベントループをブロックせずに結果を待つ"""
+        with self.reserve():
+            return await self.submit(fn, *args, **kwargs)
+
+    @property
+    def avg_duration(self) -> float:
+        """1リクエストあたりの処理時間の指数移動平均（秒）"""
+        return self._avg_duration
+
+    def _estimate_retry_after(self) -> int:
+        waves = self._in_flight / self.max_concurrency
+        return max(1, math.ceil(waves * self._avg_duration))
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "in_flight": self._in_flight,
+                "capacity": self.capacity,
+                "max_queue_depth": self.max_queue_depth,
+                "avg_duration_seconds": round(self._avg_duration, 3)
+            }
@@ -0,0 +1,135 @@
+import os
+import json
+import struct
+import hashlib
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = "model_manifest.json"
+MANIFEST_VERSION = 1
+
+# ローカル成果物として認識する重みファイル（safetensorsを優先）
+SAFETENSORS_FILES = ("model.safetensors", "model.safetensors.index.json")
+PYTORCH_FILES = ("pytorch_model.bin", "pytorch_model.bin.index.json")
+
+# safetensorsヘッダーのdtype -> torchのdtype名
+SAFETENSORS_DTYPES = {
+    "F32": "float32",
+    "F16": "float16",
+    "BF16": "bfloat16",
+}
+
+_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def weights_format(model_dir: str) -> Optional[str]:
+    """ディレクトリ内の重みの形式（"safetensors" / "pytorch"、なければ None）"""
+    if not model_dir or not os.path.isdir(model_dir):
+        return None
+    if any(os.path.exists(os.path.join(model_dir, name)) for name in SAFETENSORS_FILES):
+        return "safetensors"
+    if any(os.path.exists(os.path.join(model_dir, name)) for name in PYTORCH_FILES):
+        return "pytorch"
+    return None
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def config_hash(model_dir: str) -> str:
+    """config.json の内容のハッシュ（キー順や空白の違いは無視する）"""
+    with open(os.path.join(model_dir, "config.json"), encoding="utf-8") as f:
+        config = json.load(f)
+    canonical = json.dumps(config, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def safetensors_dtype(model_dir: str) -> Optional[str]:
+    """safetensorsのヘッダーから浮動小数点の重みのdtypeを読み取る（テンソル本体は読まない）"""
+    files = sorted(name for name in os.listdir(model_dir) if name.endswith(".safetensors"))
+    dtypes = set()
+    for name in files:
+        with open(os.path.join(model_dir, name), "rb") as f:
+            header_size = struct.unpack("<Q", f.read(8))[0]
+            header = json.loads(f.read(header_size))
+        dtypes.update(
+            SAFETENSORS_DTYPES[tensor["dtype"]]
+            for key, tensor in header.items()
+            if key != "__metadata__" and tensor["dtype"] in SAFETENSORS_DTYPES
+        )
+    if len(dtypes) > 1:
+        return "mixed"
+    return dtypes.pop() if dtypes else None
+
+
+def _artifact_files(model_dir: str):
+    return sorted(
+        name for name in os.listdir(model_dir)
+        if name != MANIFEST_FILE and os.path.isfile(os.path.join(model_dir, name))
+    )
+
+
+def write_manifest(model_dir: str, model_name: str) -> Dict[str, Any]:
+    """ディレクトリ内の全ファイルのチェックサム・dtype・設定ハッシュをマニフェストに記録する"""
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "model_name": model_name,
+        "format": weights_format(model_dir),
+        "dtype": safetensors_dtype(model_dir),
+        "config_hash": config_hash(model_dir),
+        "files": {
+            name: {
+                "size": os.path.getsize(os.path.join(model_dir, name)),
+                "sha256": file_sha256(os.path.join(model_dir, name))
+            }
+            for name in _artifact_files(model_dir)
+        },
+        "created_at": datetime.now(timezone.utc).isoformat()
+    }
+    with open(os.path.join(model_dir, MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    logger.info(f"モデルのマニフェストを作成: {model_dir} ({len(manifest['files'])} ファイル, dtype: {manifest['dtype']})")
+    return manifest
+
+
+def validate_manifest(model_dir: str, verify_checksums: bool = True) -> Tuple[bool, str]:
+    """ローカル成果物をマニフェストと照合し、(有効か, 理由) を返す
+
+    verify_checksums=False の場合はファイルサイズのみ確認する（大きなモデルの起動を速くしたい場合）。
+    """
+    manifest_path = os.path.join(model_dir, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return False, "マニフェストがありません"
+    try:
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        return False, f"マニフェストを読み込めません: {str(e)}"
+
+    if manifest.get("version") != MANIFEST_VERSION:
+        return False, f"未対応のマニフェストバージョン: {manifest.get('version')}"
+
+    for name, expected in manifest.get("files", {}).items():
+        path = os.path.join(model_dir, name)
+        if not os.path.exists(path):
+            return False, f"ファイルがありません: {name}"
+        if os.path.getsize(path) != expected["size"]:
+            return False, f"ファイルサイズが一致しません: {name}"
+        if verify_checksums and file_sha256(path) != expected["sha256"]:
+            return False, f"チェックサムが一致しません: {name}"
+
+    if config_hash(model_dir) != manifest.get("config_hash"):
+        return False, "config.json のハッシュが一致しません"
+
+    if manifest.get("format") == "safetensors" and safetensors_dtype(model_dir) != manifest.get("dtype"):
+        return False, f"重みのdtypeがマニフェスト({manifest.get('dtype')})と一致しません"
+
+    return True, "OK"
@@ -1,75 +1,199 @@
 import os
+import gc
+import time
+import asyncio
+import numpy as np
 import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM, pipeline
-from typing import Dict, Any, Optional
+from transformers import AutoTokenizer, AutoModelForCausalLM, StoppingCriteriaList
+from typing import AsyncIterator, Dict, Any, List, Optional
 import logging
 from dotenv import load_dotenv
+from client.llm.batching_engine import ContinuousBatchingEngine
+from client.llm.inference_executor import InferenceExecutor, QueueFullError
+from client.llm.fair_scheduler import FairScheduler, QuotaExceededError, Tenant, get_token_quotas, parse_weights
+from client.llm.streaming import IncrementalDetokenizer, TokenCallbackStreamer
+from client.llm.generation_constraints import GenerationConstraints
+from client.llm.generation_deadline import CANCELLED, DISCONNECTED, GenerationDeadline
+from client.llm.prefix_cache import PrefixCache, PrefixEntry, past_nbytes
+from client.llm.precision import PRECISION_DTYPES, apply_precision, resolve_precision
+from client.llm.prompt_lookup import PromptLookupDecoder
+from client.llm.inference_backend import create_backend, resolve_model_source
+from client.metrics.generation_metrics import (
+    MODEL_RESIDENT_MEMORY_BYTES,
+    TOKENIZATION_SECONDS,
+    GenerationTimer,
+    current_rss_bytes,
+    observe_generation,
+    record_cancellation,
+    record_error,
+    with_timing_criteria
+)
 
 load_dotenv()
 logger = logging.getLogger(__name__)
 
 
+def resolve_torch_dtype(device: str, torch_dtype: Optional[str] = None, precision: Optional[str] = None) -> str:
+    """モデルをロードするdtype名を決定（明示指定がなければ精度モードから決める）"""
+    if torch_dtype:
+        return torch_dtype
+    return PRECISION_DTYPES[resolve_precision(device, precision)]
+
+
 class ModelClient:
-    def __init__(self):
-        self.model_name = os.getenv("MODEL_NAME", "microsoft/DialoGPT-medium")
-        self.model_path = os.getenv("MODEL_PATH", "./data/models")
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+    # 埋め込み計算に使う最大トークン数（末尾側を使用）
+    EMBEDDING_MAX_TOKENS = 256
+
+    def __init__(
+        self,
+        model_name: Optional[str] = None,
+        model_path: Optional[str] = None,
+        torch_dtype: Optional[str] = None,
+        precision: Optional[str] = None,
+        backend: Optional[str] = None,
+        start_engine: bool = True
+    ):
+        self.model_name = model_name or os.getenv("MODEL_NAME", "microsoft/DialoGPT-medium")
+        self.model_path = model_path or os.getenv("MODEL_PATH", "./data/models")
+        # 推論バックエンド（torch / onnx）。ONNX Runtimeバックエンドは常にCPUで推論する
+        self.backend_name = (backend or os.getenv("INFERENCE_BACKEND", "torch")).lower()
+        self.device = "cuda" if torch.cuda.is_available() and self.backend_name == "torch" else "cpu"
+        # 推論精度モード（fp32 / fp16 / bf16 / int8）
+        self.precision = resolve_precision(self.device, precision or os.getenv("MODEL_PRECISION"))
+        self.torch_dtype = resolve_torch_dtype(self.device, torch_dtype, self.precision)
+        self.backend = None
+        # ロード処理のフェーズごとの所要時間（秒）
+        self.load_timings: Dict[str, float] = {}
         self.tokenizer = None
         self.model = None
-        self.pipeline = None
-        self._load_model()
+        self.engine = None
+        # 投機的デコード（assisted generation）用のドラフトモデル（未指定なら無効）
+        self.draft_model_name = os.getenv("DRAFT_MODEL_NAME") or None
+        self.draft_model_path = os.getenv("DRAFT_MODEL_PATH", "")
+        self.draft_num_tokens = int(os.getenv("DRAFT_NUM_TOKENS", 5))
+        self.draft_model = None
+        # プロンプトのn-gramを候補にする投機的デコード（リクエスト単位で有効化する）
+        self.prompt_lookup = None
+        self.batching_enabled = os.getenv("INFERENCE_BATCHING", "false").lower() == "true"
+        self.max_batch_size = int(os.getenv("INFERENCE_MAX_BATCH_SIZE", 8))
+        # 生成はイベントループ外の推論スレッドで実行し、受付数を制限する
+        self.executor = InferenceExecutor(
+            max_workers=int(os.getenv("INFERENCE_WORKERS", 1)),
+            max_queue_depth=int(os.getenv("INFERENCE_MAX_QUEUE_DEPTH", 16)),
+            max_concurrency=self.max_batch_size if self.batching_enabled else None
+        )
+        # 推論の実行枠はチャンネル間の重み付き公平キューイングで割り当て、テナントごとのトークン予算を適用する
+        self.scheduler = FairScheduler(self.executor, get_token_quotas(), parse_weights(os.getenv("TENANT_WEIGHTS", "")))
+        # 固定プロンプトプレフィックスのKVキャッシュ
+        self.prefix_cache = None
+        if os.getenv("PREFIX_CACHE_ENABLED", "true").lower() == "true":
+            self.prefix_cache = PrefixCache(
+                max_bytes=int(os.getenv("PREFIX_CACHE_MAX_MB", 256)) * 1024 * 1024
+            )
+        rss_before = current_rss_bytes()
+        self._load_model(start_engine)
+        MODEL_RESIDENT_MEMORY_BYTES.labels(self.model_name).set(max(current_rss_bytes() - rss_before, 0))
     
-    def _load_model(self):
+    def _load_model(self, start_engine: bool = True):
         try:
-            logger.info(f"モデルをロード中: {self.model_name}")
-            
-            if os.path.exists(os.path.join(self.model_path, "pytorch_model.bin")):
-                logger.info(f"ローカルモデルを使用: {self.model_path}")
-                model_path = self.model_path
-            else:
-                logger.info(f"Hugging Faceからモデルをダウンロード: {self.model_name}")
-                model_path = self.model_name
+            logger.info(f"モデルをロード中: {self.model_name} (バックエンド: {self.backend_name})")
             
-            self.tokenizer = AutoTokenizer.from_pretrained(
-                model_path,
-                padding_side="left"
+            self.backend = create_backend(
+                self.backend_name,
+                self.model_name,
+                self.model_path,
+                self.device,
+                self.torch_dtype,
+                self.precision
             )
+            self.backend.load()
+            self.tokenizer = self.backend.tokenizer
+            self.load_timings = dict(self.backend.load_timings)
             
-            if self.tokenizer.pad_token is None:
-                self.tokenizer.pad_token = self.tokenizer.eos_token
+            if self.backend_name != "torch":
+                # プレフィックスキャッシュ・投機的デコード・連続バッチングはPyTorchモデル専用
+                self.prefix_cache = None
+                self._log_load_timings()
+                logger.info(f"モデルのロードが完了 (バックエンド: {self.backend.name}, 精度: {self.precision})")
+                return
             
-            self.model = AutoModelForCausalLM.from_pretrained(
-                model_path,
-                torch_dtype=torch.float16 if self.device == "cuda" else torch.float32,
-                device_map="auto" if self.device == "cuda" else None,
-                trust_remote_code=True
-            )
+            self.model = self.backend.model
             
-            if self.device == "cpu":
-                self.model = self.model.to(self.device)
+            if self.draft_model_name:
+                start = time.perf_counter()
+                self._load_draft_model()
+                self._record_timing("draft_model", start)
             
-            # accelerateでロードされている場合はdeviceを指定しない
-            pipeline_kwargs = {
-                "model": self.model,
-                "tokenizer": self.tokenizer
-            }
+            self.prompt_lookup = PromptLookupDecoder(
+                self.model,
+                self.tokenizer,
+                max_ngram_size=int(os.getenv("PROMPT_LOOKUP_MAX_NGRAM", 3)),
+                num_pred_tokens=int(os.getenv("PROMPT_LOOKUP_NUM_TOKENS", 10))
+            )
             
-            # accelerateが使われていない場合のみdeviceを指定
-            try:
-                self.pipeline = pipeline("text-generation", **pipeline_kwargs)
-            except ValueError as e:
-                if "accelerate" not in str(e):
-                    # accelerate以外のエラーの場合は再発生
-                    raise
-                # accelerateが使われている場合はdeviceを指定せずに再試行
-                self.pipeline = pipeline("text-generation", **pipeline_kwargs)
+            if self.batching_enabled and start_engine:
+                start = time.perf_counter()
+                self._start_engine()
+                self._record_timing("engine", start)
             
-            logger.info(f"モデルのロードが完了 (デバイス: {self.device})")
+            self._log_load_timings()
+            logger.info(f"モデルのロードが完了 (デバイス: {self.device}, dtype: {self.torch_dtype}, 精度: {self.precision})")
             
         except Exception as e:
             logger.error(f"モデルロードエラー: {str(e)}")
             raise
     
+    def _start_engine(self):
+        self.engine = ContinuousBatchingEngine(
+            self.model,
+            self.tokenizer,
+            max_batch_size=self.max_batch_size
+        )
+        self.engine.start()
+    
+    def _record_timing(self, phase: str, start: float):
+        self.load_timings[phase] = round(time.perf_counter() - start, 3)
+    
+    def _log_load_timings(self):
+        """起動時間の内訳をログに出力（コールドスタートの回帰を追跡するため）"""
+        phases = ", ".join(f"{phase}={seconds:.2f}s" for phase, seconds in self.load_timings.items())
+        logger.info(f"モデルロード時間: 合計 {sum(self.load_timings.values()):.2f}s ({phases})")
+    
+    def _load_draft_model(self):
+        """ドラフトモデルをロード（トークナイザーが一致しない場合やロード失敗時は無効化する）"""
+        try:
+            draft_source = resolve_model_source(self.draft_model_name, self.draft_model_path)
+            logger.info(f"ドラフトモデルをロード中: {draft_source.path}")
+            
+            draft_tokenizer = AutoTokenizer.from_pretrained(draft_source.path, local_files_only=draft_source.local)
+            if not self._tokenizers_match(draft_tokenizer):
+                logger.warning(f"ドラフトモデルのトークナイザーが一致しないため投機的デコードを無効化: {draft_source.path}")
+                return
+            
+            draft_model = AutoModelForCausalLM.from_pretrained(
+                draft_source.path,
+                torch_dtype=getattr(torch, self.torch_dtype),
+                low_cpu_mem_usage=True,
+                local_files_only=draft_source.local,
+                trust_remote_code=True
+            ).to(self.model.device)
+            draft_model = apply_precision(draft_model, self.precision)
+            draft_model.generation_config.num_assistant_tokens = self.draft_num_tokens
+            self.draft_model = draft_model
+            logger.info(f"ドラフトモデルのロードが完了 (提案トークン数: {self.draft_num_tokens})")
+            
+        except Exception as e:
+            logger.warning(f"ドラフトモデルのロードに失敗したため投機的デコードを無効化: {str(e)}")
+            self.draft_model = None
+    
+    def _tokenizers_match(self, other) -> bool:
+        """ドラフトモデルのトークナイザーが本体と同じトークンIDを使うか"""
+        return (
+            other.get_vocab() == self.tokenizer.get_vocab()
+            and other.eos_token_id == self.tokenizer.eos_token_id
+            and other.bos_token_id == self.tokenizer.bos_token_id
+        )
+    
     async def generate_text(
         self,
         prompt: str,
@@ -78,64 +202,663 @@ class ModelClient:
         temperature: float = 0.7,
         top_p: float = 0.9,
         do_sample: bool = True,
-        num_return_sequences: int = 1
+        num_return_sequences: int = 1,
+        constraints: Optional[GenerationConstraints] = None,
+        prefix: Optional[str] = None,
+        assisted: Optional[bool] = None,
+        prompt_lookup: bool = False,
+        endpoint: str = "default",
+        deadline: Optional[GenerationDeadline] = None,
+        tenant: Optional[Tenant] = None
     ) -> Dict[str, Any]:
+        """テキストを生成
+
+        prefixにプロンプト先頭の固定部分を渡すと、そのKVキャッシュを再利用して残りだけをprefillする。
+        ドラフトモデルがロードされている場合、単一系列の生成はドラフトモデルの提案を本体で検証する
+        投機的デコードで行う（assisted=False で無効化できる）。
+        prompt_lookup=True の場合はプロンプト中のn-gramを候補にする投機的デコードで生成し、
+        結果に候補の採用率を含める。
+        endpointは /metrics のラベルに使う呼び出し元の名前。
+        deadlineの締め切りを過ぎるか打ち切られた場合は、その時点までの出力を返し、結果の stopped に理由を入れる。
+        tenantはスケジューラーの公平キューイングとトークン予算の単位（予算超過時は QuotaExceededError）。
+        """
+        deadline = deadline or GenerationDeadline()
+        tenant = tenant or Tenant()
         try:
-            if not self.pipeline:
+            if self.backend is None:
                 raise RuntimeError("モデルが初期化されていません")
             
             logger.info(f"テキスト生成開始: {prompt[:50]}...")
             
-            # プロンプトの長さを取得
-            input_tokens = len(self.tokenizer.encode(prompt))
+            # プロンプトは一度だけトークン化し、長さの確認と生成の両方に使う（特殊トークンは付与しない）
+            start = time.perf_counter()
+            input_ids = self._encode_prompt(prompt, prefix)
+            TOKENIZATION_SECONDS.labels(endpoint, self.model_name).observe(time.perf_counter() - start)
+            input_tokens = len(input_ids)
             logger.info(f"プロンプトトークン数: {input_tokens}")
             
-            generation_config = {
-                "temperature": temperature,
-                "top_p": top_p,
-                "do_sample": do_sample,
-                "num_return_sequences": num_return_sequences,
-                "pad_token_id": self.tokenizer.pad_token_id,
-                "eos_token_id": self.tokenizer.eos_token_id,
-                "return_full_text": False
-            }
+            generation_config = self._build_generation_config(
+                input_tokens,
+                max_length=max_length,
+                max_new_tokens=max_new_tokens,
+                temperature=temperature,
+                top_p=top_p,
+                do_sample=do_sample,
+                num_return_sequences=num_return_sequences
+            )
+            # 公平キューイングと予算の予約には、プロンプトと最大生成トークン数（候補数分）の見積もりを使う
+            estimate = input_tokens + self._max_new_tokens(input_tokens, generation_config) * num_return_sequences
             
-            # max_new_tokensが指定されている場合はそれを使用、そうでなければmax_lengthを使用
-            if max_new_tokens is not None:
-                generation_config["max_new_tokens"] = max_new_tokens
-                logger.info(f"max_new_tokens使用: {max_new_tokens}")
-            else:
-                generation_config["max_length"] = max_length
-                logger.info(f"max_length使用: {max_length}")
-                if input_tokens >= max_length:
-                    logger.warning(f"プロンプトトークン数({input_tokens})がmax_length({max_length})以上です")
-                    generation_config["max_new_tokens"] = 50  # 最低限の生成を保証
-                    generation_config.pop("max_length")
+            # プロンプト参照の投機的デコード（本体モデルのみで検証するためプレフィックスキャッシュと併用できる）
+            if prompt_lookup and self.prompt_lookup is not None and num_return_sequences == 1:
+                async with self.scheduler.slot({tenant: estimate}, deadline) as ticket:
+                    prefix_entry = await self._resolve_prefix(prompt, prefix)
+                    timer = GenerationTimer()
+                    generated_ids, speculation = await self.executor.submit(
+                        timer.wrap(self.prompt_lookup.generate),
+                        input_ids,
+                        max_new_tokens=self._max_new_tokens(input_tokens, generation_config),
+                        temperature=temperature,
+                        top_p=top_p,
+                        do_sample=do_sample,
+                        constraints=constraints,
+                        prefix_entry=prefix_entry,
+                        on_token=timer.on_token,
+                        deadline=deadline
+                    )
+                    ticket.charge(tenant, input_tokens + len(generated_ids))
+                observe_generation(endpoint, self.model_name, timer, input_tokens, len(generated_ids))
+                generated_text = self.tokenizer.decode(generated_ids, skip_special_tokens=True)
+                logger.info(
+                    f"テキスト生成完了: {len(generated_text)} 文字 "
+                    f"(プロンプト参照, 採用率: {speculation['acceptance_rate']:.2f})"
+                )
+                
+                return {
+                    "generated_text": generated_text,
+                    "prompt": prompt,
+                    "config": {**generation_config, "prompt_lookup": True, "prefix_cached": prefix_entry is not None},
+                    "prompt_tokens": input_tokens,
+                    "generated_tokens": len(generated_ids),
+                    "speculation": speculation,
+                    **self._interruption(deadline, endpoint)
+                }
             
-            results = self.pipeline(prompt, **generation_config)
+            # 投機的デコードはバッチサイズ1でのみ利用できる
+            use_assisted = self.draft_model is not None and num_return_sequences == 1 and assisted is not False
             
-            if isinstance(results, list) and len(results) > 0:
-                generated_text = results[0]["generated_text"]
-            else:
-                generated_text = "生成に失敗しました"
+            # 連続バッチングエンジンが有効なら他のリクエストと同じデコードループで生成
+            if self.engine is not None and num_return_sequences == 1 and not use_assisted:
+                async with self.scheduler.slot({tenant: estimate}, deadline) as ticket:
+                    prefix_entry = await self._resolve_prefix(prompt, prefix)
+                    timer = GenerationTimer()
+                    engine_result = await self.engine.generate(
+                        input_ids,
+                        max_new_tokens=self._max_new_tokens(input_tokens, generation_config),
+                        temperature=temperature,
+                        top_p=top_p,
+                        do_sample=do_sample,
+                        constraints=constraints,
+                        prefix_entry=prefix_entry,
+                        on_token=timer.on_token,
+                        on_admit=timer.start,
+                        deadline=deadline
+                    )
+                    ticket.charge(tenant, input_tokens + engine_result["generated_tokens"])
+                observe_generation(endpoint, self.model_name, timer, input_tokens, engine_result["generated_tokens"])
+                generated_text = engine_result["generated_text"]
+                logger.info(f"テキスト生成完了: {len(generated_text)} 文字 (連続バッチング)")
+                
+                return {
+                    "generated_text": generated_text,
+                    "prompt": prompt,
+                    "config": {**generation_config, "engine": "continuous_batching"},
+                    "prompt_tokens": input_tokens,
+                    "generated_tokens": engine_result["generated_tokens"],
+                    **self._interruption(deadline, endpoint)
+                }
+            
+            # PyTorch以外のバックエンドは共通のデコードループで生成（複数候補もprefillは1回）
+            if self.model is None:
+                async with self.scheduler.slot({tenant: estimate}, deadline) as ticket:
+                    timer = GenerationTimer()
+                    generated_ids = await self.executor.submit(
+                        timer.wrap(self.backend.generate),
+                        input_ids,
+                        max_new_tokens=self._max_new_tokens(input_tokens, generation_config),
+                        temperature=temperature,
+                        top_p=top_p,
+                        do_sample=do_sample,
+                        num_return_sequences=num_return_sequences,
+                        constraints=constraints,
+                        on_token=timer.on_token,
+                        deadline=deadline
+                    )
+                    ticket.charge(tenant, input_tokens + self._count_generated(generated_ids))
+                observe_generation(endpoint, self.model_name, timer, input_tokens, self._count_generated(generated_ids))
+                generated_texts = self.tokenizer.batch_decode(generated_ids, skip_special_tokens=True)
+                logger.info(f"テキスト生成完了: {len(generated_texts[0])} 文字 ({self.backend.name})")
+                
+                return {
+                    "generated_text": generated_texts[0],
+                    "generated_texts": generated_texts,
+                    "prompt": prompt,
+                    "config": {**generation_config, "backend": self.backend.name},
+                    "prompt_tokens": input_tokens,
+                    "generated_tokens": len(generated_ids[0]),
+                    **self._interruption(deadline, endpoint)
+                }
             
-            logger.info(f"テキスト生成完了: {len(generated_text)} 文字")
+            # model.generate() を直接呼び出し、トークン化済みのIDをそのまま入力して新たに生成したIDだけをデコードする
+            async with self.scheduler.slot({tenant: estimate}, deadline) as ticket:
+                # ドラフトモデルは本体のKVキャッシュを使えないためプレフィックスキャッシュとは併用しない
+                prefix_entry = None if use_assisted else await self._resolve_prefix(prompt, prefix)
+                timer = GenerationTimer()
+                output_ids = await self.executor.submit(
+                    timer.wrap(self._generate_ids),
+                    input_ids,
+                    generation_config,
+                    constraints=constraints,
+                    prefix_entry=prefix_entry,
+                    assistant_model=self.draft_model if use_assisted else None,
+                    timer=timer,
+                    deadline=deadline
+                )
+                ticket.charge(tenant, input_tokens + self._count_generated(output_ids))
+            observe_generation(endpoint, self.model_name, timer, input_tokens, self._count_generated(output_ids))
+            generated_texts = self.tokenizer.batch_decode(output_ids, skip_special_tokens=True)
+            logger.info(f"テキスト生成完了: {len(generated_texts)} 候補, {len(generated_texts[0])} 文字")
             
             return {
-                "generated_text": generated_text,
+                "generated_text": generated_texts[0],
+                "generated_texts": generated_texts,
                 "prompt": prompt,
-                "config": generation_config
+                "config": {
+                    **generation_config,
+                    "prefix_cached": prefix_entry is not None,
+                    "assisted": use_assisted
+                },
+                "prompt_tokens": input_tokens,
+                "generated_tokens": self._count_generated(output_ids[:1]),
+                **self._interruption(deadline, endpoint)
             }
             
+        except asyncio.CancelledError:
+            # 呼び出し元がキャンセルされた場合は推論スレッドでの生成も打ち切り、受付枠はすぐに返却する
+            deadline.cancel(CANCELLED)
+            record_cancellation(endpoint, self.model_name, CANCELLED)
+            raise
+        except (QueueFullError, QuotaExceededError):
+            # 過負荷・予算超過はフォールバックせず呼び出し元に伝える
+            raise
         except Exception as e:
             logger.error(f"テキスト生成エラー: {str(e)}")
+            record_error(endpoint, self.model_name, e)
             return {
                 "generated_text": "申し訳ございません、システムエラーが発生しました。",
                 "prompt": prompt,
                 "error": str(e)
             }
     
+    async def generate_batch(
+        self,
+        prompts: List[str],
+        max_length: int = 512,
+        max_new_tokens: int = None,
+        temperature: float = 0.7,
+        top_p: float = 0.9,
+        do_sample: bool = True,
+        constraints: Optional[GenerationConstraints] = None,
+        endpoint: str = "default",
+        deadline: Optional[GenerationDeadline] = None,
+        tenants: Optional[List[Tenant]] = None
+    ) -> List[Dict[str, Any]]:
+        """複数プロンプトを左パディングしたバッチでまとめて生成
+
+        プロンプトは一度にトークン化し、長さ順に並べて max_batch_size ごとのバケットに分けることで
+        パディングの無駄を抑える。結果は入力順に返し、失敗したバケットの要素には "error" を含める。
+        deadlineで打ち切った場合は各要素の stopped に理由を入れる（以降のバケットは生成しない）。
+        tenantsは要素ごとのテナントで、バケットごとに各テナントの見積もりトークン数でスケジューラーの実行枠を確保する。
+        """
+        if self.backend is None:
+            raise RuntimeError("モデルが初期化されていません")
+        deadline = deadline or GenerationDeadline()
+        tenants = tenants or [Tenant()] * len(prompts)
+        
+        start = time.perf_counter()
+        encodings = self.tokenizer(prompts, add_special_tokens=False)["input_ids"]
+        TOKENIZATION_SECONDS.labels(endpoint, self.model_name).observe(time.perf_counter() - start)
+        order = sorted(range(len(prompts)), key=lambda i: len(encodings[i]))
+        buckets = [order[i:i + self.max_batch_size] for i in range(0, len(order), self.max_batch_size)]
+        logger.info(f"バッチ生成開始: {len(prompts)} 件, {len(buckets)} バケット")
+        
+        results: List[Optional[Dict[str, Any]]] = [None] * len(prompts)
+        for bucket in buckets:
+            bucket_ids = [encodings[i] for i in bucket]
+            longest = max(len(ids) for ids in bucket_ids)
+            generation_config = self._build_generation_config(
+                longest,
+                max_length=max_length,
+                max_new_tokens=max_new_tokens,
+                temperature=temperature,
+                top_p=top_p,
+                do_sample=do_sample
+            )
+            # パディング後の長さに依存しないよう生成トークン数で指定する
+            generation_config["max_new_tokens"] = self._max_new_tokens(longest, generation_config)
+            generation_config.pop("max_length", None)
+            
+            shares: Dict[Tenant, int] = {}
+            for index in bucket:
+                shares[tenants[index]] = shares.get(tenants[index], 0) + len(encodings[index]) + generation_config["max_new_tokens"]
+            
+            try:
+                async with self.scheduler.slot(shares, deadline) as ticket:
+                    timer = GenerationTimer()
+                    output_ids = await self.executor.submit(
+                        timer.wrap(self._generate_padded),
+                        bucket_ids,
+                        generation_config,
+                        constraints=constraints,
+                        timer=timer,
+                        deadline=deadline
+                    )
+                    for row, index in enumerate(bucket):
+                        ticket.charge(tenants[index], len(encodings[index]) + self._count_generated(output_ids[row:row + 1]))
+                observe_generation(
+                    endpoint,
+                    self.model_name,
+                    timer,
+                    sum(len(ids) for ids in bucket_ids),
+                    self._count_generated(output_ids)
+                )
+                generated_texts = self.tokenizer.batch_decode(output_ids, skip_special_tokens=True)
+                padding = sum(longest - len(ids) for ids in bucket_ids)
+                logger.info(f"バケット生成完了: {len(bucket)} 件, 最大 {longest} トークン, パディング {padding} トークン")
+                
+                for row, (index, generated_text) in enumerate(zip(bucket, generated_texts)):
+                    results[index] = {
+                        "generated_text": generated_text,
+                        "prompt": prompts[index],
+                        "config": {**generation_config, "engine": "padded_batch"},
+                        "prompt_tokens": len(encodings[index]),
+                        "generated_tokens": self._count_generated(output_ids[row:row + 1])
+                    }
+            except asyncio.CancelledError:
+                deadline.cancel(CANCELLED)
+                record_cancellation(endpoint, self.model_name, CANCELLED)
+                raise
+            except (QueueFullError, QuotaExceededError):
+                raise
+            except Exception as e:
+                logger.error(f"バッチ生成エラー: {str(e)}")
+                record_error(endpoint, self.model_name, e)
+                for index in bucket:
+                    results[index] = {
+                        "generated_text": "申し訳ございません、システムエラーが発生しました。",
+                        "prompt": prompts[index],
+                        "error": str(e)
+                    }
+        
+        stopped = self._interruption(deadline, endpoint)
+        return [{**result, **stopped} if "error" not in result else result for result in results]
+    
+    async def stream_text(
+        self,
+        prompt: str,
+        max_length: int = 512,
+        max_new_tokens: int = None,
+        temperature: float = 0.7,
+        top_p: float = 0.9,
+        do_sample: bool = True,
+        constraints: Optional[GenerationConstraints] = None,
+        prefix: Optional[str] = None,
+        endpoint: str = "default",
+        deadline: Optional[GenerationDeadline] = None,
+        tenant: Optional[Tenant] = None
+    ) -> AsyncIterator[str]:
+        """生成されたテキストを確定した差分ごとに順次返す
+
+        deadlineの締め切りを過ぎるか打ち切られた場合は、その時点までで終了する。
+        呼び出し元が最後まで読まずに終了した場合（クライアントの切断など）は推論スレッドでの生成も打ち切る。
+        tenantの予算にはそれまでに生成したトークン数を計上する。
+        """
+        if self.backend is None:
+            raise RuntimeError("モデルが初期化されていません")
+        deadline = deadline or GenerationDeadline()
+        tenant = tenant or Tenant()
+        
+        logger.info(f"ストリーミング生成開始: {prompt[:50]}...")
+        
+        start = time.perf_counter()
+        input_ids = self._encode_prompt(prompt, prefix)
+        TOKENIZATION_SECONDS.labels(endpoint, self.model_name).observe(time.perf_counter() - start)
+        generation_config = self._build_generation_config(
+            len(input_ids),
+            max_length=max_length,
+            max_new_tokens=max_new_tokens,
+            temperature=temperature,
+            top_p=top_p,
+            do_sample=do_sample
+        )
+        
+        # 推論スレッドから受け取ったトークンIDをイベントループ側でデトークナイズする
+        loop = asyncio.get_running_loop()
+        token_queue: asyncio.Queue = asyncio.Queue()
+        
+        def on_token(token_id: int):
+            timer.on_token(token_id)
+            loop.call_soon_threadsafe(token_queue.put_nowait, token_id)
+        
+        estimate = len(input_ids) + self._max_new_tokens(len(input_ids), generation_config)
+        async with self.scheduler.slot({tenant: estimate}, deadline) as ticket:
+            # ドラフトモデルがあれば投機的デコード（バッチサイズ1、プレフィックスキャッシュなし）で生成
+            use_assisted = self.draft_model is not None
+            prefix_entry = None if use_assisted else await self._resolve_prefix(prompt, prefix)
+            timer = GenerationTimer()
+            if self.engine is not None and not use_assisted:
+                generation = asyncio.ensure_future(self.engine.generate(
+                    input_ids,
+                    max_new_tokens=self._max_new_tokens(len(input_ids), generation_config),
+                    temperature=temperature,
+                    top_p=top_p,
+                    do_sample=do_sample,
+                    constraints=constraints,
+                    prefix_entry=prefix_entry,
+                    on_token=on_token,
+                    on_admit=timer.start,
+                    deadline=deadline
+                ))
+            elif self.model is None:
+                generation = self.executor.submit(
+                    timer.wrap(self.backend.generate),
+                    input_ids,
+                    max_new_tokens=self._max_new_tokens(len(input_ids), generation_config),
+                    temperature=temperature,
+                    top_p=top_p,
+                    do_sample=do_sample,
+                    constraints=constraints,
+                    on_token=on_token,
+                    deadline=deadline
+                )
+            else:
+                generation = self.executor.submit(
+                    timer.wrap(self._generate_ids),
+                    input_ids,
+                    generation_config,
+                    constraints=constraints,
+                    prefix_entry=prefix_entry,
+                    streamer=TokenCallbackStreamer(on_token),
+                    assistant_model=self.draft_model,
+                    deadline=deadline
+                )
+            generation.add_done_callback(lambda _: token_queue.put_nowait(None))
+            
+            detokenizer = IncrementalDetokenizer(self.tokenizer)
+            try:
+                while True:
+                    token_id = await token_queue.get()
+                    if token_id is None:
+                        break
+                    delta = detokenizer.push(token_id)
+                    if delta:
+                        yield delta
+                
+                # 生成側の例外はここで呼び出し元に伝える
+                await generation
+                observe_generation(endpoint, self.model_name, timer, len(input_ids), len(detokenizer.token_ids))
+                self._interruption(deadline, endpoint)
+                tail = detokenizer.flush()
+                if tail:
+                    yield tail
+            finally:
+                if not generation.done():
+                    deadline.cancel(DISCONNECTED)
+                    record_cancellation(endpoint, self.model_name, DISCONNECTED)
+                    generation.cancel()
+                ticket.charge(tenant, len(input_ids) + len(detokenizer.token_ids))
+        
+        logger.info(f"ストリーミング生成完了: {len(detokenizer.token_ids)} トークン")
+
+    def check_quota(self, tenant: Optional[Tenant] = None):
+        """テナントが予算を使い切っていれば QuotaExceededError を送出する"""
+        self.scheduler.check(tenant or Tenant())
+    
+    def charge_shared_generation(self, tenant: Optional[Tenant], result: Dict[str, Any]):
+        """他のリクエストの generate_text の結果を共有したテナントに、その生成のトークン数を課金する"""
+        if "prompt_tokens" not in result:
+            return
+        num_candidates = len(result.get("generated_texts", [result["generated_text"]]))
+        self.scheduler.charge(tenant or Tenant(), result["prompt_tokens"] + result["generated_tokens"] * num_candidates)
+
+    async def embed_text(self, text: str) -> np.ndarray:
+        """最終層の隠れ状態を平均プーリングしたL2正規化済みの埋め込みベクトルを取得"""
+        return await self.executor.run(self._embed, text)
+
+    def _embed(self, text: str) -> np.ndarray:
+        token_ids = self.tokenizer.encode(text, add_special_tokens=False)[-self.EMBEDDING_MAX_TOKENS:]
+        return self.backend.embed(token_ids)
+
+    def _has_prefix(self, prompt: str, prefix: Optional[str]) -> bool:
+        return bool(prefix) and prompt.startswith(prefix)
+    
+    def _encode_prompt(self, prompt: str, prefix: Optional[str] = None) -> List[int]:
+        """プロンプトをトークン化（プレフィックス指定時はキャッシュと一致するよう分けてトークン化）"""
+        if self._has_prefix(prompt, prefix):
+            return (
+                self.tokenizer.encode(prefix, add_special_tokens=False)
+                + self.tokenizer.encode(prompt[len(prefix):], add_special_tokens=False)
+            )
+        return self.tokenizer.encode(prompt, add_special_tokens=False)
+    
+    async def _resolve_prefix(self, prompt: str, prefix: Optional[str]) -> Optional[PrefixEntry]:
+        """プレフィックスのKVキャッシュを取得（未作成なら推論スレッドでprefillする）
+
+        呼び出し側で scheduler.slot() により実行枠を確保済みであること。
+        """
+        if self.prefix_cache is None or not self._has_prefix(prompt, prefix):
+            return None
+        
+        entry = self.prefix_cache.get(prefix)
+        if entry is None:
+            entry = await self.executor.submit(self._build_prefix_entry, prefix)
+            self.prefix_cache.put(prefix, entry)
+        return entry
+    
+    @torch.inference_mode()
+    def _build_prefix_entry(self, prefix: str) -> PrefixEntry:
+        token_ids = self.tokenizer.encode(prefix, add_special_tokens=False)
+        outputs = self.model(
+            input_ids=torch.tensor([token_ids], device=self.model.device),
+            use_cache=True
+        )
+        past_key_values = outputs.past_key_values
+        logger.info(f"プレフィックスのKVキャッシュを作成: {len(token_ids)} トークン")
+        return PrefixEntry(token_ids, past_key_values, past_nbytes(past_key_values))
+    
+    @torch.inference_mode()
+    def _generate_ids(
+        self,
+        input_ids: List[int],
+        generation_config: Dict[str, Any],
+        constraints: Optional[GenerationConstraints] = None,
+        prefix_entry: Optional[PrefixEntry] = None,
+        streamer=None,
+        assistant_model=None,
+        timer: Optional[GenerationTimer] = None,
+        deadline: Optional[GenerationDeadline] = None
+    ) -> torch.Tensor:
+        """model.generate() を直接呼び出し、新たに生成されたトークンIDだけを返す"""
+        copies = generation_config.get("num_return_sequences", 1)
+        if deadline is not None and deadline.should_stop():
+            # 推論スレッドの順番待ちの間に締め切りを過ぎた場合はprefillもしない
+            return torch.empty((copies, 0), dtype=torch.long)
+        
+        input_tensor = torch.tensor([input_ids], device=self.model.device)
+        generate_kwargs = {
+            **generation_config,
+            **self._constraint_kwargs(constraints, len(input_ids), timer, deadline)
+        }
+        if assistant_model is not None:
+            generate_kwargs["assistant_model"] = assistant_model
+        
+        past_key_values = prefix_entry.past_key_values if prefix_entry is not None else None
+        if copies > 1:
+            # 複数候補はプロンプトを1系列だけprefillし、そのKVキャッシュを候補数分複製してデコードする
+            # （最後のトークンはgenerate側で入力するため残しておく）
+            cached_length = len(prefix_entry.token_ids) if prefix_entry is not None else 0
+            if len(input_ids) - 1 > cached_length:
+                outputs = self.model(
+                    input_ids=input_tensor[:, cached_length:-1],
+                    past_key_values=past_key_values,
+                    use_cache=True
+                )
+                past_key_values = outputs.past_key_values
+            if past_key_values is not None:
+                past_key_values = tuple(
+                    (key.repeat_interleave(copies, dim=0), value.repeat_interleave(copies, dim=0))
+                    for key, value in past_key_values
+                )
+        
+        if past_key_values is not None:
+            generate_kwargs["past_key_values"] = past_key_values
+        
+        output = self.model.generate(
+            input_tensor,
+            attention_mask=torch.ones_like(input_tensor),
+            streamer=streamer,
+            **generate_kwargs
+        )
+        return output[:, len(input_ids):]
+    
+    @torch.inference_mode()
+    def _generate_padded(
+        self,
+        input_id_lists: List[List[int]],
+        generation_config: Dict[str, Any],
+        constraints: Optional[GenerationConstraints] = None,
+        timer: Optional[GenerationTimer] = None,
+        deadline: Optional[GenerationDeadline] = None
+    ) -> torch.Tensor:
+        """左パディングしたバッチで model.generate() を呼び出し、新たに生成されたトークンIDだけを返す"""
+        if deadline is not None and deadline.should_stop():
+            return [[] for _ in input_id_lists]
+        
+        if self.model is None:
+            # PyTorch以外のバックエンドはプロンプトごとにデコードループで生成する
+            return [
+                self.backend.generate(
+                    input_ids,
+                    max_new_tokens=generation_config["max_new_tokens"],
+                    temperature=generation_config["temperature"],
+                    top_p=generation_config["top_p"],
+                    do_sample=generation_config["do_sample"],
+                    constraints=constraints,
+                    on_token=timer.on_token if timer is not None else None,
+                    deadline=deadline
+                )[0]
+                for input_ids in input_id_lists
+            ]
+        
+        batch = self.tokenizer.pad({"input_ids": input_id_lists}, padding=True, return_tensors="pt")
+        input_tensor = batch["input_ids"].to(self.model.device)
+        prompt_length = input_tensor.shape[1]
+        
+        output = self.model.generate(
+            input_tensor,
+            attention_mask=batch["attention_mask"].to(self.model.device),
+            **generation_config,
+            **self._constraint_kwargs(constraints, prompt_length, timer, deadline)
+        )
+        return output[:, prompt_length:]
+    
+    def _build_generation_config(
+        self,
+        input_tokens: int,
+        max_length: int = 512,
+        max_new_tokens: int = None,
+        temperature: float = 0.7,
+        top_p: float = 0.9,
+        do_sample: bool = True,
+        num_return_sequences: int = 1
+    ) -> Dict[str, Any]:
+        generation_config = {
+            "temperature": temperature,
+            "top_p": top_p,
+            "do_sample": do_sample,
+            "num_return_sequences": num_return_sequences,
+            "pad_token_id": self.tokenizer.pad_token_id,
+            "eos_token_id": self.tokenizer.eos_token_id
+        }
+        
+        # max_new_tokensが指定されている場合はそれを使用、そうでなければmax_lengthを使用
+        if max_new_tokens is not None:
+            generation_config["max_new_tokens"] = max_new_tokens
+            logger.info(f"max_new_tokens使用: {max_new_tokens}")
+        else:
+            generation_config["max_length"] = max_length
+            logger.info(f"max_length使用: {max_length}")
+            if input_tokens >= max_length:
+                logger.warning(f"プロンプトトークン数({input_tokens})がmax_length({max_length})以上です")
+                generation_config["max_new_tokens"] = 50  # 最低限の生成を保証
+                generation_config.pop("max_length")
+        
+        return generation_config
+    
+    def _constraint_kwargs(
+        self,
+        constraints: Optional[GenerationConstraints],
+        prompt_length: int,
+        timer: Optional[GenerationTimer] = None,
+        deadline: Optional[GenerationDeadline] = None
+    ) -> Dict[str, Any]:
+        """generate() に渡す停止条件とロジット制約
+
+        timerを渡すとステップごとの時刻も記録し、deadlineを渡すとステップごとに締め切りと切断を確認する。
+        """
+        kwargs = {}
+        if constraints is not None:
+            kwargs = {
+                "stopping_criteria": constraints.stopping_criteria(self.tokenizer, prompt_length),
+                "logits_processor": constraints.logits_processors(self.tokenizer)
+            }
+        if timer is not None:
+            kwargs["stopping_criteria"] = with_timing_criteria(kwargs.get("stopping_criteria"), timer)
+        if deadline is not None:
+            kwargs["stopping_criteria"] = StoppingCriteriaList(kwargs.get("stopping_criteria") or [])
+            kwargs["stopping_criteria"].append(deadline.stopping_criteria())
+        return kwargs
+    
+    def _interruption(self, deadline: GenerationDeadline, endpoint: str) -> Dict[str, Any]:
+        """締め切り超過・切断で生成を打ち切った場合はメトリクスに記録し、結果に含める理由を返す"""
+        if not deadline.interrupted:
+            return {}
+        logger.info(f"生成を打ち切りました (理由: {deadline.reason})")
+        record_cancellation(endpoint, self.model_name, deadline.reason)
+        return {"stopped": deadline.reason}
+    
+    def _count_generated(self, output_ids) -> int:
+        """生成結果（パディング済みのテンソルまたは系列ごとのリスト）のトークン数
+
+        テンソルは系列ごとに最初のEOSまで（EOSを含む）を数え、それ以降のトークンとパディングは数えない
+        （GPT-2のようにパディングとEOSが同じトークンでも生成したEOSを数える）。
+        """
+        if isinstance(output_ids, torch.Tensor):
+            is_eos = output_ids == self.tokenizer.eos_token_id
+            before_eos = (is_eos.cumsum(dim=1) - is_eos.int()) == 0
+            generated = (output_ids != self.tokenizer.pad_token_id) | is_eos
+            return int((before_eos & generated).sum())
+        return sum(len(ids) for ids in output_ids)
+    
+    @staticmethod
+    def _max_new_tokens(input_tokens: int, generation_config: Dict[str, Any]) -> int:
+        if "max_new_tokens" in generation_config:
+            return generation_config["max_new_tokens"]
+        return generation_config["max_length"] - input_tokens
+    
     def save_model(self, save_path: str):
+        if self.model is None:
+            raise RuntimeError("モデルの保存はPyTorchバックエンドでのみ利用できます")
         try:
             logger.info(f"モデルを保存中: {save_path}")
             os.makedirs(save_path, exist_ok=True)
@@ -149,11 +872,74 @@ class ModelClient:
             logger.error(f"モデル保存エラー: {str(e)}")
             raise
     
+    def reset_after_fork(self):
+        """forkした子プロセスで、親プロセスから引き継げない推論スレッドを作り直す
+
+        連続バッチングエンジンは親プロセスでは起動せず（start_engine=False でロード）、ここで初めて起動する。
+        モデルの重みはコピーオンライトで親プロセスと共有したまま使う。ONNX Runtime等のセッションは
+        内部のスレッドプールをforkで引き継げないため、PyTorch以外のバックエンドはワーカーごとにロードし直す。
+        """
+        if self.backend_name != "torch":
+            logger.warning(f"バックエンド {self.backend_name} はワーカー間で重みを共有できないため、ワーカーごとにロードします")
+            self.backend.load()
+            self.tokenizer = self.backend.tokenizer
+        self.executor = InferenceExecutor(
+            max_workers=self.executor.max_workers,
+            max_queue_depth=self.executor.max_queue_depth,
+            max_concurrency=self.executor.max_concurrency
+        )
+        self.scheduler = FairScheduler(self.executor, self.scheduler.quotas, self.scheduler.weights)
+        if self.batching_enabled and self.model is not None:
+            self._start_engine()
+    
+    def weights_nbytes(self) -> int:
+        """ロード済みモデル（ドラフトモデルを含む）の重みのバイト数"""
+        models = [model for model in (self.model, self.draft_model) if model is not None]
+        return sum(
+            tensor.numel() * tensor.element_size()
+            for model in models
+            for tensor in list(model.parameters()) + list(model.buffers())
+        )
+    
+    def unload(self):
+        """モデルを解放してメモリを返却"""
+        logger.info(f"モデルを解放中: {self.model_name}")
+        if self.engine is not None:
+            self.engine.stop()
+            self.engine = None
+        self.executor.shutdown()
+        if self.prefix_cache is not None:
+            self.prefix_cache.clear()
+        if self.backend is not None:
+            self.backend.unload()
+            self.backend = None
+        self.model = None
+        self.draft_model = None
+        self.prompt_lookup = None
+        self.tokenizer = None
+        gc.collect()
+        try:
+            MODEL_RESIDENT_MEMORY_BYTES.remove(self.model_name)
+        except KeyError:
+            pass
+        if self.device == "cuda":
+            torch.cuda.empty_cache()
+    
     def get_model_info(self) -> Dict[str, Any]:
         return {
             "model_name": self.model_name,
             "model_path": self.model_path,
             "device": self.device,
+            "backend": self.backend.model_info() if self.backend else None,
+            "load_timings": self.load_timings,
+            "torch_dtype": self.torch_dtype,
+            "precision": self.precision,
+            "draft_model": self.draft_model_name if self.draft_model is not None else None,
             "parameters": self.model.num_parameters() if self.model else None,
-            "tokenizer_vocab_size": len(self.tokenizer) if self.tokenizer else None
+            "tokenizer_vocab_size": len(self.tokenizer) if self.tokenizer else None,
+            "batching_engine": self.engine.stats if self.engine else None,
+            "prefix_cache": self.prefix_cache.get_stats() if self.prefix_cache else None,
+            "prompt_lookup": self.prompt_lookup.get_stats() if self.prompt_lookup else None,
+            "inference_queue": self.executor.get_stats(),
+            "scheduler": self.scheduler.get_stats()
         }
\ No newline at end of file
@@ -0,0 +1,151 @@
+import os
+import threading
+import torch
+from typing import Dict, Any, NamedTuple, Optional
+import logging
+from dotenv import load_dotenv
+from client.llm.model_client import ModelClient, resolve_torch_dtype
+from client.llm.precision import resolve_precision
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+
+class ModelKey(NamedTuple):
+    model_name: str
+    model_path: str
+    torch_dtype: str
+    precision: str
+    backend: str
+
+
+class ModelRegistry:
+    """プロセス全体で共有するModelClientのレジストリ
+
+    同じ (モデル名, パス, dtype, 精度モード, バックエンド) のモデルは一度だけロードし、参照カウントで利用状況を管理する。
+    参照が0になってもモデルは保持し、unload_idle() または shutdown() で解放する。
+    """
+
+    def __init__(self):
+        self._clients: Dict[ModelKey, ModelClient] = {}
+        self._ref_counts: Dict[ModelKey, int] = {}
+        self._lock = threading.RLock()
+
+    def _make_key(
+        self,
+        model_name: Optional[str] = None,
+        model_path: Optional[str] = None,
+        torch_dtype: Optional[str] = None,
+        precision: Optional[str] = None,
+        backend: Optional[str] = None
+    ) -> ModelKey:
+        backend = (backend or os.getenv("INFERENCE_BACKEND", "torch")).lower()
+        device = "cuda" if torch.cuda.is_available() and backend == "torch" else "cpu"
+        precision = resolve_precision(device, precision or os.getenv("MODEL_PRECISION"))
+        return ModelKey(
+            model_name=model_name or os.getenv("MODEL_NAME", "microsoft/DialoGPT-medium"),
+            model_path=model_path or os.getenv("MODEL_PATH", "./data/models"),
+            torch_dtype=resolve_torch_dtype(device, torch_dtype, precision),
+            precision=precision,
+            backend=backend
+        )
+
+    def acquire(
+        self,
+        model_name: Optional[str] = None,
+        model_path: Optional[str] = None,
+        torch_dtype: Optional[str] = None,
+        precision: Optional[str] = None,
+        backend: Optional[str] = None,
+        start_engine: bool = True
+    ) -> ModelClient:
+        """モデルを取得し参照カウントを増やす（未ロードならロードする）
+
+        start_engine=False の場合、新たにロードするモデルの連続バッチングエンジンは起動しない。
+        """
+        key = self._make_key(model_name, model_path, torch_dtype, precision, backend)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                logger.info(f"レジストリにモデルを登録: {key}")
+                client = ModelClient(
+                    model_name=key.model_name,
+                    model_path=key.model_path,
+                    torch_dtype=key.torch_dtype,
+                    precision=key.precision,
+                    backend=key.backend,
+                    start_engine=start_engine
+                )
+                self._clients[key] = client
+                self._ref_counts[key] = 0
+            self._ref_counts[key] += 1
+            return client
+
+    def release(self, client: ModelClient):
+        """参照カウントを減らす"""
+        with self._lock:
+            for key, registered in self._clients.items():
+                if registered is client:
+                    self._ref_counts[key] = max(0, self._ref_counts[key] - 1)
+                    return
+            logger.warning(f"レジストリに存在しないモデルの解放要求: {client.model_name}")
+
+    def unload_idle(self) -> int:
+        """参照されていないモデルを解放し、解放した数を返す"""
+        with self._lock:
+            idle_keys = [key for key, count in self._ref_counts.items() if count <= 0]
+            for key in idle_keys:
+                self._unload(key)
+            return len(idle_keys)
+
+    def load(
+        self,
+        model_name: Optional[str] = None,
+        model_path: Optional[str] = None,
+        torch_dtype: Optional[str] = None,
+        precision: Optional[str] = None,
+        backend: Optional[str] = None,
+        start_engine: bool = True
+    ) -> ModelClient:
+        """起動時の明示的なロード（参照はshutdownまで保持される）"""
+        return self.acquire(model_name, model_path, torch_dtype, precision, backend, start_engine)
+
+    def _unload(self, key: ModelKey):
+        client = self._clients.pop(key)
+        self._ref_counts.pop(key, None)
+        client.unload()
+
+    def shutdown(self):
+        """登録済みのモデルをすべて解放"""
+        with self._lock:
+            for key in list(self._clients.keys()):
+                if self._ref_counts.get(key, 0) > 1:
+                    logger.warning(f"使用中のモデルを解放します: {key} (参照数: {self._ref_counts[key]})")
+                self._unload(key)
+        logger.info("モデルレジストリを終了しました")
+
+    def reset_after_fork(self):
+        """forkした子プロセスで呼び出し、ロード済みの各モデルの推論スレッドを作り直す"""
+        self._lock = threading.RLock()
+        for client in self._clients.values():
+            client.reset_after_fork()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "models": [
+                    {
+                        **key._asdict(),
+                        "ref_count": self._ref_counts.get(key, 0),
+                        "info": client.get_model_info()
+                    }
+                    for key, client in self._clients.items()
+                ]
+            }
+
+
+_registry = ModelRegistry()
+
+
+def get_model_registry() -> ModelRegistry:
+    return _registry
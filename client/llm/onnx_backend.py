@@ -0,0 +1,280 @@
+import os
+import json
+import time
+import hashlib
+import numpy as np
+import onnxruntime as ort
+import torch
+from torch import nn
+from transformers import AutoConfig, AutoTokenizer, AutoModelForCausalLM, GenerationConfig
+from typing import Any, Dict, List, Optional, Tuple
+import logging
+from client.llm.inference_backend import InferenceBackend, resolve_model_source
+from client.llm.model_artifact import PYTORCH_FILES, SAFETENSORS_FILES, config_hash
+
+logger = logging.getLogger(__name__)
+
+ONNX_MODEL_FILE = "model.onnx"
+ONNX_INT8_MODEL_FILE = "model.int8.onnx"
+EXPORT_INFO_FILE = "export_info.json"
+ONNX_OPSET_VERSION = 14
+
+
+class KVCacheExportWrapper(nn.Module):
+    """KVキャッシュを入出力に持つ形でエクスポートするためのラッパー
+
+    入力: input_ids, attention_mask, position_ids, past_key_values.{i}.key / .value
+    出力: logits, last_hidden_state, present.{i}.key / .value
+    KVキャッシュは (batch, heads, past_length, head_dim) で、past_length=0 を渡せばprefillになる。
+    """
+
+    def __init__(self, model: nn.Module):
+        super().__init__()
+        self.model = model
+        self.num_layers = model.config.num_hidden_layers
+
+    def forward(self, input_ids, attention_mask, position_ids, *past_flat):
+        past_key_values = tuple(
+            (past_flat[2 * i], past_flat[2 * i + 1]) for i in range(self.num_layers)
+        )
+        outputs = self.model(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            position_ids=position_ids,
+            past_key_values=past_key_values,
+            use_cache=True,
+            output_hidden_states=True
+        )
+        presents = [tensor for layer in outputs.past_key_values for tensor in layer]
+        return (outputs.logits, outputs.hidden_states[-1], *presents)
+
+
+def _kv_names(prefix: str, num_layers: int) -> List[str]:
+    return [f"{prefix}.{i}.{kind}" for i in range(num_layers) for kind in ("key", "value")]
+
+
+def source_fingerprint(model_source: str) -> str:
+    """エクスポート元のモデルの指紋（ローカルのモデルは設定の内容と重みファイルのサイズ・更新時刻から作る）
+
+    同じパスのモデルを置き換えた場合も指紋が変わるため、古いエクスポートを使い続けない。
+    Hugging Faceのモデル名の場合はモデル名をそのまま使う。
+    """
+    if not os.path.isfile(os.path.join(model_source, "config.json")):
+        return model_source
+    weight_files = sorted(
+        name for name in os.listdir(model_source)
+        if name in SAFETENSORS_FILES + PYTORCH_FILES or name.endswith((".safetensors", ".bin"))
+    )
+    digest = hashlib.sha256(config_hash(model_source).encode("utf-8"))
+    for name in weight_files:
+        stat = os.stat(os.path.join(model_source, name))
+        digest.update(f"{name}:{stat.st_size}:{stat.st_mtime_ns}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def export_onnx_model(
+    model_source: str,
+    output_dir: str,
+    opset_version: int = ONNX_OPSET_VERSION,
+    local_files_only: bool = False
+) -> str:
+    """PyTorchモデルをKVキャッシュ入出力付きのONNXにエクスポートし、トークナイザーと設定（生成設定を含む）も保存する"""
+    logger.info(f"ONNXエクスポート開始: {model_source} -> {output_dir}")
+    os.makedirs(output_dir, exist_ok=True)
+
+    tokenizer = AutoTokenizer.from_pretrained(model_source, local_files_only=local_files_only)
+    model = AutoModelForCausalLM.from_pretrained(
+        model_source,
+        torch_dtype=torch.float32,
+        low_cpu_mem_usage=True,
+        local_files_only=local_files_only
+    )
+    model.eval()
+    config = model.config
+
+    num_layers = config.num_hidden_layers
+    num_heads = config.num_attention_heads
+    head_dim = config.hidden_size // num_heads
+
+    # ダミー入力（past_length=1 とし、系列長はすべて動的軸にする）
+    input_ids = torch.tensor([[tokenizer.eos_token_id or 0] * 2])
+    past_length = 1
+    past = [torch.zeros(1, num_heads, past_length, head_dim) for _ in range(2 * num_layers)]
+    attention_mask = torch.ones(1, past_length + input_ids.shape[1], dtype=torch.long)
+    position_ids = torch.arange(past_length, past_length + input_ids.shape[1]).unsqueeze(0)
+
+    past_names = _kv_names("past_key_values", num_layers)
+    present_names = _kv_names("present", num_layers)
+    dynamic_axes = {
+        "input_ids": {0: "batch", 1: "sequence"},
+        "attention_mask": {0: "batch", 1: "total_sequence"},
+        "position_ids": {0: "batch", 1: "sequence"},
+        "logits": {0: "batch", 1: "sequence"},
+        "last_hidden_state": {0: "batch", 1: "sequence"},
+        **{name: {0: "batch", 2: "past_sequence"} for name in past_names},
+        **{name: {0: "batch", 2: "total_sequence"} for name in present_names}
+    }
+
+    model_file = os.path.join(output_dir, ONNX_MODEL_FILE)
+    with torch.no_grad():
+        torch.onnx.export(
+            KVCacheExportWrapper(model),
+            (input_ids, attention_mask, position_ids, *past),
+            model_file,
+            input_names=["input_ids", "attention_mask", "position_ids", *past_names],
+            output_names=["logits", "last_hidden_state", *present_names],
+            dynamic_axes=dynamic_axes,
+            opset_version=opset_version,
+            do_constant_folding=True
+        )
+
+    tokenizer.save_pretrained(output_dir)
+    config.save_pretrained(output_dir)
+    model.generation_config.save_pretrained(output_dir)
+    with open(os.path.join(output_dir, EXPORT_INFO_FILE), "w", encoding="utf-8") as f:
+        json.dump(
+            {"source": model_source, "fingerprint": source_fingerprint(model_source), "opset_version": opset_version},
+            f,
+            ensure_ascii=False,
+            indent=2
+        )
+
+    logger.info(f"ONNXエクスポート完了: {model_file}")
+    return model_file
+
+
+def quantize_onnx_model(output_dir: str) -> str:
+    """エクスポート済みのONNXモデルの重みを動的INT8量子化する"""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    int8_file = os.path.join(output_dir, ONNX_INT8_MODEL_FILE)
+    quantize_dynamic(
+        os.path.join(output_dir, ONNX_MODEL_FILE),
+        int8_file,
+        weight_type=QuantType.QInt8
+    )
+    logger.info(f"ONNXモデルを動的INT8量子化: {int8_file}")
+    return int8_file
+
+
+class OnnxRuntimeBackend(InferenceBackend):
+    """ONNX Runtime（CPU）で推論するバックエンド
+
+    ONNX_MODEL_PATH にエクスポート済みのモデルがなければ、起動時にPyTorchモデルからエクスポートする。
+    KVキャッシュは present.* の出力（NumPy配列）をそのまま次のステップの past_key_values.* に渡す。
+    """
+
+    name = "onnxruntime"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.onnx_path = os.getenv("ONNX_MODEL_PATH", "./data/models/onnx")
+        self.num_threads = int(os.getenv("ONNX_NUM_THREADS", 0))
+        self.session = None
+        self.model_file = None
+        self.num_layers = 0
+        self.num_heads = 0
+        self.head_dim = 0
+
+    def load(self):
+        if self.precision not in ("fp32", "int8"):
+            raise ValueError(f"ONNXバックエンドはfp32またはint8のみ対応しています: {self.precision}")
+        if self.device != "cpu":
+            logger.warning("ONNXバックエンドはCPUで推論します")
+
+        start = time.perf_counter()
+        model_source = resolve_model_source(self.model_name, self.model_path)
+        if not self._is_exported(model_source.path):
+            export_onnx_model(model_source.path, self.onnx_path, local_files_only=model_source.local)
+        self._record_timing("export", start)
+
+        self.model_file = os.path.join(self.onnx_path, ONNX_MODEL_FILE)
+        if self.precision == "int8":
+            int8_file = os.path.join(self.onnx_path, ONNX_INT8_MODEL_FILE)
+            if not os.path.exists(int8_file) or os.path.getmtime(int8_file) < os.path.getmtime(self.model_file):
+                quantize_onnx_model(self.onnx_path)
+            self.model_file = int8_file
+
+        start = time.perf_counter()
+        self.tokenizer = AutoTokenizer.from_pretrained(self.onnx_path, padding_side="left", local_files_only=True)
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        self._record_timing("tokenizer", start)
+
+        start = time.perf_counter()
+        config = AutoConfig.from_pretrained(self.onnx_path, local_files_only=True)
+        self.num_layers = config.num_hidden_layers
+        self.num_heads = config.num_attention_heads
+        self.head_dim = config.hidden_size // self.num_heads
+        self.top_k = self._load_generation_config(config).top_k or 0
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if self.num_threads > 0:
+            options.intra_op_num_threads = self.num_threads
+        self.session = ort.InferenceSession(self.model_file, options, providers=["CPUExecutionProvider"])
+        self._past_names = _kv_names("past_key_values", self.num_layers)
+        self._present_names = _kv_names("present", self.num_layers)
+        self._record_timing("session", start)
+        logger.info(f"ONNX Runtimeセッションを作成: {self.model_file}")
+
+    def _load_generation_config(self, config) -> GenerationConfig:
+        """エクスポート時に保存した生成設定（古いエクスポートにはないためモデル設定から作成）"""
+        try:
+            return GenerationConfig.from_pretrained(self.onnx_path, local_files_only=True)
+        except OSError:
+            return GenerationConfig.from_model_config(config)
+
+    def _is_exported(self, model_source: str) -> bool:
+        """同じモデル（設定と重みが変わっていないもの）からエクスポート済みのONNXモデルがあるか"""
+        info_file = os.path.join(self.onnx_path, EXPORT_INFO_FILE)
+        if not os.path.exists(os.path.join(self.onnx_path, ONNX_MODEL_FILE)) or not os.path.exists(info_file):
+            return False
+        with open(info_file, encoding="utf-8") as f:
+            info = json.load(f)
+        return info.get("source") == model_source and info.get("fingerprint") == source_fingerprint(model_source)
+
+    def _run(
+        self,
+        input_ids: List[int],
+        past: Optional[List[np.ndarray]],
+        output_names: List[str]
+    ) -> List[np.ndarray]:
+        if past is None:
+            empty = np.zeros((1, self.num_heads, 0, self.head_dim), dtype=np.float32)
+            past = [empty] * (2 * self.num_layers)
+        past_length = past[0].shape[2]
+        total_length = past_length + len(input_ids)
+
+        feeds = {
+            "input_ids": np.array([input_ids], dtype=np.int64),
+            "attention_mask": np.ones((1, total_length), dtype=np.int64),
+            "position_ids": np.arange(past_length, total_length, dtype=np.int64)[None],
+            **dict(zip(self._past_names, past))
+        }
+        return self.session.run(output_names, feeds)
+
+    def prefill(self, input_ids: List[int]) -> Tuple[torch.Tensor, Any]:
+        outputs = self._run(input_ids, None, ["logits", *self._present_names])
+        return torch.from_numpy(outputs[0][0, -1]), outputs[1:]
+
+    def decode_step(self, token_id: int, past: Any) -> Tuple[torch.Tensor, Any]:
+        outputs = self._run([token_id], past, ["logits", *self._present_names])
+        return torch.from_numpy(outputs[0][0, -1]), outputs[1:]
+
+    def embed(self, token_ids: List[int]) -> np.ndarray:
+        hidden = self._run(token_ids, None, ["last_hidden_state"])[0][0]
+        embedding = hidden.astype(np.float32).mean(axis=0)
+        return embedding / max(float(np.linalg.norm(embedding)), 1e-12)
+
+    def model_info(self) -> Dict[str, Any]:
+        return {
+            **super().model_info(),
+            "onnx_model": self.model_file,
+            "onnxruntime_version": ort.__version__,
+            "intra_op_num_threads": self.num_threads or None
+        }
+
+    def unload(self):
+        super().unload()
+        self.session = None
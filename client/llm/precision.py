@@ -0,0 +1,59 @@
+import torch
+from torch import nn
+from typing import Optional
+import logging
+from transformers.pytorch_utils import Conv1D
+
+logger = logging.getLogger(__name__)
+
+# MODEL_PRECISION で指定できるモード -> ロード時のdtype
+PRECISION_DTYPES = {
+    "fp32": "float32",
+    "fp16": "float16",
+    "bf16": "bfloat16",
+    # 動的INT8量子化はfloat32でロードしてから線形層を量子化する
+    "int8": "float32",
+}
+
+
+def resolve_precision(device: str, precision: Optional[str] = None) -> str:
+    """推論精度モードを決定（未指定時はGPUならfp16、CPUならfp32）"""
+    if not precision:
+        return "fp16" if device == "cuda" else "fp32"
+
+    precision = precision.lower()
+    if precision not in PRECISION_DTYPES:
+        raise ValueError(f"未対応のMODEL_PRECISIONです: {precision} (指定可能: {', '.join(PRECISION_DTYPES)})")
+    if precision == "int8" and device == "cuda":
+        raise ValueError("動的INT8量子化はCPU推論でのみ利用できます")
+    return precision
+
+
+def apply_precision(model: nn.Module, precision: str) -> nn.Module:
+    """ロード済みモデルに精度モードを適用（int8の場合は線形層を動的量子化）"""
+    if precision != "int8":
+        return model
+
+    # GPT-2系の注意機構・MLPはConv1D実装のため、量子化対象になるようnn.Linearに置き換える
+    converted = _convert_conv1d_to_linear(model)
+    torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8, inplace=True)
+    logger.info(f"線形層を動的INT8量子化 (Conv1D -> Linear 変換: {converted} 層)")
+    return model
+
+
+def _convert_conv1d_to_linear(model: nn.Module) -> int:
+    converted = 0
+    for parent in list(model.modules()):
+        for name, child in list(parent.named_children()):
+            if not isinstance(child, Conv1D):
+                continue
+            # Conv1Dの重みは (in_features, out_features) で x @ W + b を計算する
+            in_features, out_features = child.weight.shape
+            linear = nn.Linear(in_features, out_features, bias=child.bias is not None)
+            with torch.no_grad():
+                linear.weight.copy_(child.weight.t())
+                if child.bias is not None:
+                    linear.bias.copy_(child.bias)
+            setattr(parent, name, linear)
+            converted += 1
+    return converted
@@ -0,0 +1,95 @@
+import threading
+import torch
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+PastKeyValues = Tuple[Tuple[torch.Tensor, torch.Tensor], ...]
+
+
+@dataclass
+class PrefixEntry:
+    """固定プレフィックスのトークン列とprefill済みのKVキャッシュ"""
+    token_ids: List[int]
+    past_key_values: PastKeyValues
+    nbytes: int
+
+
+def past_nbytes(past_key_values: PastKeyValues) -> int:
+    return sum(key.nelement() * key.element_size() + value.nelement() * value.element_size()
+               for key, value in past_key_values)
+
+
+class PrefixCache:
+    """プロンプトテンプレートの固定部分のKVキャッシュを保持するLRUキャッシュ
+
+    キャッシュしたテンソルは生成時に読み取り専用で共有する（レガシー形式のKVキャッシュは
+    生成中に連結で新しいテンソルが作られるため、元のテンソルは書き換えられない）。
+    合計サイズが max_bytes を超えると最も古く使われたエントリから削除する。
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, PrefixEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, prefix: str) -> Optional[PrefixEntry]:
+        with self._lock:
+            entry = self._entries.get(prefix)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(prefix)
+            self.hits += 1
+            return entry
+
+    def get_or_create(self, prefix: str, build: Callable[[], PrefixEntry]) -> PrefixEntry:
+        """キャッシュを参照し、なければ build() で作成して登録する"""
+        entry = self.get(prefix)
+        if entry is None:
+            entry = build()
+            self.put(prefix, entry)
+        return entry
+
+    def put(self, prefix: str, entry: PrefixEntry):
+        if entry.nbytes > self.max_bytes:
+            logger.warning(f"プレフィックスのKVキャッシュが上限を超えるため保存しません ({entry.nbytes} bytes)")
+            return
+
+        with self._lock:
+            previous = self._entries.pop(prefix, None)
+            if previous is not None:
+                self._total_bytes -= previous.nbytes
+
+            self._entries[prefix] = entry
+            self._total_bytes += entry.nbytes
+
+            while self._total_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._total_bytes -= evicted.nbytes
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0
+            }
@@ -0,0 +1,175 @@
+import threading
+import torch
+from transformers import LogitsProcessorList
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import logging
+from client.llm.generation_constraints import GenerationConstraints
+from client.llm.generation_deadline import GenerationDeadline
+from client.llm.inference_backend import build_logits_processors
+from client.llm.prefix_cache import PastKeyValues, PrefixEntry
+from client.llm.streaming import IncrementalDetokenizer
+
+logger = logging.getLogger(__name__)
+
+
+def find_candidate_tokens(token_ids: List[int], max_ngram_size: int = 3, num_pred_tokens: int = 10) -> List[int]:
+    """末尾のn-gramと一致する箇所をこれまでの系列から探し、その続きを候補として返す
+
+    長いn-gramから順に探し、最初に見つかった一致箇所の直後のトークン列を使う。
+    """
+    length = len(token_ids)
+    for ngram_size in range(min(max_ngram_size, length - 1), 0, -1):
+        ngram = token_ids[-ngram_size:]
+        for start in range(length - ngram_size):
+            if token_ids[start:start + ngram_size] == ngram:
+                candidates = token_ids[start + ngram_size:start + ngram_size + num_pred_tokens]
+                if candidates:
+                    return candidates
+    return []
+
+
+class PromptLookupDecoder:
+    """ドラフトモデルを使わない投機的デコード（プロンプトのn-gram参照）
+
+    生成中の系列の末尾n-gramと一致する箇所をプロンプト（と生成済みテキスト）から探し、
+    その続きを候補トークンとして本体モデルの1回のforwardでまとめて検証する。
+    各位置で本体モデルが選んだトークンと候補が一致する限り採用するため、
+    貪欲法では通常のデコードと同じ出力になり、サンプリングでも出力分布は変わらない
+    （温度・top-p に加えて model.generate() と同じく generation_config の top_k も適用する）。
+    KVキャッシュはレガシー形式（layer毎の (key, value)）で、不採用の候補分は切り詰める。
+    """
+
+    def __init__(self, model, tokenizer, max_ngram_size: int = 3, num_pred_tokens: int = 10):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_ngram_size = max_ngram_size
+        self.num_pred_tokens = num_pred_tokens
+        self.top_k = getattr(getattr(model, "generation_config", None), "top_k", None) or 0
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "steps": 0, "proposed": 0, "accepted": 0, "generated": 0}
+
+    @torch.inference_mode()
+    def generate(
+        self,
+        input_ids: List[int],
+        max_new_tokens: int,
+        temperature: float = 0.7,
+        top_p: float = 0.9,
+        do_sample: bool = True,
+        constraints: Optional[GenerationConstraints] = None,
+        prefix_entry: Optional[PrefixEntry] = None,
+        on_token: Optional[Callable[[int], None]] = None,
+        deadline: Optional[GenerationDeadline] = None
+    ) -> Tuple[List[int], Dict[str, Any]]:
+        """生成したトークンIDと、このリクエストの候補数・採用数を返す（deadlineで打ち切ると途中までを返す）"""
+        device = self.model.device
+        eos_token_id = self.tokenizer.eos_token_id
+        processors = build_logits_processors(self.tokenizer, temperature, top_p, do_sample, constraints, self.top_k)
+
+        # 推論スレッドの順番待ちの間に締め切りを過ぎた場合はprefillもしない
+        finished = deadline is not None and deadline.should_stop()
+
+        # 最後のトークン以外をprefillする（最後のトークンは候補と一緒に入力する）
+        past, cached_length = None, 0
+        if prefix_entry is not None and len(prefix_entry.token_ids) < len(input_ids):
+            past, cached_length = prefix_entry.past_key_values, len(prefix_entry.token_ids)
+        if not finished and len(input_ids) - 1 > cached_length:
+            outputs = self.model(
+                input_ids=torch.tensor([input_ids[cached_length:-1]], device=device),
+                past_key_values=past,
+                use_cache=True
+            )
+            past = outputs.past_key_values
+
+        sequence = list(input_ids)
+        generated: List[int] = []
+        # 生成制約の完了判定用に、生成済みのテキストを1トークンずつ差分でデコードする
+        detokenizer = IncrementalDetokenizer(self.tokenizer) if constraints is not None else None
+        text = ""
+        steps = proposed = accepted = 0
+
+        while not finished:
+            candidates = find_candidate_tokens(sequence, self.max_ngram_size, self.num_pred_tokens)
+            candidates = candidates[:max(max_new_tokens - len(generated) - 1, 0)]
+
+            # 最後のトークンと候補を1回のforwardで検証する
+            step_input = torch.tensor([[sequence[-1]] + candidates], device=device)
+            outputs = self.model(input_ids=step_input, past_key_values=past, use_cache=True)
+            selected = self._select_tokens(sequence, candidates, outputs.logits[0], processors, do_sample)
+
+            # 先頭から一致する候補数（一致しなかった位置では本体モデルの選んだトークンを採用する）
+            matches = 0
+            while matches < len(candidates) and candidates[matches] == selected[matches]:
+                matches += 1
+            new_tokens = selected[:matches + 1]
+
+            steps += 1
+            proposed += len(candidates)
+            accepted += matches
+
+            for token_id in new_tokens:
+                if token_id == eos_token_id:
+                    finished = True
+                    break
+                sequence.append(token_id)
+                generated.append(token_id)
+                if on_token is not None:
+                    on_token(token_id)
+                if detokenizer is not None:
+                    text += detokenizer.push(token_id)
+                if len(generated) >= max_new_tokens or (constraints is not None and constraints.is_complete(text)):
+                    finished = True
+                    break
+
+            if not finished and deadline is not None and deadline.should_stop():
+                finished = True
+
+            # KVキャッシュは採用したトークンのうち最後の1つを除いた長さに揃える
+            past = self._crop(outputs.past_key_values, len(sequence) - 1)
+
+        with self._lock:
+            self.stats["requests"] += 1
+            self.stats["steps"] += steps
+            self.stats["proposed"] += proposed
+            self.stats["accepted"] += accepted
+            self.stats["generated"] += len(generated)
+
+        return generated, {
+            "steps": steps,
+            "proposed": proposed,
+            "accepted": accepted,
+            "acceptance_rate": round(accepted / proposed, 3) if proposed else 0.0
+        }
+
+    def _select_tokens(
+        self,
+        sequence: List[int],
+        candidates: List[int],
+        logits: torch.Tensor,
+        processors: LogitsProcessorList,
+        do_sample: bool
+    ) -> List[int]:
+        """各位置で本体モデルが選ぶトークン（候補が正しかった場合の文脈で計算する）"""
+        context = torch.tensor([sequence + candidates], device=logits.device)
+        scores = torch.stack([
+            processors(context[:, :len(sequence) + i], logits[i:i + 1].float())[0]
+            for i in range(len(candidates) + 1)
+        ])
+        if do_sample:
+            return torch.multinomial(torch.softmax(scores, dim=-1), num_samples=1).squeeze(-1).tolist()
+        return scores.argmax(dim=-1).tolist()
+
+    @staticmethod
+    def _crop(past_key_values: PastKeyValues, length: int) -> PastKeyValues:
+        return tuple((key[:, :, :length], value[:, :, :length]) for key, value in past_key_values)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            proposed = self.stats["proposed"]
+            return {
+                **self.stats,
+                "max_ngram_size": self.max_ngram_size,
+                "num_pred_tokens": self.num_pred_tokens,
+                "acceptance_rate": round(self.stats["accepted"] / proposed, 3) if proposed else 0.0,
+                "tokens_per_step": round(self.stats["generated"] / self.stats["steps"], 3) if self.stats["steps"] else 0.0
+            }
@@ -0,0 +1,60 @@
+from typing import Callable, List
+from transformers.generation.streamers import BaseStreamer
+
+
+class IncrementalDetokenizer:
+    """トークンIDを1つずつ受け取り、確定した差分テキストだけを返すデトークナイザー
+
+    sentencepieceのバイトフォールバックで日本語の1文字が複数トークンに分かれる場合、
+    途中までのデコード結果は置換文字(U+FFFD)で終わるため、文字が揃うまで出力を保留する。
+    先頭の空白記号(▁)の扱いがずれないよう、直前に出力済みのトークンを前置してデコードし
+    その差分を取る。
+    """
+
+    def __init__(self, tokenizer, skip_special_tokens: bool = True):
+        self.tokenizer = tokenizer
+        self.skip_special_tokens = skip_special_tokens
+        self.token_ids: List[int] = []
+        self._prefix_offset = 0
+        self._read_offset = 0
+
+    def _decode(self, token_ids: List[int]) -> str:
+        return self.tokenizer.decode(token_ids, skip_special_tokens=self.skip_special_tokens)
+
+    def push(self, token_id: int) -> str:
+        """トークンを追加し、新たに確定したテキストを返す（未確定なら空文字）"""
+        self.token_ids.append(token_id)
+        prefix_text = self._decode(self.token_ids[self._prefix_offset:self._read_offset])
+        new_text = self._decode(self.token_ids[self._prefix_offset:])
+
+        if len(new_text) > len(prefix_text) and not new_text.endswith("\ufffd"):
+            self._prefix_offset = self._read_offset
+            self._read_offset = len(self.token_ids)
+            return new_text[len(prefix_text):]
+        return ""
+
+    def flush(self) -> str:
+        """保留中のテキストを出力"""
+        prefix_text = self._decode(self.token_ids[self._prefix_offset:self._read_offset])
+        new_text = self._decode(self.token_ids[self._prefix_offset:])
+        self._prefix_offset = self._read_offset = len(self.token_ids)
+        return new_text[len(prefix_text):]
+
+
+class TokenCallbackStreamer(BaseStreamer):
+    """model.generate() から生成トークンIDを1つずつコールバックに渡すストリーマー"""
+
+    def __init__(self, on_token: Callable[[int], None]):
+        self.on_token = on_token
+        self._prompt_skipped = False
+
+    def put(self, value):
+        # 最初の呼び出しはプロンプト全体なので読み飛ばす
+        if not self._prompt_skipped:
+            self._prompt_skipped = True
+            return
+        for token_id in value.reshape(-1).tolist():
+            self.on_token(token_id)
+
+    def end(self):
+        pass
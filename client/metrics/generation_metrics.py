@@ -0,0 +1,234 @@
+import os
+import time
+import inspect
+import functools
+from typing import Callable, Optional
+from prometheus_client import Counter, Gauge, Histogram
+from transformers import StoppingCriteria, StoppingCriteriaList
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 全メトリクス共通のラベル（エンドポイント名とモデルID）
+LABELS = ("endpoint", "model")
+
+# トークン化・後処理はマイクロ秒〜ミリ秒、生成はミリ秒〜数十秒の範囲
+FAST_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+GENERATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+QUEUE_WAIT_SECONDS = Histogram(
+    "shachiku_queue_wait_seconds",
+    "推論スレッド（連続バッチング時はエンジン）で実行が始まるまでの待ち時間",
+    LABELS,
+    buckets=GENERATION_BUCKETS
+)
+TOKENIZATION_SECONDS = Histogram(
+    "shachiku_tokenization_seconds",
+    "プロンプトのトークン化にかかった時間",
+    LABELS,
+    buckets=FAST_BUCKETS
+)
+PREFILL_SECONDS = Histogram(
+    "shachiku_prefill_seconds",
+    "実行開始から最初のトークンが生成されるまでの時間（prefill）",
+    LABELS,
+    buckets=GENERATION_BUCKETS
+)
+DECODE_SECONDS = Histogram(
+    "shachiku_decode_seconds",
+    "最初のトークン以降、生成完了までの時間（デコード）",
+    LABELS,
+    buckets=GENERATION_BUCKETS
+)
+POSTPROCESS_SECONDS = Histogram(
+    "shachiku_postprocess_seconds",
+    "生成テキストの整形（_format_reply / _format_excuse）と信頼度計算の時間",
+    LABELS,
+    buckets=FAST_BUCKETS
+)
+PROMPT_TOKENS = Counter("shachiku_prompt_tokens", "生成に入力したプロンプトのトークン数", LABELS)
+GENERATED_TOKENS = Counter("shachiku_generated_tokens", "生成したトークン数", LABELS)
+FALLBACKS = Counter(
+    "shachiku_fallbacks",
+    "フォールバック（prompt_used: \"fallback\"）を返した回数",
+    LABELS + ("reason",)
+)
+ERRORS = Counter("shachiku_errors", "生成処理で発生したエラーの回数（例外の型別）", LABELS + ("type",))
+CANCELLATIONS = Counter(
+    "shachiku_cancellations",
+    "締め切り超過・クライアントの切断で生成を打ち切った回数",
+    LABELS + ("reason",)
+)
+# テナント別のメトリクス（チャンネルとユーザーIDはクライアントが自由に指定できるため、
+# ラベルは TENANT_WEIGHTS で設定したチャンネルのみ、それ以外は "other" にまとめる）
+TENANT_TOKENS = Counter(
+    "shachiku_tenant_tokens",
+    "テナントが消費したトークン数（プロンプト+生成）",
+    ("channel",)
+)
+TENANT_REJECTIONS = Counter(
+    "shachiku_tenant_rejections",
+    "トークン予算の超過で拒否したリクエスト数（scope: user / channel）",
+    ("channel", "scope")
+)
+TENANT_QUEUE_WAIT_SECONDS = Histogram(
+    "shachiku_tenant_queue_wait_seconds",
+    "公平スケジューラーで実行枠を割り当てられるまでの待ち時間",
+    ("channel",),
+    buckets=GENERATION_BUCKETS
+)
+IN_FLIGHT_REQUESTS = Gauge(
+    "shachiku_in_flight_requests",
+    "処理中のリクエスト数（キャッシュヒットを含む）",
+    LABELS,
+    multiprocess_mode="livesum"
+)
+MODEL_RESIDENT_MEMORY_BYTES = Gauge(
+    "shachiku_model_resident_memory_bytes",
+    "モデルのロードで増えたプロセスのRSS（プロセス全体のRSSは process_resident_memory_bytes）",
+    ("model",),
+    multiprocess_mode="livemax"
+)
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def current_rss_bytes() -> int:
+    """現在のプロセスのRSS（/proc が読めない環境では 0）"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return 0
+
+
+class GenerationTimer:
+    """1回の生成のキュー待ち・prefill・デコードの時刻を推論スレッド側で記録する
+
+    時刻の記録だけを推論スレッドで行い、ヒストグラムへの反映は observe_generation() で
+    イベントループ側からまとめて行う。
+    """
+
+    def __init__(self):
+        self.queued_at = time.perf_counter()
+        self.started_at: Optional[float] = None
+        self.first_token_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.steps = 0
+
+    def start(self):
+        self.started_at = time.perf_counter()
+
+    def finish(self):
+        self.finished_at = time.perf_counter()
+
+    def on_token(self, token_id: Optional[int] = None):
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+        self.steps += 1
+
+    def wrap(self, fn: Callable) -> Callable:
+        """推論スレッドで実行される関数の開始・終了時刻を記録するラッパー"""
+        @functools.wraps(fn)
+        def timed(*args, **kwargs):
+            self.start()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.finish()
+        return timed
+
+    def stopping_criteria(self) -> "TimingStoppingCriteria":
+        """generate() のステップごとに呼ばれ、最初のトークンの時刻を記録する（停止はしない）"""
+        return TimingStoppingCriteria(self)
+
+
+class TimingStoppingCriteria(StoppingCriteria):
+    def __init__(self, timer: GenerationTimer):
+        self.timer = timer
+
+    def __call__(self, input_ids, scores, **kwargs) -> bool:
+        self.timer.on_token()
+        return False
+
+
+def with_timing_criteria(
+    stopping_criteria: Optional[StoppingCriteriaList],
+    timer: GenerationTimer
+) -> StoppingCriteriaList:
+    criteria = StoppingCriteriaList(stopping_criteria or [])
+    criteria.append(timer.stopping_criteria())
+    return criteria
+
+
+def observe_generation(
+    endpoint: str,
+    model: str,
+    timer: GenerationTimer,
+    prompt_tokens: int,
+    generated_tokens: int
+):
+    """完了した生成のキュー待ち・prefill・デコード時間とトークン数を記録"""
+    finished_at = timer.finished_at or time.perf_counter()
+    started_at = timer.started_at or timer.queued_at
+    first_token_at = timer.first_token_at or finished_at
+
+    QUEUE_WAIT_SECONDS.labels(endpoint, model).observe(started_at - timer.queued_at)
+    PREFILL_SECONDS.labels(endpoint, model).observe(first_token_at - started_at)
+    DECODE_SECONDS.labels(endpoint, model).observe(finished_at - first_token_at)
+    PROMPT_TOKENS.labels(endpoint, model).inc(prompt_tokens)
+    GENERATED_TOKENS.labels(endpoint, model).inc(generated_tokens)
+
+
+def record_error(endpoint: str, model: str, error: BaseException):
+    ERRORS.labels(endpoint, model, type(error).__name__).inc()
+
+
+def record_fallback(endpoint: str, model: str, reason: str):
+    FALLBACKS.labels(endpoint, model, reason).inc()
+
+
+def record_cancellation(endpoint: str, model: str, reason: str):
+    CANCELLATIONS.labels(endpoint, model, reason).inc()
+
+
+def record_tenant_tokens(channel: str, tokens: int):
+    TENANT_TOKENS.labels(channel).inc(tokens)
+
+
+def record_tenant_rejection(channel: str, scope: str):
+    TENANT_REJECTIONS.labels(channel, scope).inc()
+
+
+def observe_tenant_queue_wait(channel: str, seconds: float):
+    TENANT_QUEUE_WAIT_SECONDS.labels(channel).observe(seconds)
+
+
+def track_in_flight(endpoint: str):
+    """サービスのメソッドの実行中（ストリーミングは最後のイベントまで）を処理中として数えるデコレーター
+
+    モデルIDは呼び出し時の self.model_client.model_name を使う。
+    """
+    def decorator(fn):
+        if inspect.isasyncgenfunction(fn):
+            @functools.wraps(fn)
+            async def stream(self, *args, **kwargs):
+                gauge = IN_FLIGHT_REQUESTS.labels(endpoint, self.model_client.model_name)
+                gauge.inc()
+                try:
+                    async for item in fn(self, *args, **kwargs):
+                        yield item
+                finally:
+                    gauge.dec()
+            return stream
+
+        @functools.wraps(fn)
+        async def call(self, *args, **kwargs):
+            gauge = IN_FLIGHT_REQUESTS.labels(endpoint, self.model_client.model_name)
+            gauge.inc()
+            try:
+                return await fn(self, *args, **kwargs)
+            finally:
+                gauge.dec()
+        return call
+    return decorator
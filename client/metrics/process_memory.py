@@ -0,0 +1,85 @@
+import os
+from typing import Dict, Iterable, List, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+# /proc/<pid>/smaps_rollup から読み取る項目（kB）
+SMAPS_FIELDS = ("Rss", "Pss", "Shared_Clean", "Shared_Dirty", "Private_Clean", "Private_Dirty", "Swap")
+
+
+def read_smaps_rollup(pid: int) -> Optional[Dict[str, int]]:
+    """プロセスのメモリ使用量（バイト）。読めない場合（プロセス終了・Linux以外）は None"""
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            lines = f.readlines()
+    except OSError:
+        return None
+
+    values = {}
+    for line in lines[1:]:
+        name, _, rest = line.partition(":")
+        if name in SMAPS_FIELDS:
+            values[name] = int(rest.split()[0]) * 1024
+    return values
+
+
+def process_memory(pid: int) -> Optional[Dict[str, int]]:
+    """共有・固有メモリの内訳
+
+    unique（USS）はそのプロセスだけが使っているページ、shared は他のプロセス（forkした親子など）と
+    共有しているページ、pss は共有ページをプロセス数で按分した値で、全プロセスの pss の合計が実際の使用量になる。
+    """
+    smaps = read_smaps_rollup(pid)
+    if smaps is None:
+        return None
+    return {
+        "rss": smaps.get("Rss", 0),
+        "pss": smaps.get("Pss", 0),
+        "shared": smaps.get("Shared_Clean", 0) + smaps.get("Shared_Dirty", 0),
+        "unique": smaps.get("Private_Clean", 0) + smaps.get("Private_Dirty", 0),
+        "swap": smaps.get("Swap", 0)
+    }
+
+
+def child_pids(pid: int) -> List[int]:
+    """直接の子プロセスのPID"""
+    children = []
+    try:
+        for task in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{task}/children") as f:
+                children.extend(int(child) for child in f.read().split())
+    except OSError:
+        pass
+    return sorted(set(children))
+
+
+def memory_report(pids: Iterable[int]) -> Dict[str, object]:
+    """複数プロセスのメモリ内訳と合計（pss の合計が全プロセスで実際に使っている量）"""
+    processes = {}
+    for pid in pids:
+        memory = process_memory(pid)
+        if memory is not None:
+            processes[pid] = memory
+    return {
+        "processes": processes,
+        "total_pss": sum(memory["pss"] for memory in processes.values()),
+        "total_rss": sum(memory["rss"] for memory in processes.values()),
+        "total_unique": sum(memory["unique"] for memory in processes.values())
+    }
+
+
+def format_memory_report(report: Dict[str, object], labels: Optional[Dict[int, str]] = None) -> str:
+    labels = labels or {}
+    mb = 1024 * 1024
+    lines = [f"{'プロセス':<14} {'PID':>8} {'RSS':>10} {'PSS':>10} {'共有':>10} {'固有':>10}"]
+    for pid, memory in report["processes"].items():
+        lines.append(
+            f"{labels.get(pid, ''):<14} {pid:>8} {memory['rss'] / mb:>8.1f}MB {memory['pss'] / mb:>8.1f}MB "
+            f"{memory['shared'] / mb:>8.1f}MB {memory['unique'] / mb:>8.1f}MB"
+        )
+    lines.append(
+        f"合計: PSS {report['total_pss'] / mb:.1f}MB / 固有 {report['total_unique'] / mb:.1f}MB "
+        f"(RSSの単純合計 {report['total_rss'] / mb:.1f}MB)"
+    )
+    return "\n".join(lines)
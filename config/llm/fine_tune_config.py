@@ -35,6 +35,19 @@ class FineTuneConfig:
     max_length: int = 512
     gradient_accumulation_steps: int = 1
     dataloader_num_workers: int = 4
+    max_steps: int = -1
+    
+    # CPU向けの効率化設定
+    # バッチ内の最長の例に合わせてパディングする（False なら全例を max_length までパディング）
+    dynamic_padding: bool = True
+    pad_to_multiple_of: Optional[int] = 8
+    # 長さの近い例を同じバッチにまとめ、パディングを減らす
+    group_by_length: bool = True
+    # auto: GPUなら fp16、CPUなら bf16 に対応していれば bf16、それ以外は fp32
+    precision: str = "auto"
+    gradient_checkpointing: bool = True
+    # PyTorchのスレッド数（0 なら変更しない）
+    num_threads: int = 0
     
     def __post_init__(self):
         if self.lora_target_modules is None:
@@ -48,9 +61,20 @@ class DatasetConfig:
     max_length: int = 512
     train_test_split: float = 0.8
     validation_split: float = 0.1
+    # 分割前のシャッフルのシード（同じデータと設定なら同じ分割になる）
+    shuffle_seed: int = 42
     
     # データ前処理
     clean_text: bool = True
     remove_duplicates: bool = True
     min_length: int = 10
-    max_examples: Optional[int] = None
\ No newline at end of file
+    max_examples: Optional[int] = None
+    # ほぼ重複とみなすJaccard類似度（文字n-gramのMinHashで推定、None なら完全一致のみ除去）
+    near_duplicate_threshold: Optional[float] = 0.8
+    minhash_num_perm: int = 128
+    minhash_ngram: int = 5
+    
+    # トークン化のプロセス数と、前処理済みデータセットのキャッシュ
+    num_proc: int = 4
+    cache_dir: str = "./data/cache/datasets"
+    use_cache: bool = True
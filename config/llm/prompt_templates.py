@@ -0,0 +1,8 @@
+# 言い訳生成のプロンプト
+# 固定部分を先頭に置き、推論時はそのKVキャッシュを再利用する。ファインチューニングでも同じ形式を使う。
+EXCUSE_PROMPT_PREFIX = "以下は質問に対する丁寧で説得力のある言い訳です。\n\n"
+EXCUSE_PROMPT_TEMPLATE = "質問: {question}\n\n言い訳:\n"
+
+
+def build_excuse_prompt(question: str, excuse: str = "") -> str:
+    return EXCUSE_PROMPT_PREFIX + EXCUSE_PROMPT_TEMPLATE.format(question=question) + excuse
@@ -1,7 +1,16 @@
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, generate_latest, multiprocess
 from api.v1.excuse_router import router as excuse_router
 from api.v1.reply_router import router as reply_router
+from client.llm.model_registry import get_model_registry
+from client.cache.response_cache import get_response_cache
+from client.cache.semantic_cache import get_semantic_cache
+from client.cache.single_flight import get_single_flight
+from client.metrics.process_memory import process_memory
+from service.readiness.readiness_service import FAILED, get_readiness_service
+from contextlib import asynccontextmanager
 import logging
 import os
 from dotenv import load_dotenv
@@ -14,12 +23,36 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    registry = get_model_registry()
+    readiness = get_readiness_service()
+    
+    # 起動時にモデルを一度だけロードし、全リクエストで共有する
+    # ロードとウォームアップはバックグラウンドで行い、その間も /health には応答する
+    readiness.start(preload=os.getenv("MODEL_PRELOAD", "true").lower() == "true")
+    
+    yield
+    
+    await readiness.stop()
+    
+    # 再起動後もキャッシュを引き継げるようにセマンティックキャッシュを保存
+    semantic_cache = get_semantic_cache()
+    if semantic_cache is not None:
+        semantic_cache.save()
+    
+    logger.info("シャットダウン: モデルを解放します")
+    registry.shutdown()
+
+
 app = FastAPI(
     title="ShachikuAI - 言い訳生成API",
     description="質問に対して丁寧で説得力のある言い訳を生成するAPI",
     version="1.0.0",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    lifespan=lifespan
 )
 
 app.add_middleware(
@@ -43,20 +76,71 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "service": "shachiku_ai"}
+    # liveness: モデルのロード中も応答する（ロードに失敗した場合のみ503）
+    readiness = get_readiness_service()
+    if readiness.state == FAILED:
+        return JSONResponse(
+            status_code=503,
+            content={"status": "unhealthy", "service": "shachiku_ai", "error": readiness.error}
+        )
+    return {"status": "healthy", "service": "shachiku_ai", "model": readiness.state}
+
+@app.get("/ready")
+async def ready_check():
+    # readiness: モデルのロードとウォームアップが完了してから200を返す
+    readiness = get_readiness_service()
+    status = readiness.get_status()
+    if not readiness.is_ready:
+        return JSONResponse(
+            status_code=503,
+            content=status,
+            headers={"Retry-After": str(readiness.retry_after)}
+        )
+    return status
+
+@app.get("/stats")
+async def stats():
+    # ロード済みモデルごとのキュー・バッチング・プレフィックスキャッシュ、応答キャッシュの統計
+    stats = get_model_registry().get_stats()
+    stats["readiness"] = get_readiness_service().get_status()
+    response_cache = get_response_cache()
+    semantic_cache = get_semantic_cache()
+    stats["response_cache"] = response_cache.get_stats() if response_cache else None
+    stats["semantic_cache"] = semantic_cache.get_stats() if semantic_cache else None
+    single_flight = get_single_flight()
+    stats["single_flight"] = single_flight.get_stats() if single_flight else None
+    # マルチワーカー時はワーカーごとの値（親プロセスと共有しているモデルの重みは shared に入る）
+    stats["process"] = {"pid": os.getpid(), "memory": process_memory(os.getpid())}
+    return stats
+
+@app.get("/metrics")
+async def metrics():
+    # Prometheus形式のメトリクス（生成のホットパスのヒストグラム・カウンターとプロセスのRSSなど）
+    # マルチワーカー時（PROMETHEUS_MULTIPROC_DIR を設定）は全ワーカーの値を集計して返す
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return Response(content=generate_latest(registry), headers={"Content-Type": CONTENT_TYPE_LATEST})
+    return Response(content=generate_latest(), headers={"Content-Type": CONTENT_TYPE_LATEST})
 
 if __name__ == "__main__":
     import uvicorn
     
     host = os.getenv("API_HOST", "0.0.0.0")
     port = int(os.getenv("API_PORT", 8000))
+    workers = int(os.getenv("API_WORKERS", 1))
     
     logger.info(f"ShachikuAI APIを起動中... {host}:{port}")
     
-    uvicorn.run(
-        "main:app",
-        host=host,
-        port=port,
-        reload=True,
-        log_level="info"
-    )
\ No newline at end of file
+    if workers > 1:
+        # モデルを親プロセスで一度だけロードし、forkしたワーカーで重みを共有する
+        from serving.prefork import PreforkServer
+        PreforkServer(app, host, port, workers, log_level="info").run()
+    else:
+        uvicorn.run(
+            "main:app",
+            host=host,
+            port=port,
+            reload=True,
+            log_level="info"
+        )
\ No newline at end of file
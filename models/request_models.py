@@ -1,19 +1,85 @@
-from pydantic import BaseModel
-from typing import Optional
+import os
+from pydantic import BaseModel, Field, field_validator
+from typing import List, Optional
 from datetime import datetime
 
+# クライアントが指定できる max_length の上限（超える値は上限に切り詰める）
+MAX_LENGTH_CAP = int(os.getenv("MAX_LENGTH_CAP", 512))
+
+
+def reject_candidate_options(items: list) -> list:
+    """バッチ生成で使えない要素ごとのオプションを指定した要素を拒否する（422）
+
+    バッチ生成は各要素1候補のみをパディングしたバッチでデコードするため、
+    num_candidates / return_alternatives と prompt_lookup（返信のみ）には対応しない。
+    """
+    for index, item in enumerate(items):
+        if item.num_candidates not in (None, 1) or item.return_alternatives:
+            raise ValueError(
+                f"items[{index}]: バッチ生成では num_candidates / return_alternatives を指定できません"
+                "（複数候補は単体のエンドポイントを使ってください）"
+            )
+        if getattr(item, "prompt_lookup", False):
+            raise ValueError(
+                f"items[{index}]: バッチ生成では prompt_lookup を指定できません"
+                "（プロンプト参照の投機的デコードは単体のエンドポイントを使ってください）"
+            )
+    return items
+
 
 class ExcuseRequest(BaseModel):
     question: str
-    max_length: Optional[int] = 512
+    max_length: Optional[int] = Field(default=512, ge=1)
     temperature: Optional[float] = 0.7
     top_p: Optional[float] = 0.9
+    use_cache: Optional[bool] = True
+    # 1回のバッチデコードで生成する候補数（信頼度が最も高い候補を返す）
+    num_candidates: Optional[int] = Field(default=1, ge=1, le=8)
+    return_alternatives: Optional[bool] = False
+    # 生成の締め切り（秒）。X-Request-Timeout ヘッダーと両方指定された場合は短い方を使う
+    timeout: Optional[float] = Field(default=None, gt=0, le=300)
+    # 公平キューイングとトークン予算の単位（省略時は anonymous）
+    userId: Optional[str] = None
+    channel: Optional[str] = None
+
+    @field_validator("max_length")
+    @classmethod
+    def cap_max_length(cls, value: Optional[int]) -> Optional[int]:
+        return min(value, MAX_LENGTH_CAP) if value is not None else value
+
+
+class ExcuseAlternative(BaseModel):
+    excuse: str
+    confidence: float
 
 
 class ExcuseResponse(BaseModel):
     question: str
     excuse: str
     confidence: float
+    alternatives: Optional[List[ExcuseAlternative]] = None
+    # 締め切りか切断で生成を打ち切り、途中までの言い訳を返した場合は True
+    partial: Optional[bool] = None
+
+
+class ExcuseBatchRequest(BaseModel):
+    items: List[ExcuseRequest] = Field(min_length=1, max_length=64)
+    # バッチ全体の締め切り（秒）。各要素の timeout とヘッダーを含めて最も短いものを使う
+    timeout: Optional[float] = Field(default=None, gt=0, le=300)
+
+    @field_validator("items")
+    @classmethod
+    def single_candidate_items(cls, items: List[ExcuseRequest]) -> List[ExcuseRequest]:
+        return reject_candidate_options(items)
+
+
+class ExcuseBatchItem(ExcuseResponse):
+    # 生成に失敗しフォールバックの言い訳を返した場合は True
+    fallback: bool = False
+
+
+class ExcuseBatchResponse(BaseModel):
+    results: List[ExcuseBatchItem]
 
 
 class ReplySettings(BaseModel):
@@ -36,8 +102,44 @@ class ReplyRequest(BaseModel):
     settings: ReplySettings
     mission: ReplyMission
     message: ReplyMessage
+    use_cache: Optional[bool] = True
+    # プロンプト中のn-gramを候補にする投機的デコードで生成する
+    prompt_lookup: Optional[bool] = False
+    # 1回のバッチデコードで生成する候補数（信頼度が最も高い候補を返す）
+    num_candidates: Optional[int] = Field(default=1, ge=1, le=8)
+    return_alternatives: Optional[bool] = False
+    # 生成の締め切り（秒）。X-Request-Timeout ヘッダーと両方指定された場合は短い方を使う
+    timeout: Optional[float] = Field(default=None, gt=0, le=300)
+
+
+class ReplyAlternative(BaseModel):
+    reply: str
+    confidence: float
 
 
 class ReplyResponse(BaseModel):
     reply: str
-    replyAt: datetime
\ No newline at end of file
+    replyAt: datetime
+    alternatives: Optional[List[ReplyAlternative]] = None
+    # 締め切りか切断で生成を打ち切り、途中までの返信を返した場合は True
+    partial: Optional[bool] = None
+
+
+class ReplyBatchRequest(BaseModel):
+    items: List[ReplyRequest] = Field(min_length=1, max_length=64)
+    # バッチ全体の締め切り（秒）。各要素の timeout とヘッダーを含めて最も短いものを使う
+    timeout: Optional[float] = Field(default=None, gt=0, le=300)
+
+    @field_validator("items")
+    @classmethod
+    def single_candidate_items(cls, items: List[ReplyRequest]) -> List[ReplyRequest]:
+        return reject_candidate_options(items)
+
+
+class ReplyBatchItem(ReplyResponse):
+    # 生成に失敗しフォールバックの返信を返した場合は True
+    fallback: bool = False
+
+
+class ReplyBatchResponse(BaseModel):
+    results: List[ReplyBatchItem]
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+セマンティックキャッシュの較正スクリプト
+
+ロードするモデル（MODEL_NAME）で言い換え・非言い換えの文対（data/calibration/semantic_pairs.jsonl）を埋め込み、
+埋め込みの平均ベクトル（平均中心化に使う）と、非言い換えの文対をキャッシュヒットさせない類似度の閾値を求めて保存する。
+モデルを変えたら較正し直す（較正したモデル以外ではセマンティックキャッシュは使われない）。
+
+    python scripts/calibrate_semantic_cache.py
+    python scripts/calibrate_semantic_cache.py --target-precision 0.95 --output ./data/models/semantic_calibration.npz
+"""
+import argparse
+import json
+import os
+import sys
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+# プロジェクトのルートディレクトリを追加
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from client.cache.semantic_cache import SemanticCalibration
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_pairs(path: str) -> List[dict]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def load_questions(path: str) -> List[str]:
+    """平均ベクトルの推定に加える学習データの質問"""
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line)["question"] for line in f if line.strip()]
+
+
+def choose_threshold(scores: Sequence[float], labels: Sequence[bool], target_precision: float) -> Optional[float]:
+    """類似度が閾値以上の文対の適合率が target_precision 以上になる最小の閾値（なければ None）"""
+    for threshold in sorted(set(scores)):
+        hits = [label for score, label in zip(scores, labels) if score >= threshold]
+        if any(hits) and sum(hits) / len(hits) >= target_precision:
+            return float(threshold)
+    return None
+
+
+def pair_scores(vectors: dict, pairs: List[dict], calibration: Optional[SemanticCalibration] = None) -> List[float]:
+    transform = calibration.transform if calibration is not None else (lambda vector: vector)
+    return [
+        float(transform(vectors[pair["text_a"]]) @ transform(vectors[pair["text_b"]]))
+        for pair in pairs
+    ]
+
+
+def summarize(name: str, scores: List[float], labels: List[bool]):
+    positives = [score for score, label in zip(scores, labels) if label]
+    negatives = [score for score, label in zip(scores, labels) if not label]
+    print(
+        f"{name:<8} 言い換え: 平均 {np.mean(positives):.3f} / 最小 {min(positives):.3f}   "
+        f"非言い換え: 平均 {np.mean(negatives):.3f} / 最大 {max(negatives):.3f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="セマンティックキャッシュの平均ベクトルと閾値を較正")
+    parser.add_argument("--pairs", default=os.path.join(ROOT_DIR, "data", "calibration", "semantic_pairs.jsonl"))
+    parser.add_argument("--questions", default=os.path.join(ROOT_DIR, "data", "training", "excuses.jsonl"))
+    parser.add_argument("--target-precision", type=float, default=1.0, help="較正用の文対でのキャッシュヒットの適合率の下限")
+    parser.add_argument("--margin", type=float, default=0.02, help="求めた閾値に足す余裕")
+    parser.add_argument(
+        "--output",
+        default=os.getenv("SEMANTIC_CACHE_CALIBRATION_PATH", "./data/models/semantic_calibration.npz"),
+        help="較正結果の保存先（SEMANTIC_CACHE_CALIBRATION_PATH）"
+    )
+    args = parser.parse_args()
+
+    from client.llm.model_client import ModelClient
+
+    pairs = load_pairs(args.pairs)
+    labels = [bool(pair["paraphrase"]) for pair in pairs]
+    texts = sorted({pair[key] for pair in pairs for key in ("text_a", "text_b")} | set(load_questions(args.questions)))
+
+    client = ModelClient()
+    vectors = {text: client._embed(text) for text in texts}
+    client.unload()
+
+    mean = np.mean([vectors[text] for text in texts], axis=0).astype(np.float32)
+    calibration = SemanticCalibration(client.model_name, mean, 1.0)
+    raw_scores = pair_scores(vectors, pairs)
+    centered_scores = pair_scores(vectors, pairs, calibration)
+    print(f"モデル: {client.model_name} ({len(texts)} 文で平均ベクトルを推定、文対 {len(pairs)} 件)")
+    summarize("中心化前", raw_scores, labels)
+    summarize("中心化後", centered_scores, labels)
+
+    threshold = choose_threshold(centered_scores, labels, args.target_precision)
+    if threshold is None:
+        print(f"適合率 {args.target_precision} を満たす閾値がありません。セマンティックキャッシュは有効にしないでください")
+        sys.exit(1)
+    threshold = min(1.0, threshold + args.margin)
+    hits = [label for score, label in zip(centered_scores, labels) if score >= threshold]
+    recall = sum(hits) / sum(labels)
+    precision = sum(hits) / len(hits) if hits else 1.0
+    print(f"閾値: {threshold:.3f} (適合率 {precision:.2f}, 再現率 {recall:.2f})")
+
+    calibration._replace(threshold=threshold).save(
+        args.output,
+        precision=np.array(precision),
+        recall=np.array(recall),
+        pairs=np.array(len(pairs))
+    )
+    print(f"較正結果を保存: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
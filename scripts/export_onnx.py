@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""
+ONNXエクスポートスクリプト
+
+MODEL_NAME / MODEL_PATH のモデルを、KVキャッシュ入出力付きのONNXモデルとして
+ONNX_MODEL_PATH にエクスポートする（INFERENCE_BACKEND=onnx で使用）。
+
+    python scripts/export_onnx.py --int8
+"""
+import argparse
+import logging
+import os
+import sys
+
+# プロジェクトのルートディレクトリを追加
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+from client.llm.inference_backend import resolve_model_source
+from client.llm.onnx_backend import export_onnx_model, quantize_onnx_model
+
+load_dotenv()
+logging.basicConfig(level=logging.INFO)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="モデルをONNX形式にエクスポート")
+    parser.add_argument("--model-name", default=os.getenv("MODEL_NAME", "microsoft/DialoGPT-medium"))
+    parser.add_argument("--model-path", default=os.getenv("MODEL_PATH", "./data/models"))
+    parser.add_argument("--output", default=os.getenv("ONNX_MODEL_PATH", "./data/models/onnx"))
+    parser.add_argument("--int8", action="store_true", help="動的INT8量子化したモデルも作成する")
+    args = parser.parse_args()
+
+    model_source = resolve_model_source(args.model_name, args.model_path)
+    export_onnx_model(model_source.path, args.output, local_files_only=model_source.local)
+    if args.int8:
+        quantize_onnx_model(args.output)
+
+
+if __name__ == "__main__":
+    main()
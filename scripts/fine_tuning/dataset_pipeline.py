@@ -0,0 +1,284 @@
+import os
+import glob
+import json
+import shutil
+import hashlib
+import tempfile
+import unicodedata
+from collections import Counter
+from dataclasses import asdict
+from typing import Any, Callable, Dict, Iterator, List
+import logging
+import numpy as np
+from datasets import Dataset, DatasetDict, load_from_disk
+from datasets.fingerprint import Hasher
+from config.llm.fine_tune_config import DatasetConfig
+from config.llm.prompt_templates import build_excuse_prompt
+
+logger = logging.getLogger(__name__)
+
+# 前処理の内容を変えたら上げる（キャッシュキーに含まれるため、古いキャッシュは使われなくなる）
+PIPELINE_VERSION = 1
+
+# キャッシュキーに含めない設定（前処理の結果が変わらないもの）
+_CACHE_IRRELEVANT_FIELDS = ("num_proc", "cache_dir", "use_cache")
+
+
+def find_shards(dataset_path: str) -> List[str]:
+    """dataset_path がディレクトリなら中の *.jsonl、globパターンなら一致するファイル、ファイルならそれ自体を返す"""
+    if os.path.isdir(dataset_path):
+        return sorted(glob.glob(os.path.join(dataset_path, "*.jsonl")))
+    if glob.has_magic(dataset_path):
+        return sorted(glob.glob(dataset_path))
+    return [dataset_path] if os.path.exists(dataset_path) else []
+
+
+def iter_jsonl(shards: List[str]) -> Iterator[Dict[str, Any]]:
+    """JSONLのシャードを1行ずつ読み込む（ファイル全体をメモリに載せない）"""
+    for shard in shards:
+        with open(shard, 'r', encoding='utf-8') as f:
+            for line_number, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning(f"JSONとして読み込めない行を除外: {shard}:{line_number}")
+
+
+def clean_text(text: str) -> str:
+    """全角/半角の揺れ、制御文字、連続する空白を取り除く"""
+    text = unicodedata.normalize("NFKC", text)
+    text = "".join(ch for ch in text if ch.isspace() or unicodedata.category(ch)[0] != "C")
+    return " ".join(text.split())
+
+
+class MinHashDeduplicator:
+    """文字n-gramのMinHashとLSHで、既出の例とのJaccard類似度が threshold 以上の例（ほぼ重複）を検出する
+
+    シグネチャを bands 個の帯に分け、いずれかの帯が一致した既出の例だけをシグネチャの一致率で比較する。
+    保持するのは残した例のシグネチャのみ（1例あたり num_perm × 4バイト）。
+    """
+
+    _MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+    _MAX_HASH = np.uint64((1 << 32) - 1)
+
+    def __init__(self, threshold: float = 0.8, num_perm: int = 128, ngram: int = 5, seed: int = 1):
+        self.threshold = threshold
+        self.ngram = ngram
+        self.bands, self.rows = self._optimal_bands(threshold, num_perm)
+        generator = np.random.RandomState(seed)
+        self._a = generator.randint(1, (1 << 61) - 1, size=num_perm, dtype=np.uint64)
+        self._b = generator.randint(0, (1 << 61) - 1, size=num_perm, dtype=np.uint64)
+        self._signatures: List[np.ndarray] = []
+        self._buckets: List[Dict[bytes, List[int]]] = [{} for _ in range(self.bands)]
+
+    @staticmethod
+    def _optimal_bands(threshold: float, num_perm: int):
+        # 候補になる類似度の境目 (1/bands)^(1/rows) が threshold 以下で最も近い分割（候補はシグネチャで確かめるため、取りこぼさない側に寄せる）
+        candidates = [(bands, num_perm // bands) for bands in range(1, num_perm + 1) if num_perm % bands == 0]
+        below = [c for c in candidates if (1 / c[0]) ** (1 / c[1]) <= threshold] or candidates
+        return max(below, key=lambda c: (1 / c[0]) ** (1 / c[1]))
+
+    def signature(self, text: str) -> np.ndarray:
+        shingles = {text[i:i + self.ngram] for i in range(max(1, len(text) - self.ngram + 1))}
+        hashes = np.array(
+            [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=4).digest(), "little") for s in shingles],
+            dtype=np.uint64
+        )
+        # 符号なし64ビットの乗算はオーバーフローで折り返すが、ハッシュ関数の族としては問題ない
+        permuted = (hashes[:, None] * self._a + self._b) % self._MERSENNE_PRIME & self._MAX_HASH
+        return permuted.min(axis=0).astype(np.uint32)
+
+    def is_duplicate(self, text: str) -> bool:
+        """既出の例とほぼ重複していれば True を返し、そうでなければ既出の例として記録する"""
+        signature = self.signature(text)
+        keys = [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+        candidates = {index for bucket, key in zip(self._buckets, keys) for index in bucket.get(key, ())}
+        for index in candidates:
+            if np.mean(self._signatures[index] == signature) >= self.threshold:
+                return True
+
+        index = len(self._signatures)
+        self._signatures.append(signature)
+        for bucket, key in zip(self._buckets, keys):
+            bucket.setdefault(key, []).append(index)
+        return False
+
+
+def iter_examples(shards: List[str], dataset_config: DatasetConfig, stats: Counter) -> Iterator[Dict[str, str]]:
+    """シャードを順に読み、整形・長さのフィルタ・重複除去をした例を返す（件数は stats に記録する）"""
+    question_column = dataset_config.question_column
+    answer_column = dataset_config.answer_column
+    seen = set()
+    near_duplicates = None
+    if dataset_config.remove_duplicates and dataset_config.near_duplicate_threshold is not None:
+        near_duplicates = MinHashDeduplicator(
+            threshold=dataset_config.near_duplicate_threshold,
+            num_perm=dataset_config.minhash_num_perm,
+            ngram=dataset_config.minhash_ngram
+        )
+
+    for record in iter_jsonl(shards):
+        stats["read"] += 1
+        question = record.get(question_column)
+        answer = record.get(answer_column)
+        if not isinstance(question, str) or not isinstance(answer, str):
+            stats["invalid"] += 1
+            continue
+        if dataset_config.clean_text:
+            question, answer = clean_text(question), clean_text(answer)
+        if not question or len(answer) < dataset_config.min_length:
+            stats["too_short"] += 1
+            continue
+
+        if dataset_config.remove_duplicates:
+            text = f"{question}\n{answer}"
+            digest = hashlib.sha1(text.encode("utf-8")).digest()
+            if digest in seen:
+                stats["exact_duplicates"] += 1
+                continue
+            seen.add(digest)
+            if near_duplicates is not None and near_duplicates.is_duplicate(text):
+                stats["near_duplicates"] += 1
+                continue
+
+        yield {question_column: question, answer_column: answer}
+        stats["kept"] += 1
+        if dataset_config.max_examples and stats["kept"] >= dataset_config.max_examples:
+            return
+
+
+def _hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def dataset_cache_key(shards: List[str], tokenizer, dataset_config: DatasetConfig, tokenize_options: Dict[str, Any]) -> str:
+    """データの内容・トークナイザー・前処理とトークン化の設定・プロンプト形式から前処理結果のキャッシュキーを作成"""
+    config = {
+        key: value for key, value in asdict(dataset_config).items() if key not in _CACHE_IRRELEVANT_FIELDS
+    }
+    payload = json.dumps(
+        {
+            "version": PIPELINE_VERSION,
+            "data": [_hash_file(shard) for shard in shards],
+            "tokenizer": Hasher.hash(tokenizer),
+            "config": config,
+            "tokenize": tokenize_options,
+            "prompt": build_excuse_prompt("{question}", "{excuse}")
+        },
+        ensure_ascii=False,
+        sort_keys=True
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _tokenize_function(
+    tokenizer,
+    dataset_config: DatasetConfig,
+    max_length: int,
+    dynamic_padding: bool
+) -> Callable[[Dict[str, List[str]]], Dict[str, List[Any]]]:
+    def tokenize(examples):
+        # 推論時（ExcuseService）と同じプロンプト形式で学習する
+        prompts = [
+            build_excuse_prompt(q, a)
+            for q, a in zip(examples[dataset_config.question_column], examples[dataset_config.answer_column])
+        ]
+        encoded = tokenizer(prompts)
+        # DatasetConfig.max_length を超える例は切り詰めると言い訳が途中で終わるため除外する
+        kept = [i for i, ids in enumerate(encoded["input_ids"]) if len(ids) <= dataset_config.max_length]
+        features = {
+            "input_ids": [encoded["input_ids"][i][:max_length] for i in kept],
+            "attention_mask": [encoded["attention_mask"][i][:max_length] for i in kept]
+        }
+        if not dynamic_padding:
+            features = dict(tokenizer.pad(features, padding="max_length", max_length=max_length))
+        # group_by_length でバッチを組むときの長さ（パディングを除く）
+        features["length"] = [sum(mask) for mask in features["attention_mask"]]
+        return features
+
+    return tokenize
+
+
+def _split(dataset: Dataset, dataset_config: DatasetConfig) -> DatasetDict:
+    # シャードの並び順（収集元や時期）が訓練・検証の分割に偏りとして出ないよう、固定のシードでシャッフルしてから分ける
+    dataset = dataset.shuffle(seed=dataset_config.shuffle_seed)
+    train_size = int(len(dataset) * dataset_config.train_test_split)
+    val_size = int(len(dataset) * dataset_config.validation_split)
+    return DatasetDict({
+        "train": dataset.select(range(train_size)),
+        "validation": dataset.select(range(train_size, train_size + val_size))
+    })
+
+
+def build_tokenized_dataset(
+    shards: List[str],
+    tokenizer,
+    dataset_config: DatasetConfig,
+    max_length: int,
+    dynamic_padding: bool
+) -> DatasetDict:
+    """JSONLのシャードから訓練・検証用のトークン化済みデータセットを作成する
+
+    前処理の結果はデータ・トークナイザー・設定のハッシュをキーにArrow形式で cache_dir に保存し、
+    同じキーで再実行したときは読み込むだけにする（ディスク上のArrowをメモリマップで参照する）。
+    """
+    tokenize_options = {"max_length": max_length, "dynamic_padding": dynamic_padding}
+    cache_path = None
+    if dataset_config.use_cache:
+        key = dataset_cache_key(shards, tokenizer, dataset_config, tokenize_options)
+        cache_path = os.path.join(dataset_config.cache_dir, key)
+        if os.path.isdir(cache_path):
+            logger.info(f"前処理済みのデータセットを読み込み: {cache_path}")
+            return load_from_disk(cache_path)
+
+    # 高速トークナイザーの内部スレッドとマルチプロセスのトークン化を併用しない
+    os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+    stats = Counter()
+    with tempfile.TemporaryDirectory() as work_dir:
+        # ジェネレーターの出力は逐次Arrowに書き出され、全件をメモリに載せない
+        dataset = Dataset.from_generator(
+            iter_examples,
+            gen_kwargs={"shards": shards, "dataset_config": dataset_config, "stats": stats},
+            cache_dir=work_dir
+        )
+        splits = _split(dataset, dataset_config)
+        tokenize = _tokenize_function(tokenizer, dataset_config, max_length, dynamic_padding)
+        tokenized = DatasetDict({
+            name: split.map(
+                tokenize,
+                batched=True,
+                remove_columns=split.column_names,
+                num_proc=dataset_config.num_proc if len(split) >= dataset_config.num_proc > 1 else None
+            )
+            for name, split in splits.items()
+        })
+        stats["too_long"] = sum(len(splits[name]) - len(tokenized[name]) for name in splits)
+        logger.info(
+            "前処理完了 - " + ", ".join(f"{name}: {count}" for name, count in stats.items())
+            + f" (訓練: {len(tokenized['train'])}, 検証: {len(tokenized['validation'])})"
+        )
+
+        if cache_path is None:
+            # 作業ディレクトリを削除する前にメモリに読み込む
+            return DatasetDict({name: Dataset.from_dict(split.to_dict()) for name, split in tokenized.items()})
+
+        # 書きかけのキャッシュを読まないよう、別名で保存してから置き換える
+        partial_path = f"{cache_path}.partial-{os.getpid()}"
+        tokenized.save_to_disk(partial_path)
+        with open(os.path.join(partial_path, "preprocess_stats.json"), 'w', encoding='utf-8') as f:
+            json.dump(dict(stats), f, ensure_ascii=False, indent=2)
+        try:
+            os.replace(partial_path, cache_path)
+        except OSError:
+            # 同じキーのキャッシュを別のプロセスが先に保存した
+            shutil.rmtree(partial_path, ignore_errors=True)
+        logger.info(f"前処理済みのデータセットを保存: {cache_path}")
+
+    return load_from_disk(cache_path)
@@ -1,5 +1,6 @@
 import os
 import json
+import time
 import torch
 from transformers import (
     AutoTokenizer, 
@@ -8,15 +9,54 @@ from transformers import (
     Trainer,
     DataCollatorForLanguageModeling
 )
-from datasets import Dataset, load_dataset
 from peft import LoraConfig, get_peft_model, TaskType
 import logging
 from config.llm.fine_tune_config import FineTuneConfig, DatasetConfig
+from scripts.fine_tuning.dataset_pipeline import build_tokenized_dataset, find_shards
 from typing import Dict, Any
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+PRECISIONS = ("auto", "bf16", "fp16", "fp32")
+
+
+def resolve_precision(precision: str, use_cuda: bool) -> str:
+    """FineTuneConfig.precision から学習時の精度を決める"""
+    if precision not in PRECISIONS:
+        raise ValueError(f"precision は {', '.join(PRECISIONS)} のいずれかを指定してください: {precision}")
+    if precision == "fp16" and not use_cuda:
+        raise ValueError("fp16 の学習にはGPUが必要です。CPUでは bf16 か fp32 を指定してください")
+    if precision != "auto":
+        return precision
+    if use_cuda:
+        return "fp16"
+    # bf16命令（AVX512-BF16/AMX）のないCPUでは bf16 の演算がエミュレーションになり fp32 より遅い
+    return "bf16" if torch.ops.mkldnn._is_mkldnn_bf16_supported() else "fp32"
+
+
+def read_peak_rss_mb() -> float:
+    # VmHWM はプロセス開始からの常駐メモリ(RSS)の最大値
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+class ThroughputTrainer(Trainer):
+    """学習ステップごとに、実際のトークン数とパディングを含めたトークン数を数える"""
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.tokens = 0
+        self.padded_tokens = 0
+    
+    def training_step(self, model, inputs):
+        self.tokens += int(inputs["attention_mask"].sum())
+        self.padded_tokens += inputs["input_ids"].numel()
+        return super().training_step(model, inputs)
+
 
 class ExcuseFineTuner:
     def __init__(self, config: FineTuneConfig):
@@ -24,20 +64,36 @@ class ExcuseFineTuner:
         self.tokenizer = None
         self.model = None
         self.dataset = None
+        self.use_cuda = torch.cuda.is_available()
+        self.precision = resolve_precision(config.precision, self.use_cuda)
         
     def setup_model_and_tokenizer(self):
         logger.info(f"モデルとトークナイザーを初期化: {self.config.model_name}")
         
+        if self.config.num_threads > 0:
+            torch.set_num_threads(self.config.num_threads)
+        logger.info(
+            f"学習デバイス: {'cuda' if self.use_cuda else 'cpu'}, 精度: {self.precision}, "
+            f"スレッド数: {torch.get_num_threads()}"
+        )
+        
         self.tokenizer = AutoTokenizer.from_pretrained(self.config.model_name)
         if self.tokenizer.pad_token is None:
             self.tokenizer.pad_token = self.tokenizer.eos_token
             
+        # bf16 は重みを fp32 のまま読み込み、学習時の autocast で使う
         self.model = AutoModelForCausalLM.from_pretrained(
             self.config.model_name,
-            torch_dtype=torch.float16,
-            device_map="auto"
+            torch_dtype=torch.float16 if self.precision == "fp16" else torch.float32,
+            device_map="auto" if self.use_cuda else None
         )
         
+        if self.config.gradient_checkpointing:
+            # 活性化を保存せず逆伝播時に再計算する（ベースモデルの重みは凍結されるため、埋め込みの出力に勾配を流す）
+            self.model.gradient_checkpointing_enable()
+            self.model.enable_input_require_grads()
+            self.model.config.use_cache = False
+        
         # LoRA設定
         lora_config = LoraConfig(
             task_type=TaskType.CAUSAL_LM,
@@ -53,43 +109,22 @@ class ExcuseFineTuner:
     def prepare_dataset(self, dataset_config: DatasetConfig):
         logger.info(f"データセットを準備: {self.config.dataset_path}")
         
-        if not os.path.exists(self.config.dataset_path):
+        shards = find_shards(self.config.dataset_path)
+        if not shards:
             logger.warning("トレーニングデータが見つかりません。サンプルデータを作成します。")
             self._create_sample_dataset()
-        
-        # JSONLファイルを読み込み
-        data = []
-        with open(self.config.dataset_path, 'r', encoding='utf-8') as f:
-            for line in f:
-                data.append(json.loads(line.strip()))
-        
-        # データセット作成
-        dataset = Dataset.from_list(data)
-        
-        # データセットを分割
-        train_size = int(len(dataset) * dataset_config.train_test_split)
-        val_size = int(len(dataset) * dataset_config.validation_split)
-        
-        train_dataset = dataset.select(range(train_size))
-        val_dataset = dataset.select(range(train_size, train_size + val_size))
-        
-        # トークン化
-        def tokenize_function(examples):
-            prompts = [
-                f"質問: {q}\n\n以下は上記の質問に対する丁寧で説得力のある言い訳です:\n\n{a}"
-                for q, a in zip(examples[dataset_config.question_column], examples[dataset_config.answer_column])
-            ]
-            
-            return self.tokenizer(
-                prompts,
-                truncation=True,
-                padding="max_length",
-                max_length=self.config.max_length,
-                return_tensors="pt"
-            )
-        
-        self.train_dataset = train_dataset.map(tokenize_function, batched=True)
-        self.val_dataset = val_dataset.map(tokenize_function, batched=True)
+            shards = [self.config.dataset_path]
+        
+        # シャードを逐次読み込んで整形・フィルタ・重複除去し、トークン化した結果をキャッシュする
+        dataset = build_tokenized_dataset(
+            shards,
+            self.tokenizer,
+            dataset_config,
+            max_length=self.config.max_length,
+            dynamic_padding=self.config.dynamic_padding
+        )
+        self.train_dataset = dataset["train"]
+        self.val_dataset = dataset["validation"]
         
         logger.info(f"データセット準備完了 - 訓練: {len(self.train_dataset)}, 検証: {len(self.val_dataset)}")
     
@@ -120,7 +155,8 @@ class ExcuseFineTuner:
         
         logger.info(f"サンプルデータセットを作成: {self.config.dataset_path}")
     
-    def train(self):
+    def train(self) -> Dict[str, Any]:
+        """ファインチューニングを実行し、tokens/sec とピークRSSのレポートを返す（出力先にも保存する）"""
         logger.info("ファインチューニングを開始")
         
         os.makedirs(self.config.output_dir, exist_ok=True)
@@ -140,16 +176,21 @@ class ExcuseFineTuner:
             logging_steps=self.config.logging_steps,
             gradient_accumulation_steps=self.config.gradient_accumulation_steps,
             dataloader_num_workers=self.config.dataloader_num_workers,
-            fp16=True,
+            max_steps=self.config.max_steps,
+            group_by_length=self.config.group_by_length,
+            fp16=self.precision == "fp16",
+            bf16=self.precision == "bf16",
+            use_cpu=not self.use_cuda,
             report_to=None
         )
         
         data_collator = DataCollatorForLanguageModeling(
             tokenizer=self.tokenizer,
-            mlm=False
+            mlm=False,
+            pad_to_multiple_of=self.config.pad_to_multiple_of if self.config.dynamic_padding else None
         )
         
-        trainer = Trainer(
+        trainer = ThroughputTrainer(
             model=self.model,
             args=training_args,
             train_dataset=self.train_dataset,
@@ -157,13 +198,40 @@ class ExcuseFineTuner:
             data_collator=data_collator,
         )
         
+        start = time.perf_counter()
         trainer.train()
+        report = self._throughput_report(trainer, time.perf_counter() - start)
         
         # モデルを保存
         trainer.save_model()
         self.tokenizer.save_pretrained(self.config.output_dir)
+        with open(os.path.join(self.config.output_dir, "training_report.json"), 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
         
         logger.info(f"ファインチューニング完了。モデルを保存: {self.config.output_dir}")
+        logger.info(
+            f"学習: {report['tokens_per_second']:.1f} tokens/sec, "
+            f"パディングの割合: {report['padding_ratio']:.1%}, ピークRSS: {report['peak_rss_mb']:.0f}MB"
+        )
+        return report
+    
+    def _throughput_report(self, trainer: ThroughputTrainer, train_seconds: float) -> Dict[str, Any]:
+        return {
+            "device": "cuda" if self.use_cuda else "cpu",
+            "precision": self.precision,
+            "num_threads": torch.get_num_threads(),
+            "dynamic_padding": self.config.dynamic_padding,
+            "group_by_length": self.config.group_by_length,
+            "gradient_checkpointing": self.config.gradient_checkpointing,
+            "steps": trainer.state.global_step,
+            "train_seconds": train_seconds,
+            "tokens": trainer.tokens,
+            "padded_tokens": trainer.padded_tokens,
+            # パディングを除いた実際のトークン数で計算する
+            "tokens_per_second": trainer.tokens / train_seconds if train_seconds > 0 else 0.0,
+            "padding_ratio": 1 - trainer.tokens / trainer.padded_tokens if trainer.padded_tokens else 0.0,
+            "peak_rss_mb": read_peak_rss_mb()
+        }
 
 
 def main():
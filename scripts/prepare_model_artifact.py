@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+ローカルモデル成果物の作成・検証スクリプト
+
+Hugging Face（またはローカルパス）のモデルをsafetensors形式で MODEL_PATH に保存し、
+チェックサム・dtype・設定ハッシュを記録したマニフェスト（model_manifest.json）を作成する。
+有効なマニフェストがある場合、APIはネットワークにアクセスせずにローカルの成果物をロードする。
+
+    python scripts/prepare_model_artifact.py --dtype float16
+    python scripts/prepare_model_artifact.py --verify
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+# プロジェクトのルートディレクトリを追加
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import torch
+from dotenv import load_dotenv
+from transformers import AutoTokenizer, AutoModelForCausalLM
+from client.llm.model_artifact import validate_manifest, weights_format, write_manifest
+
+load_dotenv()
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def prepare(source: str, output_dir: str, dtype: str):
+    start = time.perf_counter()
+    tokenizer = AutoTokenizer.from_pretrained(source)
+    model = AutoModelForCausalLM.from_pretrained(
+        source,
+        torch_dtype=getattr(torch, dtype),
+        low_cpu_mem_usage=True,
+        trust_remote_code=True
+    )
+
+    os.makedirs(output_dir, exist_ok=True)
+    # 既存のpytorch_model.binが残っているとどちらを読むか紛らわしいため削除する
+    for name in os.listdir(output_dir):
+        if name.startswith("pytorch_model") and name.endswith((".bin", ".bin.index.json")):
+            os.remove(os.path.join(output_dir, name))
+
+    model.save_pretrained(output_dir, safe_serialization=True)
+    tokenizer.save_pretrained(output_dir)
+    write_manifest(output_dir, model_name=source)
+    logger.info(f"モデル成果物を作成: {output_dir} ({time.perf_counter() - start:.1f}s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ローカルモデル成果物の作成・検証")
+    parser.add_argument("--source", default=None, help="変換元のモデル名またはパス（省略時は MODEL_PATH、なければ MODEL_NAME）")
+    parser.add_argument("--output", default=os.getenv("MODEL_PATH", "./data/models"))
+    parser.add_argument("--dtype", default="float32", choices=["float32", "float16", "bfloat16"])
+    parser.add_argument("--verify", action="store_true", help="作成せずにマニフェストの検証だけを行う")
+    args = parser.parse_args()
+
+    if args.verify:
+        valid, reason = validate_manifest(args.output)
+        print(f"{args.output}: {'有効' if valid else '無効'} ({reason})")
+        sys.exit(0 if valid else 1)
+
+    source = args.source
+    if source is None:
+        source = args.output if weights_format(args.output) else os.getenv("MODEL_NAME", "microsoft/DialoGPT-medium")
+    prepare(source, args.output, args.dtype)
+
+
+if __name__ == "__main__":
+    main()
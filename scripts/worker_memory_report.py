@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+マルチワーカー（API_WORKERS > 1）の共有・固有メモリの確認スクリプト
+
+親プロセスと各ワーカーのメモリを /proc/<pid>/smaps_rollup から読み取り、
+ワーカーごとの固有メモリ（USS）と親プロセスと共有しているメモリ、全体のPSSの合計を表示する。
+モデルの重みがコピーオンライトで共有されていれば、ワーカーの固有メモリは重みのサイズよりずっと小さく、
+PSSの合計はワーカー数によらずモデル1つ分に近くなる。
+
+    python scripts/worker_memory_report.py --pid <親プロセスのPID>
+    python scripts/worker_memory_report.py --pid <親プロセスのPID> --output memory.json
+"""
+import argparse
+import json
+import os
+import sys
+
+# プロジェクトのルートディレクトリを追加
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from client.metrics.process_memory import child_pids, format_memory_report, memory_report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="マルチワーカーの共有・固有メモリを表示")
+    parser.add_argument("--pid", type=int, required=True, help="親プロセス（python main.py）のPID")
+    parser.add_argument("--output", help="結果をJSONで保存するパス")
+    args = parser.parse_args()
+
+    workers = child_pids(args.pid)
+    labels = {args.pid: "親プロセス"}
+    labels.update({pid: f"ワーカー{index}" for index, pid in enumerate(workers)})
+    report = memory_report(labels.keys())
+    if args.pid not in report["processes"]:
+        print(f"プロセス {args.pid} のメモリを読み取れませんでした")
+        sys.exit(1)
+
+    print(format_memory_report(report, labels))
+    if workers:
+        worker_unique = [report["processes"][pid]["unique"] for pid in workers if pid in report["processes"]]
+        print(f"ワーカーの固有メモリ（平均）: {sum(worker_unique) / len(worker_unique) / 1024 / 1024:.1f}MB")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({**report, "labels": labels}, f, ensure_ascii=False, indent=2)
+        print(f"\n結果を保存: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
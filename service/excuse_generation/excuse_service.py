@@ -1,16 +1,46 @@
 import os
 import torch
 from transformers import AutoTokenizer, AutoModelForCausalLM
-from typing import Dict, Any
+from typing import AsyncIterator, Dict, Any, List, Optional
 import logging
 from client.llm.model_client import ModelClient
+from client.llm.inference_executor import QueueFullError
+from client.llm.fair_scheduler import QuotaExceededError, Tenant
+from client.llm.model_registry import get_model_registry
+from client.llm.generation_constraints import GenerationConstraints
+from client.llm.generation_deadline import GenerationDeadline
+from client.cache.response_cache import ResponseCache, get_response_cache, make_cache_key
+from client.cache.semantic_cache import SemanticCache, get_semantic_cache, make_namespace
+from client.cache.single_flight import SingleFlight, get_single_flight
+from client.metrics.generation_metrics import POSTPROCESS_SECONDS, record_error, record_fallback, track_in_flight
+from config.llm.prompt_templates import EXCUSE_PROMPT_PREFIX, build_excuse_prompt
+from models.request_models import ExcuseRequest
 
 logger = logging.getLogger(__name__)
 
 
 class ExcuseService:
-    def __init__(self):
-        self.model_client = ModelClient()
+    # _format_excuse は「質問:」で始まらない最初の空でない行しか使わないため、その行が終わった時点で停止する
+    GENERATION_CONSTRAINTS = GenerationConstraints(
+        stop_at_line_end=True,
+        ignored_line_prefixes=("質問:",)
+    )
+    # 生成テキストに言い訳の行がない場合に _format_excuse が返す文言
+    EMPTY_EXCUSE = "申し訳ございません、適切な対応ができませんでした。"
+    
+    def __init__(
+        self,
+        model_client: Optional[ModelClient] = None,
+        response_cache: Optional[ResponseCache] = None,
+        semantic_cache: Optional[SemanticCache] = None,
+        single_flight: Optional[SingleFlight] = None
+    ):
+        # 明示的に渡されない場合は共有レジストリからモデルを取得する
+        self._owns_model_reference = model_client is None
+        self.model_client = model_client or get_model_registry().acquire()
+        self.response_cache = response_cache or get_response_cache()
+        self.semantic_cache = semantic_cache or get_semantic_cache()
+        self.single_flight = single_flight or get_single_flight()
         self.excuse_prompts = [
             "申し訳ございません、",
             "すみません、実は",
@@ -19,35 +49,152 @@ class ExcuseService:
             "ご迷惑をおかけして申し訳ないのですが、"
         ]
         
+    def close(self):
+        """レジストリから取得したモデルの参照を返却"""
+        if self._owns_model_reference and self.model_client is not None:
+            get_model_registry().release(self.model_client)
+            self.model_client = None
+    
+    @track_in_flight("excuse")
     async def generate_excuse(
         self,
         question: str,
         max_length: int = 512,
         temperature: float = 0.7,
-        top_p: float = 0.9
+        top_p: float = 0.9,
+        use_cache: bool = True,
+        num_candidates: int = 1,
+        deadline: Optional[GenerationDeadline] = None,
+        tenant: Optional[Tenant] = None
     ) -> Dict[str, Any]:
+        """言い訳を生成
+
+        num_candidatesが2以上の場合は1回のバッチデコードで候補を生成し、信頼度が最も高い候補を返す
+        （残りは信頼度順に alternatives として返す）。
+        deadlineの締め切りまでに生成が終わらなかった場合は途中までの言い訳を partial として返し、
+        言い訳の行ができていなければフォールバックの言い訳を返す。
+        use_cacheが有効な場合、同じ質問・生成パラメータのリクエストを生成中であれば新たに生成せずその結果を共有する。
+        """
         try:
             prompt = self._create_excuse_prompt(question)
             
-            response = await self.model_client.generate_text(
-                prompt=prompt,
-                max_length=max_length,
-                temperature=temperature,
-                top_p=top_p,
-                do_sample=True
+            cache_params = {
+                "max_length": max_length,
+                "temperature": temperature,
+                "top_p": top_p,
+                "num_candidates": num_candidates,
+                "model": self.model_client.model_name
+            }
+            
+            # 同じ質問・生成パラメータのリクエストはキャッシュ済みの言い訳を返す
+            cache_key = make_cache_key("excuse", prompt, cache_params)
+            use_exact_cache = use_cache and self.response_cache is not None
+            if use_exact_cache:
+                cached = self.response_cache.get("excuse", cache_key)
+                if cached is not None:
+                    return {**cached, "cached": True}
+            
+            # 言い換えの質問は埋め込みの類似度で検索する
+            use_semantic_cache = (
+                use_cache
+                and self.semantic_cache is not None
+                and self.semantic_cache.supports(self.model_client.model_name)
             )
+            if use_semantic_cache:
+                namespace = make_namespace("excuse", cache_params)
+                embedding = await self.model_client.embed_text(question)
+                match = self.semantic_cache.lookup("excuse", namespace, embedding)
+                if match is not None:
+                    cached, similarity = match
+                    logger.info(f"類似質問のキャッシュを使用 (類似度: {similarity:.3f})")
+                    return {**cached, "cached": True}
             
-            excuse_text = self._format_excuse(response["generated_text"])
-            confidence = self._calculate_confidence(excuse_text)
+            def generate(generation_deadline: Optional[GenerationDeadline]):
+                return self.model_client.generate_text(
+                    prompt=prompt,
+                    max_length=max_length,
+                    temperature=temperature,
+                    top_p=top_p,
+                    do_sample=True,
+                    num_return_sequences=num_candidates,
+                    constraints=self.GENERATION_CONSTRAINTS,
+                    prefix=EXCUSE_PROMPT_PREFIX,
+                    endpoint="excuse",
+                    deadline=generation_deadline,
+                    tenant=tenant
+                )
             
-            return {
-                "text": excuse_text,
-                "confidence": confidence,
+            # 同じ質問・生成パラメータのリクエストを生成中であれば、その生成結果を共有する
+            # （共有したリクエストのテナントも合流前に予算を確認し、生成したトークン数を課金する）
+            if use_cache and self.single_flight is not None:
+                joined = []
+                
+                def join():
+                    self.model_client.check_quota(tenant)
+                    joined.append(True)
+                
+                response = await self.single_flight.run("excuse", cache_key, generate, deadline, on_join=join)
+                if joined and response is not None:
+                    self.model_client.charge_shared_generation(tenant, response)
+            else:
+                response = await generate(deadline)
+            if response is None:
+                logger.info(f"共有の生成の完了を待たずに打ち切られたため、フォールバックを使用 (理由: {deadline.reason})")
+                record_fallback("excuse", self.model_client.model_name, deadline.reason)
+                return {
+                    "text": self._get_fallback_excuse(question),
+                    "confidence": 0.3,
+                    "prompt_used": "fallback"
+                }
+            stopped = response.get("stopped")
+            
+            # 生成された候補をフォーマットし、信頼度の高い順に並べる
+            with POSTPROCESS_SECONDS.labels("excuse", self.model_client.model_name).time():
+                candidates = [
+                    self._format_excuse(text)
+                    for text in response.get("generated_texts", [response["generated_text"]])
+                ]
+                if stopped:
+                    # 打ち切った生成は言い訳の行ができている候補だけを使う
+                    candidates = [candidate for candidate in candidates if candidate != self.EMPTY_EXCUSE]
+                confidences = self._calculate_confidences(candidates)
+            if not candidates:
+                logger.info(f"言い訳を生成できないまま打ち切られたため、フォールバックを使用 (理由: {stopped})")
+                record_fallback("excuse", self.model_client.model_name, stopped)
+                return {
+                    "text": self._get_fallback_excuse(question),
+                    "confidence": 0.3,
+                    "prompt_used": "fallback"
+                }
+            ranking = sorted(range(len(candidates)), key=lambda i: -confidences[i])
+            result = {
+                "text": candidates[ranking[0]],
+                "confidence": float(confidences[ranking[0]]),
                 "prompt_used": prompt
             }
+            if len(candidates) > 1:
+                result["alternatives"] = [
+                    {"text": candidates[i], "confidence": float(confidences[i])} for i in ranking[1:]
+                ]
+            if stopped:
+                result["partial"] = True
+            
+            # システムエラー時・打ち切った途中までの出力はキャッシュしない
+            if "error" not in response and not stopped:
+                if use_exact_cache:
+                    self.response_cache.set("excuse", cache_key, result)
+                if use_semantic_cache:
+                    self.semantic_cache.insert("excuse", namespace, embedding, result)
+            
+            return result
             
+        except (QueueFullError, QuotaExceededError) as e:
+            record_error("excuse", self.model_client.model_name, e)
+            raise
         except Exception as e:
             logger.error(f"言い訳生成中にエラー: {str(e)}")
+            record_error("excuse", self.model_client.model_name, e)
+            record_fallback("excuse", self.model_client.model_name, "exception")
             fallback_excuse = self._get_fallback_excuse(question)
             return {
                 "text": fallback_excuse,
@@ -55,12 +202,156 @@ class ExcuseService:
                 "prompt_used": "fallback"
             }
     
-    def _create_excuse_prompt(self, question: str) -> str:
-        return f"""質問: {question}
+    @track_in_flight("excuses")
+    async def generate_excuses(
+        self,
+        requests: List[ExcuseRequest],
+        deadline: Optional[GenerationDeadline] = None
+    ) -> List[Dict[str, Any]]:
+        """複数の質問に対する言い訳をまとめて生成（入力順に返す）
 
-以下は上記の質問に対する丁寧で説得力のある言い訳です:
+        生成パラメータが同じ質問ごとにパディングしたバッチで生成し、失敗した要素だけフォールバックする。
+        deadlineはバッチ全体の締め切りで、打ち切られた要素は途中までの言い訳かフォールバックを返す。
+        """
+        results: List[Optional[Dict[str, Any]]] = [None] * len(requests)
+        groups: Dict[tuple, List[int]] = {}
+        cache_keys: Dict[int, str] = {}
+        
+        for index, request in enumerate(requests):
+            prompt = self._create_excuse_prompt(request.question)
+            if request.use_cache and self.response_cache is not None:
+                cache_keys[index] = make_cache_key("excuse", prompt, {
+                    "max_length": request.max_length,
+                    "temperature": request.temperature,
+                    "top_p": request.top_p,
+                    "num_candidates": 1,
+                    "model": self.model_client.model_name
+                })
+                cached = self.response_cache.get("excuse", cache_keys[index])
+                if cached is not None:
+                    results[index] = {**cached, "cached": True}
+                    continue
+            groups.setdefault((request.max_length, request.temperature, request.top_p), []).append(index)
+        
+        for (max_length, temperature, top_p), indices in groups.items():
+            try:
+                responses = await self.model_client.generate_batch(
+                    [self._create_excuse_prompt(requests[i].question) for i in indices],
+                    max_length=max_length,
+                    temperature=temperature,
+                    top_p=top_p,
+                    do_sample=True,
+                    constraints=self.GENERATION_CONSTRAINTS,
+                    endpoint="excuses",
+                    deadline=deadline,
+                    tenants=[Tenant.of(requests[i].userId, requests[i].channel) for i in indices]
+                )
+            except (QueueFullError, QuotaExceededError) as e:
+                record_error("excuses", self.model_client.model_name, e)
+                raise
+            except Exception as e:
+                logger.error(f"言い訳のバッチ生成中にエラー: {str(e)}")
+                record_error("excuses", self.model_client.model_name, e)
+                responses = [{"error": str(e)} for _ in indices]
+            
+            with POSTPROCESS_SECONDS.labels("excuses", self.model_client.model_name).time():
+                texts = [self._format_excuse(response.get("generated_text", "")) for response in responses]
+                confidences = self._calculate_confidences(texts)
+            for index, response, excuse_text, confidence in zip(indices, responses, texts, confidences):
+                stopped = response.get("stopped")
+                if "error" in response or (stopped and excuse_text == self.EMPTY_EXCUSE):
+                    record_fallback("excuses", self.model_client.model_name, stopped or "generation_error")
+                    results[index] = {
+                        "text": self._get_fallback_excuse(requests[index].question),
+                        "confidence": 0.3,
+                        "prompt_used": "fallback",
+                        "fallback": True
+                    }
+                    continue
+                
+                results[index] = {
+                    "text": excuse_text,
+                    "confidence": float(confidence),
+                    "prompt_used": response["prompt"]
+                }
+                if stopped:
+                    results[index]["partial"] = True
+                elif index in cache_keys:
+                    self.response_cache.set("excuse", cache_keys[index], results[index])
+        
+        return results
+    
+    @track_in_flight("excuse_stream")
+    async def stream_excuse(
+        self,
+        question: str,
+        max_length: int = 512,
+        temperature: float = 0.7,
+        top_p: float = 0.9,
+        deadline: Optional[GenerationDeadline] = None,
+        tenant: Optional[Tenant] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """言い訳をトークン単位で順次返し、最後にフォーマット済みの言い訳を返す
 
-"""
+        deadlineの締め切りで打ち切られた場合、最後のイベントは途中までの言い訳（partial）かフォールバックになる。
+        """
+        prompt = self._create_excuse_prompt(question)
+        deadline = deadline or GenerationDeadline()
+        generated_text = ""
+        partial = None
+        
+        try:
+            async for delta in self.model_client.stream_text(
+                prompt=prompt,
+                max_length=max_length,
+                temperature=temperature,
+                top_p=top_p,
+                do_sample=True,
+                constraints=self.GENERATION_CONSTRAINTS,
+                prefix=EXCUSE_PROMPT_PREFIX,
+                endpoint="excuse_stream",
+                deadline=deadline,
+                tenant=tenant
+            ):
+                generated_text += delta
+                yield {"event": "token", "data": {"text": delta}}
+            
+            with POSTPROCESS_SECONDS.labels("excuse_stream", self.model_client.model_name).time():
+                excuse_text = self._format_excuse(generated_text)
+                confidence = self._calculate_confidence(excuse_text)
+            prompt_used = prompt
+            if deadline.interrupted:
+                if excuse_text == self.EMPTY_EXCUSE:
+                    record_fallback("excuse_stream", self.model_client.model_name, deadline.reason)
+                    excuse_text = self._get_fallback_excuse(question)
+                    confidence = 0.3
+                    prompt_used = "fallback"
+                else:
+                    partial = True
+        except (QueueFullError, QuotaExceededError) as e:
+            record_error("excuse_stream", self.model_client.model_name, e)
+            raise
+        except Exception as e:
+            logger.error(f"言い訳のストリーミング生成中にエラー: {str(e)}")
+            record_error("excuse_stream", self.model_client.model_name, e)
+            record_fallback("excuse_stream", self.model_client.model_name, "exception")
+            excuse_text = self._get_fallback_excuse(question)
+            confidence = 0.3
+            prompt_used = "fallback"
+        
+        yield {
+            "event": "done",
+            "data": {
+                "question": question,
+                "excuse": excuse_text,
+                "confidence": confidence,
+                "prompt_used": prompt_used,
+                "partial": partial
+            }
+        }
+    
+    def _create_excuse_prompt(self, question: str) -> str:
+        return build_excuse_prompt(question)
     
     def _format_excuse(self, generated_text: str) -> str:
         lines = generated_text.strip().split('\n')
@@ -73,7 +364,7 @@ class ExcuseService:
         if excuse_lines:
             return excuse_lines[0]
         else:
-            return "申し訳ございません、適切な対応ができませんでした。"
+            return self.EMPTY_EXCUSE
     
     def _calculate_confidence(self, excuse_text: str) -> float:
         confidence = 0.5
@@ -87,6 +378,10 @@ class ExcuseService:
             
         return min(confidence, 1.0)
     
+    def _calculate_confidences(self, excuse_texts: List[str]) -> List[float]:
+        """複数の言い訳候補の信頼度を計算（候補は高々8件なので1件ずつ計算する）"""
+        return [self._calculate_confidence(text) for text in excuse_texts]
+    
     def _get_fallback_excuse(self, question: str) -> str:
         import random
         fallback_excuses = [
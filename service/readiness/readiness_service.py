@@ -0,0 +1,150 @@
+import os
+import time
+import asyncio
+from contextlib import suppress
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+import logging
+from client.llm.model_client import ModelClient
+from client.llm.model_registry import get_model_registry
+from models.request_models import ReplyRequest, ReplySettings, ReplyMission, ReplyMessage
+from service.excuse_generation.excuse_service import ExcuseService
+from service.reply_generation.reply_service import ReplyService
+
+logger = logging.getLogger(__name__)
+
+STARTING = "starting"
+LOADING = "loading"
+WARMING_UP = "warming_up"
+READY = "ready"
+FAILED = "failed"
+
+# ウォームアップに使う代表的なリクエスト
+WARMUP_QUESTION = "なぜ遅刻したのですか？"
+WARMUP_REPLY = ("やんわりと断る", "角が立たないように断る", "明日の飲み会に参加しませんか？")
+
+
+class ModelNotReadyError(Exception):
+    """モデルのロードまたはウォームアップが終わっていないときに送出される"""
+
+    def __init__(self, state: str, retry_after: int):
+        super().__init__(f"モデルの準備中です (状態: {state})")
+        self.state = state
+        self.retry_after = retry_after
+
+
+class ReadinessService:
+    """起動時のモデルロードとウォームアップをバックグラウンドで実行し、準備状態を管理する
+
+    プロセスの生存確認（liveness）はロード中でも応答できるようにし、推論リクエストの受付可否（readiness）は
+    ウォームアップ完了後にのみ ready とする。ready になるまでの推論リクエストには ModelNotReadyError を返す。
+    """
+
+    def __init__(
+        self,
+        warmup_enabled: Optional[bool] = None,
+        warmup_runs: Optional[int] = None,
+        retry_after: Optional[int] = None
+    ):
+        if warmup_enabled is None:
+            warmup_enabled = os.getenv("WARMUP_ENABLED", "true").lower() == "true"
+        self.warmup_runs = warmup_runs if warmup_runs is not None else int(os.getenv("WARMUP_RUNS", 1))
+        self.warmup_enabled = warmup_enabled and self.warmup_runs > 0
+        self.retry_after = retry_after or int(os.getenv("NOT_READY_RETRY_AFTER", 5))
+        self.state = STARTING
+        self.error: Optional[str] = None
+        self.timings: Dict[str, float] = {}
+        self._started_at = time.perf_counter()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def is_ready(self) -> bool:
+        return self.state == READY
+
+    def start(self, preload: bool = True):
+        """バックグラウンドでロードとウォームアップを開始（preload=False なら初回リクエスト時に遅延ロード）"""
+        self._started_at = time.perf_counter()
+        if not preload:
+            self.state = READY
+            return
+        self._task = asyncio.get_running_loop().create_task(self._load_and_warmup())
+
+    async def stop(self):
+        """未完了のロード・ウォームアップを中断する（ロード中のスレッドはレジストリのロックで完了を待つ）"""
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+
+    async def _load_and_warmup(self):
+        try:
+            self.state = LOADING
+            logger.info("バックグラウンドでモデルのロードを開始")
+            start = time.perf_counter()
+            # ロードはブロッキング処理のためイベントループ外で実行し、その間もlivenessに応答する
+            client = await asyncio.to_thread(get_model_registry().load)
+            self.timings["load_seconds"] = round(time.perf_counter() - start, 3)
+
+            if self.warmup_enabled:
+                self.state = WARMING_UP
+                start = time.perf_counter()
+                await self._warmup(client)
+                self.timings["warmup_seconds"] = round(time.perf_counter() - start, 3)
+
+            self.state = READY
+            self.timings["ready_seconds"] = round(time.perf_counter() - self._started_at, 3)
+            logger.info(f"推論リクエストの受付を開始 (起動から {self.timings['ready_seconds']:.2f}s)")
+
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.state = FAILED
+            self.error = str(e)
+            logger.error(f"モデルの準備に失敗: {str(e)}")
+
+    async def _warmup(self, client: ModelClient):
+        """代表的な生成を数回実行し、アロケーター・スレッドプール・プレフィックスキャッシュを温める
+
+        ウォームアップ中の生成エラーは記録するだけで、ready への移行は妨げない。
+        """
+        excuse_service = ExcuseService(model_client=client)
+        reply_service = ReplyService(model_client=client)
+        instruction, goal, content = WARMUP_REPLY
+        reply_request = ReplyRequest(
+            settings=ReplySettings(userId="warmup", channel="warmup", replyTo="田中さん"),
+            mission=ReplyMission(instruction=instruction, goal=goal),
+            message=ReplyMessage(content=content, timestamp=datetime.now(timezone.utc))
+        )
+
+        for run in range(self.warmup_runs):
+            start = time.perf_counter()
+            try:
+                await excuse_service.generate_excuse(WARMUP_QUESTION, use_cache=False)
+                await reply_service.generate_reply(reply_request, use_cache=False)
+                if excuse_service.semantic_cache is not None:
+                    await client.embed_text(WARMUP_QUESTION)
+            except Exception as e:
+                logger.warning(f"ウォームアップ中にエラーが発生: {str(e)}")
+            logger.info(f"ウォームアップ {run + 1}/{self.warmup_runs}: {time.perf_counter() - start:.2f}s")
+
+    def check_ready(self):
+        """ready でなければ ModelNotReadyError を送出"""
+        if not self.is_ready:
+            raise ModelNotReadyError(self.state, self.retry_after)
+
+    def get_status(self) -> Dict[str, Any]:
+        return {
+            "status": self.state,
+            "ready": self.is_ready,
+            "error": self.error,
+            "warmup_runs": self.warmup_runs if self.warmup_enabled else 0,
+            "uptime_seconds": round(time.perf_counter() - self._started_at, 3),
+            "timings": self.timings
+        }
+
+
+_readiness_service = ReadinessService()
+
+
+def get_readiness_service() -> ReadinessService:
+    return _readiness_service
@@ -1,49 +1,172 @@
 import os
 import torch
 from transformers import AutoTokenizer, AutoModelForCausalLM
-from typing import Dict, Any
+from typing import AsyncIterator, Dict, Any, List, Optional, Tuple
 import logging
 from datetime import datetime, timezone
 from client.llm.model_client import ModelClient
+from client.llm.inference_executor import QueueFullError
+from client.llm.fair_scheduler import QuotaExceededError, Tenant
+from client.llm.model_registry import get_model_registry
+from client.llm.generation_constraints import GenerationConstraints
+from client.llm.generation_deadline import GenerationDeadline
+from client.cache.response_cache import ResponseCache, get_response_cache, make_cache_key
+from client.cache.semantic_cache import SemanticCache, get_semantic_cache, make_namespace
+from client.cache.single_flight import SingleFlight, get_single_flight
+from client.metrics.generation_metrics import POSTPROCESS_SECONDS, record_error, record_fallback, track_in_flight
 from models.request_models import ReplyRequest
 
 logger = logging.getLogger(__name__)
 
 
 class ReplyService:
-    def __init__(self):
-        self.model_client = ModelClient()
+    # _format_reply は「。」区切りの先頭3文までしか使わず、【】は信頼度を下げるだけなので
+    # 3文目が終わった時点で生成を打ち切り、【】は生成させない（文字数は3文×60文字を上限とする）
+    GENERATION_CONSTRAINTS = GenerationConstraints(
+        max_sentences=3,
+        max_chars=180,
+        banned_strings=("【", "】")
+    )
+    # 生成テキストから返信を取り出せない場合に _format_reply が返す文言
+    EMPTY_REPLY = "ありがとうございます。検討させていただきます。"
+    
+    def __init__(
+        self,
+        model_client: Optional[ModelClient] = None,
+        response_cache: Optional[ResponseCache] = None,
+        semantic_cache: Optional[SemanticCache] = None,
+        single_flight: Optional[SingleFlight] = None
+    ):
+        # 明示的に渡されない場合は共有レジストリからモデルを取得する
+        self._owns_model_reference = model_client is None
+        self.model_client = model_client or get_model_registry().acquire()
+        self.response_cache = response_cache or get_response_cache()
+        self.semantic_cache = semantic_cache or get_semantic_cache()
+        self.single_flight = single_flight or get_single_flight()
         
+    def close(self):
+        """レジストリから取得したモデルの参照を返却"""
+        if self._owns_model_reference and self.model_client is not None:
+            get_model_registry().release(self.model_client)
+            self.model_client = None
+    
+    @track_in_flight("reply")
     async def generate_reply(
         self,
         request: ReplyRequest,
         max_length: int = 512,
         temperature: float = 0.7,
-        top_p: float = 0.9
+        top_p: float = 0.9,
+        use_cache: bool = True,
+        num_candidates: int = 1,
+        deadline: Optional[GenerationDeadline] = None
     ) -> Dict[str, Any]:
+        """返信を生成
+
+        num_candidatesが2以上の場合は1回のバッチデコードで候補を生成し、信頼度が最も高い候補を返す
+        （残りは信頼度順に alternatives として返す）。
+        deadlineの締め切りまでに生成が終わらなかった場合は途中までの返信を partial として返し、
+        返信を取り出せなければフォールバックの返信を返す。
+        use_cacheが有効な場合、同じ内容のリクエストを生成中であれば新たに生成せずその結果を共有する。
+        """
         try:
             logger.info("AIを使用して返信を生成開始")
             
-            # プロンプトを作成
-            prompt = self._create_reply_prompt(request)
+            # プロンプトを作成（固定プレフィックスはKVキャッシュを再利用する）
+            prefix, suffix = self._create_reply_prompt_parts(request)
+            prompt = prefix + suffix
             logger.info(f"生成したプロンプト: {prompt[:100]}...")
             
             # モデルクライアントを使ってテキスト生成
             # max_new_tokensを使用して適切な生成量を指定
             max_new_tokens = 80  # 返信として十分な長さ
+            
+            cache_params = {
+                "goal": request.mission.goal,
+                "max_new_tokens": max_new_tokens,
+                "temperature": 0.8,
+                "top_p": 0.9,
+                "num_candidates": num_candidates,
+                "prompt_lookup": bool(request.prompt_lookup),
+                "model": self.model_client.model_name
+            }
+            
+            # 同じ内容のリクエストはキャッシュ済みの返信を返す
+            cache_key = make_cache_key("reply", prompt, cache_params)
+            use_exact_cache = use_cache and self.response_cache is not None
+            if use_exact_cache:
+                cached = self.response_cache.get("reply", cache_key)
+                if cached is not None:
+                    logger.info(f"キャッシュ済みの返信を使用: {cached['reply'][:50]}...")
+                    return {**cached, "replyAt": datetime.now(timezone.utc), "cached": True}
+            
+            # 方針・返信先が同じで言い換えのメッセージは埋め込みの類似度で検索する
+            use_semantic_cache = (
+                use_cache
+                and self.semantic_cache is not None
+                and self.semantic_cache.supports(self.model_client.model_name)
+            )
+            if use_semantic_cache:
+                namespace = make_namespace("reply", {
+                    **cache_params,
+                    "instruction": request.mission.instruction,
+                    "replyTo": request.settings.replyTo
+                })
+                embedding = await self.model_client.embed_text(request.message.content)
+                match = self.semantic_cache.lookup("reply", namespace, embedding)
+                if match is not None:
+                    cached, similarity = match
+                    logger.info(f"類似メッセージのキャッシュを使用 (類似度: {similarity:.3f})")
+                    return {**cached, "replyAt": datetime.now(timezone.utc), "cached": True}
+            
             logger.info(f"プロンプト文字数: {len(prompt)}")
             logger.info(f"生成パラメータ: max_new_tokens={max_new_tokens}, temperature=0.8, top_p=0.9")
             
-            generation_result = await self.model_client.generate_text(
-                prompt=prompt,
-                max_new_tokens=max_new_tokens,
-                temperature=0.8,
-                top_p=0.9,
-                do_sample=True
-            )
+            tenant = self._tenant(request)
+            
+            def generate(generation_deadline: Optional[GenerationDeadline]):
+                return self.model_client.generate_text(
+                    prompt=prompt,
+                    max_new_tokens=max_new_tokens,
+                    temperature=0.8,
+                    top_p=0.9,
+                    do_sample=True,
+                    num_return_sequences=num_candidates,
+                    constraints=self.GENERATION_CONSTRAINTS,
+                    prefix=prefix,
+                    prompt_lookup=bool(request.prompt_lookup),
+                    endpoint="reply",
+                    deadline=generation_deadline,
+                    tenant=tenant
+                )
+            
+            # 同じ内容のリクエストを生成中であれば、その生成結果を共有する
+            # （共有したリクエストのテナントも合流前に予算を確認し、生成したトークン数を課金する）
+            if use_cache and self.single_flight is not None:
+                joined = []
+                
+                def join():
+                    self.model_client.check_quota(tenant)
+                    joined.append(True)
+                
+                generation_result = await self.single_flight.run("reply", cache_key, generate, deadline, on_join=join)
+                if joined and generation_result is not None:
+                    self.model_client.charge_shared_generation(tenant, generation_result)
+            else:
+                generation_result = await generate(deadline)
+            if generation_result is None:
+                logger.info(f"共有の生成の完了を待たずに打ち切られたため、フォールバックを使用 (理由: {deadline.reason})")
+                record_fallback("reply", self.model_client.model_name, deadline.reason)
+                return {
+                    "reply": self._get_fallback_reply(request),
+                    "replyAt": datetime.now(timezone.utc),
+                    "prompt_used": "fallback"
+                }
+            stopped = generation_result.get("stopped")
             
             if "error" in generation_result:
                 logger.warning(f"AI生成でエラー、フォールバックを使用: {generation_result['error']}")
+                record_fallback("reply", self.model_client.model_name, "generation_error")
                 fallback_reply = self._get_fallback_reply(request)
                 return {
                     "reply": fallback_reply,
@@ -52,17 +175,34 @@ class ReplyService:
                     "ai_error": generation_result["error"]
                 }
             
-            # 生成されたテキストをフォーマット
-            generated_text = generation_result["generated_text"]
-            formatted_reply = self._format_reply(generated_text)
+            # 生成された候補をフォーマットし、信頼度の高い順に並べる
+            generated_texts = generation_result.get("generated_texts", [generation_result["generated_text"]])
+            with POSTPROCESS_SECONDS.labels("reply", self.model_client.model_name).time():
+                candidates = [self._format_reply(text) for text in generated_texts]
+                if stopped:
+                    # 打ち切った生成は返信を取り出せた候補だけを使う
+                    kept = [i for i, candidate in enumerate(candidates) if candidate != self.EMPTY_REPLY]
+                    generated_texts = [generated_texts[i] for i in kept]
+                    candidates = [candidates[i] for i in kept]
+                confidences = self._calculate_confidences(candidates)
+            if not candidates:
+                logger.info(f"返信を生成できないまま打ち切られたため、フォールバックを使用 (理由: {stopped})")
+                record_fallback("reply", self.model_client.model_name, stopped)
+                return {
+                    "reply": self._get_fallback_reply(request),
+                    "replyAt": datetime.now(timezone.utc),
+                    "prompt_used": "fallback"
+                }
+            ranking = sorted(range(len(candidates)), key=lambda i: -confidences[i])
+            generated_text = generated_texts[ranking[0]]
+            formatted_reply = candidates[ranking[0]]
+            confidence_score = float(confidences[ranking[0]])
             
             # デバッグモードでのみ詳細ログを出力
             if os.getenv("DEBUG_MODE", "false").lower() == "true":
                 logger.info(f"生成されたrawテキスト: '{generated_text}'")
                 logger.info(f"フォーマット後の返信: '{formatted_reply}'")
             
-            confidence_score = self._calculate_confidence(formatted_reply)
-            
             reply_at = datetime.now(timezone.utc)
             
             logger.info(f"AI返信生成完了: {formatted_reply[:50]}...")
@@ -77,20 +217,41 @@ class ReplyService:
                 "confidence": confidence_score
             }
             
+            if len(candidates) > 1:
+                result["alternatives"] = [
+                    {"reply": candidates[i], "confidence": float(confidences[i])} for i in ranking[1:]
+                ]
+            
+            # 打ち切った途中までの返信はキャッシュしない
+            if stopped:
+                result["partial"] = True
+            else:
+                cached_value = {key: value for key, value in result.items() if key != "replyAt"}
+                if use_exact_cache:
+                    self.response_cache.set("reply", cache_key, cached_value)
+                if use_semantic_cache:
+                    self.semantic_cache.insert("reply", namespace, embedding, cached_value)
+            
             # デバッグ情報を追加（開発環境のみ）
             if debug_mode:
                 result.update({
                     "debug": {
                         "raw_generation": generated_text[:200],
                         "prompt": prompt[:100] + "...",
-                        "generation_config": generation_result.get("config", {})
+                        "generation_config": generation_result.get("config", {}),
+                        "speculation": generation_result.get("speculation")
                     }
                 })
             
             return result
             
+        except (QueueFullError, QuotaExceededError) as e:
+            record_error("reply", self.model_client.model_name, e)
+            raise
         except Exception as e:
             logger.error(f"自動返信生成中にエラー: {str(e)}")
+            record_error("reply", self.model_client.model_name, e)
+            record_fallback("reply", self.model_client.model_name, "exception")
             fallback_reply = self._get_fallback_reply(request)
             return {
                 "reply": fallback_reply,
@@ -99,7 +260,171 @@ class ReplyService:
                 "error": str(e)
             }
     
+    @track_in_flight("replies")
+    async def generate_replies(
+        self,
+        requests: List[ReplyRequest],
+        deadline: Optional[GenerationDeadline] = None
+    ) -> List[Dict[str, Any]]:
+        """複数のメッセージへの返信をまとめて生成（入力順に返す）
+
+        generate_reply と同じ生成パラメータでパディングしたバッチ生成を行い、失敗した要素だけフォールバックする。
+        deadlineはバッチ全体の締め切りで、打ち切られた要素は途中までの返信かフォールバックを返す。
+        """
+        max_new_tokens = 80
+        results: List[Optional[Dict[str, Any]]] = [None] * len(requests)
+        pending: List[int] = []
+        cache_keys: Dict[int, str] = {}
+        
+        for index, request in enumerate(requests):
+            if request.use_cache and self.response_cache is not None:
+                cache_keys[index] = make_cache_key("reply", self._create_reply_prompt(request), {
+                    "goal": request.mission.goal,
+                    "max_new_tokens": max_new_tokens,
+                    "temperature": 0.8,
+                    "top_p": 0.9,
+                    "num_candidates": 1,
+                    "prompt_lookup": False,
+                    "model": self.model_client.model_name
+                })
+                cached = self.response_cache.get("reply", cache_keys[index])
+                if cached is not None:
+                    results[index] = {**cached, "replyAt": datetime.now(timezone.utc), "cached": True}
+                    continue
+            pending.append(index)
+        
+        if pending:
+            logger.info(f"返信のバッチ生成開始: {len(pending)} 件 (キャッシュ済み {len(requests) - len(pending)} 件)")
+            try:
+                responses = await self.model_client.generate_batch(
+                    [self._create_reply_prompt(requests[i]) for i in pending],
+                    max_new_tokens=max_new_tokens,
+                    temperature=0.8,
+                    top_p=0.9,
+                    do_sample=True,
+                    constraints=self.GENERATION_CONSTRAINTS,
+                    endpoint="replies",
+                    deadline=deadline,
+                    tenants=[self._tenant(requests[i]) for i in pending]
+                )
+            except (QueueFullError, QuotaExceededError) as e:
+                record_error("replies", self.model_client.model_name, e)
+                raise
+            except Exception as e:
+                logger.error(f"返信のバッチ生成中にエラー: {str(e)}")
+                record_error("replies", self.model_client.model_name, e)
+                responses = [{"error": str(e)} for _ in pending]
+            
+            with POSTPROCESS_SECONDS.labels("replies", self.model_client.model_name).time():
+                replies = [self._format_reply(response.get("generated_text", "")) for response in responses]
+                confidences = self._calculate_confidences(replies)
+            for index, response, reply, confidence in zip(pending, responses, replies, confidences):
+                stopped = response.get("stopped")
+                if "error" in response or (stopped and reply == self.EMPTY_REPLY):
+                    record_fallback("replies", self.model_client.model_name, stopped or "generation_error")
+                    results[index] = {
+                        "reply": self._get_fallback_reply(requests[index]),
+                        "replyAt": datetime.now(timezone.utc),
+                        "prompt_used": "fallback",
+                        "fallback": True
+                    }
+                    continue
+                
+                cached_value = {
+                    "reply": reply,
+                    "prompt_used": "ai_generated",
+                    "confidence": float(confidence)
+                }
+                results[index] = {**cached_value, "replyAt": datetime.now(timezone.utc)}
+                if stopped:
+                    results[index]["partial"] = True
+                elif index in cache_keys:
+                    self.response_cache.set("reply", cache_keys[index], cached_value)
+        
+        return results
+    
+    @track_in_flight("reply_stream")
+    async def stream_reply(
+        self,
+        request: ReplyRequest,
+        deadline: Optional[GenerationDeadline] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """返信をトークン単位で順次返し、最後にフォーマット済みの返信を返す
+
+        deadlineの締め切りで打ち切られた場合、最後のイベントは途中までの返信（partial）かフォールバックになる。
+        """
+        logger.info("AIを使用して返信のストリーミング生成を開始")
+        
+        prefix, suffix = self._create_reply_prompt_parts(request)
+        prompt = prefix + suffix
+        deadline = deadline or GenerationDeadline()
+        generated_text = ""
+        partial = None
+        
+        try:
+            # generate_replyと同じ生成パラメータを使用
+            async for delta in self.model_client.stream_text(
+                prompt=prompt,
+                max_new_tokens=80,
+                temperature=0.8,
+                top_p=0.9,
+                do_sample=True,
+                constraints=self.GENERATION_CONSTRAINTS,
+                prefix=prefix,
+                endpoint="reply_stream",
+                deadline=deadline,
+                tenant=self._tenant(request)
+            ):
+                generated_text += delta
+                yield {"event": "token", "data": {"text": delta}}
+            
+            with POSTPROCESS_SECONDS.labels("reply_stream", self.model_client.model_name).time():
+                reply = self._format_reply(generated_text)
+                confidence = self._calculate_confidence(reply)
+            prompt_used = "ai_generated"
+            if deadline.interrupted:
+                if reply == self.EMPTY_REPLY:
+                    record_fallback("reply_stream", self.model_client.model_name, deadline.reason)
+                    reply = self._get_fallback_reply(request)
+                    confidence = self._calculate_confidence(reply)
+                    prompt_used = "fallback"
+                else:
+                    partial = True
+        except (QueueFullError, QuotaExceededError) as e:
+            record_error("reply_stream", self.model_client.model_name, e)
+            raise
+        except Exception as e:
+            logger.error(f"返信のストリーミング生成中にエラー: {str(e)}")
+            record_error("reply_stream", self.model_client.model_name, e)
+            record_fallback("reply_stream", self.model_client.model_name, "exception")
+            reply = self._get_fallback_reply(request)
+            confidence = self._calculate_confidence(reply)
+            prompt_used = "fallback"
+        
+        yield {
+            "event": "done",
+            "data": {
+                "reply": reply,
+                "confidence": confidence,
+                "replyAt": datetime.now(timezone.utc),
+                "prompt_used": prompt_used,
+                "partial": partial
+            }
+        }
+    
+    @staticmethod
+    def _tenant(request: ReplyRequest) -> Tenant:
+        return Tenant.of(request.settings.userId, request.settings.channel)
+    
     def _create_reply_prompt(self, request: ReplyRequest) -> str:
+        prefix, suffix = self._create_reply_prompt_parts(request)
+        return prefix + suffix
+    
+    def _create_reply_prompt_parts(self, request: ReplyRequest) -> Tuple[str, str]:
+        """プロンプトを (固定プレフィックス, リクエスト固有の部分) に分けて作成
+
+        指示文と例文は方針ごとに固定なので先頭に置き、KVキャッシュを再利用できるようにする。
+        """
         # 具体的な例を含むプロンプト
         instruction = request.mission.instruction
         message = request.message.content
@@ -114,11 +439,15 @@ class ReplyService:
         else:
             example = "ありがとうございます。検討いたします。"
         
-        return f"""「{message}」という{sender}からのメッセージに対して、{instruction}という方針で返信してください。
+        prefix = f"""以下のメッセージに対して、指定された方針で丁寧に返信してください。
 
 例: {example}
 
+"""
+        suffix = f"""「{message}」という{sender}からのメッセージに対して、{instruction}という方針で返信してください。
+
 返信:"""
+        return prefix, suffix
     
     def _format_reply(self, generated_text: str) -> str:
         # 生成されたテキストをクリーンアップ
@@ -155,7 +484,7 @@ class ReplyService:
             return reply
         
         # フォールバック
-        return "ありがとうございます。検討させていただきます。"
+        return self.EMPTY_REPLY
     
     def _calculate_confidence(self, reply_text: str) -> float:
         """返信テキストの信頼度を計算"""
@@ -183,6 +512,10 @@ class ReplyService:
         # 0.0-1.0の範囲に収める
         return max(0.0, min(1.0, confidence))
     
+    def _calculate_confidences(self, reply_texts: List[str]) -> List[float]:
+        """複数の返信候補の信頼度を計算（候補は高々8件なので1件ずつ計算する）"""
+        return [self._calculate_confidence(text) for text in reply_texts]
+    
     def _get_fallback_reply(self, request: ReplyRequest) -> str:
         instruction = request.mission.instruction.lower()
         goal = request.mission.goal.lower()
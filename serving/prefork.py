@@ -0,0 +1,190 @@
+import gc
+import os
+import time
+import errno
+import signal
+import socket
+from typing import Dict, Optional
+import logging
+import torch
+import uvicorn
+from client.cache.response_cache import get_response_cache
+from client.cache.semantic_cache import get_semantic_cache
+from client.llm.model_registry import get_model_registry
+from client.metrics.process_memory import format_memory_report, memory_report
+
+logger = logging.getLogger(__name__)
+
+
+class PreforkServer:
+    """モデルを親プロセスで一度だけロードし、forkしたワーカープロセスでAPIを提供するサーバー
+
+    ワーカーは親プロセスのモデルの重みをコピーオンライトで共有するため、推論中に重みを書き換えない限り
+    ワーカーを増やしてもモデル1つ分のメモリで済む。待ち受けソケットは親プロセスで作成して全ワーカーで共有し、
+    異常終了したワーカーは作り直す。各プロセスの共有・固有メモリは定期的に（SIGUSR1を送るとすぐに）ログに出力する。
+    """
+
+    def __init__(self, app, host: str, port: int, workers: int, log_level: str = "info"):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.log_level = log_level
+        # ワーカーごとのtorchのスレッド数（未指定ならCPUコアをワーカー数で分ける）
+        self.threads_per_worker = int(os.getenv("WORKER_TORCH_THREADS", 0)) or max(1, (os.cpu_count() or 1) // workers)
+        self.memory_report_interval = float(os.getenv("WORKER_MEMORY_REPORT_SECONDS", 300))
+        self.shutdown_timeout = float(os.getenv("WORKER_SHUTDOWN_TIMEOUT", 30))
+        self.multiproc_dir = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+        self._socket: Optional[socket.socket] = None
+        self._children: Dict[int, int] = {}
+        self._started_at: Dict[int, float] = {}
+        self._stopping = False
+        self._report_requested = False
+
+    def run(self):
+        self._prepare_multiproc_dir()
+        self._socket = self._bind()
+
+        # ワーカーで共有するモデルを親プロセスでロードする（推論はしない）
+        # スレッドやロックの状態をforkで引き継がないよう、連続バッチングエンジンはワーカーで起動する
+        client = get_model_registry().load(start_engine=False)
+        logger.info(f"親プロセスでモデルをロード: 重み {client.weights_nbytes() / 1024 / 1024:.1f}MB")
+        # ワーカーのGCが親プロセスのオブジェクトに触れてページがコピーされないよう、既存のオブジェクトをGC対象外にする
+        gc.collect()
+        gc.freeze()
+
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGINT, self._handle_stop)
+        signal.signal(signal.SIGUSR1, self._handle_report)
+
+        for index in range(self.workers):
+            self._spawn(index)
+        logger.info(f"{self.workers} ワーカーを起動 (http://{self.host}:{self.port}, torchスレッド数: {self.threads_per_worker})")
+
+        try:
+            self._supervise()
+        finally:
+            self._stop_workers()
+            self._socket.close()
+            get_model_registry().shutdown()
+
+    def _bind(self) -> socket.socket:
+        family = socket.AF_INET6 if ":" in self.host else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, self.port))
+        sock.listen(2048)
+        sock.set_inheritable(True)
+        return sock
+
+    def _prepare_multiproc_dir(self):
+        """前回の起動で残ったPrometheusのマルチプロセス用ファイルを削除する"""
+        if not self.multiproc_dir:
+            return
+        os.makedirs(self.multiproc_dir, exist_ok=True)
+        for name in os.listdir(self.multiproc_dir):
+            if name.endswith(".db"):
+                os.remove(os.path.join(self.multiproc_dir, name))
+
+    def _spawn(self, index: int):
+        pid = os.fork()
+        if pid == 0:
+            self._run_worker(index)
+            os._exit(0)
+        self._children[pid] = index
+        self._started_at[pid] = time.monotonic()
+
+    def _run_worker(self, index: int):
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGUSR1):
+            signal.signal(signum, signal.SIG_DFL)
+        try:
+            torch.set_num_threads(self.threads_per_worker)
+            get_model_registry().reset_after_fork()
+            response_cache = get_response_cache()
+            if response_cache is not None:
+                response_cache.reset_after_fork()
+            semantic_cache = get_semantic_cache()
+            if semantic_cache is not None:
+                semantic_cache.assign_worker(index)
+            logger.info(f"ワーカー{index}を開始 (pid: {os.getpid()})")
+            config = uvicorn.Config(self.app, host=self.host, port=self.port, log_level=self.log_level)
+            uvicorn.Server(config).run(sockets=[self._socket])
+        except Exception as e:
+            logger.error(f"ワーカー{index}でエラー: {str(e)}")
+            os._exit(1)
+
+    def _supervise(self):
+        next_report = time.monotonic() + self.memory_report_interval
+        while not self._stopping:
+            self._reap(respawn=True)
+            if self._report_requested or (self.memory_report_interval > 0 and time.monotonic() >= next_report):
+                self._report_requested = False
+                self.log_memory_report()
+                next_report = time.monotonic() + self.memory_report_interval
+            time.sleep(0.5)
+
+    def _reap(self, respawn: bool):
+        while self._children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+
+            index = self._children.pop(pid, None)
+            started_at = self._started_at.pop(pid, time.monotonic())
+            self._mark_process_dead(pid)
+            if index is None or not respawn or self._stopping:
+                continue
+            logger.warning(f"ワーカー{index} (pid: {pid}) が終了しました (status: {status})。再起動します")
+            # 起動直後に落ち続ける場合に再起動を繰り返し過ぎないようにする
+            if time.monotonic() - started_at < 5:
+                time.sleep(1)
+            self._spawn(index)
+
+    def _mark_process_dead(self, pid: int):
+        if self.multiproc_dir:
+            from prometheus_client import multiprocess
+            multiprocess.mark_process_dead(pid)
+
+    def _stop_workers(self):
+        for pid in list(self._children):
+            self._kill(pid, signal.SIGTERM)
+
+        deadline = time.monotonic() + self.shutdown_timeout
+        while self._children and time.monotonic() < deadline:
+            self._reap(respawn=False)
+            time.sleep(0.1)
+
+        for pid in list(self._children):
+            logger.warning(f"ワーカー (pid: {pid}) が終了しないため強制終了します")
+            self._kill(pid, signal.SIGKILL)
+        while self._children:
+            pid, _ = os.waitpid(next(iter(self._children)), 0)
+            self._children.pop(pid, None)
+            self._mark_process_dead(pid)
+        logger.info("全ワーカーを終了しました")
+
+    @staticmethod
+    def _kill(pid: int, signum: int):
+        try:
+            os.kill(pid, signum)
+        except OSError as e:
+            if e.errno != errno.ESRCH:
+                raise
+
+    def _handle_stop(self, signum, frame):
+        self._stopping = True
+
+    def _handle_report(self, signum, frame):
+        self._report_requested = True
+
+    def log_memory_report(self):
+        """親プロセスと各ワーカーの共有・固有メモリをログに出力する"""
+        labels = {os.getpid(): "親プロセス"}
+        labels.update({pid: f"ワーカー{index}" for pid, index in self._children.items()})
+        report = memory_report(labels.keys())
+        logger.info("プロセスごとのメモリ使用量\n" + format_memory_report(report, labels))
+        return report
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+推論バックエンドの出力一致テストスクリプト
+
+PyTorchバックエンドとONNX Runtimeバックエンドで同じプロンプトを貪欲法で生成し、
+生成トークン列が model.generate() の結果と一致することを確認する。
+"""
+import sys
+import os
+import logging
+
+import torch
+
+# プロジェクトのルートディレクトリを追加
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from client.llm.inference_backend import create_backend
+from client.llm.model_client import resolve_torch_dtype
+from config.llm.prompt_templates import build_excuse_prompt
+
+# ログ設定
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MAX_NEW_TOKENS = 32
+
+PROMPTS = [
+    "以下のメッセージに、やんわりと断る返信を書いてください。\nメッセージ: 明日の飲み会に参加しませんか？\n返信:",
+    build_excuse_prompt("なぜ遅刻したのですか？"),
+    "こんにちは。今日の予定は"
+]
+
+
+def load_backend(name: str):
+    model_name = os.getenv("MODEL_NAME", "microsoft/DialoGPT-medium")
+    model_path = os.getenv("MODEL_PATH", "./data/models")
+    backend = create_backend(name, model_name, model_path, "cpu", resolve_torch_dtype("cpu", precision="fp32"), "fp32")
+    backend.load()
+    return backend
+
+
+def test_greedy_parity():
+    """貪欲法の生成結果がバックエンド間で一致するか"""
+    logger.info("=== バックエンド出力一致テスト開始 ===")
+
+    torch_backend = load_backend("torch")
+    onnx_backend = load_backend("onnx")
+
+    mismatches = 0
+    for prompt in PROMPTS:
+        input_ids = torch_backend.tokenizer.encode(prompt, add_special_tokens=False)
+
+        # 基準: transformers の model.generate()（EOS以降は除く）
+        with torch.inference_mode():
+            output = torch_backend.model.generate(
+                torch.tensor([input_ids]),
+                max_new_tokens=MAX_NEW_TOKENS,
+                do_sample=False,
+                pad_token_id=torch_backend.tokenizer.pad_token_id,
+                eos_token_id=torch_backend.tokenizer.eos_token_id
+            )[0, len(input_ids):].tolist()
+        if torch_backend.tokenizer.eos_token_id in output:
+            output = output[:output.index(torch_backend.tokenizer.eos_token_id)]
+
+        torch_ids = torch_backend.generate(input_ids, MAX_NEW_TOKENS, do_sample=False)[0]
+        onnx_ids = onnx_backend.generate(input_ids, MAX_NEW_TOKENS, do_sample=False)[0]
+
+        matched = output == torch_ids == onnx_ids
+        mismatches += not matched
+        logger.info(f"プロンプト: {prompt[-30:]!r} ({len(input_ids)} トークン) -> {'一致' if matched else '不一致'}")
+        logger.info(f"生成テキスト: {onnx_backend.tokenizer.decode(onnx_ids, skip_special_tokens=True)!r}")
+        if not matched:
+            logger.error(f"generate: {output}")
+            logger.error(f"torch:    {torch_ids}")
+            logger.error(f"onnx:     {onnx_ids}")
+
+    # 埋め込みベクトルの差
+    token_ids = torch_backend.tokenizer.encode("明日の飲み会に参加しませんか？", add_special_tokens=False)
+    embedding_diff = float(abs(torch_backend.embed(token_ids) - onnx_backend.embed(token_ids)).max())
+    logger.info(f"埋め込みの最大誤差: {embedding_diff:.2e}")
+
+    assert mismatches == 0, f"{mismatches} 件のプロンプトで生成結果が一致しませんでした"
+    assert embedding_diff < 1e-3
+
+
+if __name__ == "__main__":
+    print("ShachikuAI 推論バックエンド出力一致テスト")
+    print("=" * 50)
+
+    test_greedy_parity()
+
+    print("\nテスト完了")
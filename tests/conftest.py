@@ -0,0 +1,49 @@
+"""
+テスト共通の設定
+
+実モデルの代わりにベンチマーク用のスタブモデル（benchmarks/micro/stub_model.py）を使い、ネットワークなしで実行する。
+"""
+import os
+import sys
+import time
+
+# スタブモデルはローカルのファイルだけでロードする（transformersのインポート前に設定する）
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+# 連続バッチングエンジンとプレフィックスキャッシュは .env の設定によらず有効にしてテストする
+os.environ["INFERENCE_BATCHING"] = "true"
+os.environ["INFERENCE_MAX_BATCH_SIZE"] = "4"
+os.environ["PREFIX_CACHE_ENABLED"] = "true"
+
+# プロジェクトのルートディレクトリを追加
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from benchmarks.micro.stub_model import use_stub_model
+
+use_stub_model()
+
+
+@pytest.fixture(scope="session")
+def stub_client():
+    """スタブモデルをロードした ModelClient（テスト全体で共有する）"""
+    from client.llm.model_client import ModelClient
+
+    client = ModelClient()
+    yield client
+    client.unload()
+
+
+@pytest.fixture(scope="session")
+def api_client():
+    """モデルのロードとウォームアップが完了したAPIのテストクライアント"""
+    from fastapi.testclient import TestClient
+    from main import app
+
+    with TestClient(app) as client:
+        deadline = time.monotonic() + 120
+        while client.get("/ready").status_code != 200:
+            assert time.monotonic() < deadline, "モデルの準備が完了しませんでした"
+            time.sleep(0.1)
+        yield client
@@ -0,0 +1,44 @@
+"""
+生成処理の例外からHTTPエラーへの変換のテスト
+"""
+import pytest
+from fastapi import HTTPException
+
+from api.v1.errors import generation_errors
+from client.llm.fair_scheduler import QuotaExceededError, Tenant
+from client.llm.inference_executor import QueueFullError
+
+
+def raise_in_generation(error):
+    with pytest.raises(HTTPException) as excinfo:
+        with generation_errors("言い訳の生成"):
+            raise error
+    return excinfo.value
+
+
+def test_quota_exceeded_is_429_with_rate_limit_headers():
+    error = QuotaExceededError("user", Tenant.of("u1", "c"), limit=600, remaining=0, retry_after=3, reset_after=60)
+    http_error = raise_in_generation(error)
+
+    assert http_error.status_code == 429
+    assert http_error.headers == error.headers
+
+
+def test_queue_full_is_503_with_retry_after():
+    http_error = raise_in_generation(QueueFullError(in_flight=4, capacity=4, retry_after=2))
+
+    assert http_error.status_code == 503
+    assert http_error.headers == {"Retry-After": "2"}
+
+
+def test_other_errors_are_500_with_action_in_detail():
+    http_error = raise_in_generation(RuntimeError("boom"))
+
+    assert http_error.status_code == 500
+    assert http_error.detail == "言い訳の生成に失敗しました: boom"
+
+
+def test_no_error_passes_through():
+    with generation_errors("言い訳の生成"):
+        result = "ok"
+    assert result == "ok"
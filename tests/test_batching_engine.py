@@ -0,0 +1,176 @@
+"""
+連続バッチングエンジンのテスト（受け入れ・失敗・キャンセル・締め切り・貪欲法の出力一致）
+"""
+import asyncio
+
+import pytest
+import torch
+
+from client.llm.batching_engine import ContinuousBatchingEngine
+from client.llm.generation_deadline import DISCONNECTED, GenerationDeadline
+
+MAX_NEW_TOKENS = 12
+
+PROMPTS = [
+    "以下のメッセージに対して、指定された方針で丁寧に返信してください。",
+    "ありがとうございます。",
+    "申し訳ございませんが、今回は参加が難しいです。お疲れ様です。",
+]
+
+
+@pytest.fixture
+def engine(stub_client):
+    engine = ContinuousBatchingEngine(stub_client.model, stub_client.tokenizer, max_batch_size=4)
+    engine.start()
+    yield engine
+    engine.stop()
+
+
+def encode(stub_client, prompt):
+    return stub_client.tokenizer.encode(prompt, add_special_tokens=False)
+
+
+@torch.inference_mode()
+def greedy_reference(stub_client, input_ids, max_new_tokens=MAX_NEW_TOKENS):
+    """model.generate() の貪欲法の出力（EOSは含めない）"""
+    output = stub_client.model.generate(
+        torch.tensor([input_ids]),
+        attention_mask=torch.ones((1, len(input_ids)), dtype=torch.long),
+        max_new_tokens=max_new_tokens,
+        do_sample=False,
+        pad_token_id=stub_client.tokenizer.pad_token_id,
+        eos_token_id=stub_client.tokenizer.eos_token_id
+    )
+    generated = output[0, len(input_ids):].tolist()
+    if stub_client.tokenizer.eos_token_id in generated:
+        generated = generated[:generated.index(stub_client.tokenizer.eos_token_id)]
+    return stub_client.tokenizer.decode(generated, skip_special_tokens=True)
+
+
+@pytest.mark.asyncio
+async def test_greedy_output_matches_model_generate(stub_client, engine):
+    """1件ずつ生成した結果が model.generate() と一致する"""
+    for prompt in PROMPTS:
+        input_ids = encode(stub_client, prompt)
+        result = await engine.generate(input_ids, max_new_tokens=MAX_NEW_TOKENS, do_sample=False)
+        assert result["generated_text"] == greedy_reference(stub_client, input_ids)
+
+
+@pytest.mark.asyncio
+async def test_concurrent_requests_share_a_batch(stub_client, engine):
+    """同時に投入したリクエストは1つのバッチで生成され、結果は1件ずつの生成と一致する"""
+    id_lists = [encode(stub_client, prompt) for prompt in PROMPTS]
+    results = await asyncio.gather(*[
+        engine.generate(input_ids, max_new_tokens=MAX_NEW_TOKENS, do_sample=False)
+        for input_ids in id_lists
+    ])
+
+    assert [r["generated_text"] for r in results] == [greedy_reference(stub_client, ids) for ids in id_lists]
+    assert engine.stats["max_batch_size_seen"] > 1
+    assert engine.stats["completed"] == len(PROMPTS)
+
+
+@pytest.mark.asyncio
+async def test_prefill_failure_fails_admitted_requests(stub_client, engine, monkeypatch):
+    """prefillで失敗した場合は受け入れ中のリクエストに例外を伝え、次のリクエストは生成できる"""
+    original = engine._prefill_batch
+    calls = []
+
+    def failing_prefill(sequences):
+        calls.append(len(sequences))
+        if len(calls) == 1:
+            raise RuntimeError("prefill failed")
+        return original(sequences)
+
+    monkeypatch.setattr(engine, "_prefill_batch", failing_prefill)
+    input_ids = encode(stub_client, PROMPTS[0])
+
+    with pytest.raises(RuntimeError, match="prefill failed"):
+        await asyncio.wait_for(engine.generate(input_ids, max_new_tokens=4, do_sample=False), timeout=30)
+
+    result = await asyncio.wait_for(engine.generate(input_ids, max_new_tokens=4, do_sample=False), timeout=30)
+    assert result["generated_text"] == greedy_reference(stub_client, input_ids, max_new_tokens=4)
+
+
+@pytest.mark.asyncio
+async def test_cancelled_request_leaves_the_batch(stub_client, engine):
+    """キャンセルされたリクエストはバッチから外れ、同じバッチの他のリクエストは生成を続ける"""
+    input_ids = encode(stub_client, PROMPTS[0])
+    started = asyncio.Event()
+    loop = asyncio.get_running_loop()
+
+    cancelled = asyncio.ensure_future(engine.generate(
+        input_ids,
+        max_new_tokens=200,
+        do_sample=False,
+        on_token=lambda _: loop.call_soon_threadsafe(started.set)
+    ))
+    other = asyncio.ensure_future(engine.generate(input_ids, max_new_tokens=MAX_NEW_TOKENS, do_sample=False))
+    await asyncio.wait_for(started.wait(), timeout=30)
+    cancelled.cancel()
+
+    result = await asyncio.wait_for(other, timeout=30)
+    assert result["generated_text"] == greedy_reference(stub_client, input_ids)
+    with pytest.raises(asyncio.CancelledError):
+        await cancelled
+    # キャンセルしたリクエストも次のステップで完了扱いになり、バッチは空になる
+    for _ in range(100):
+        if not engine._active:
+            break
+        await asyncio.sleep(0.05)
+    assert not engine._active
+
+
+@pytest.mark.asyncio
+async def test_deadline_stops_generation_with_partial_output(stub_client, engine):
+    """打ち切られた時点までの出力で完了し、finish_reason に理由が入る"""
+    deadline = GenerationDeadline()
+    generated = []
+
+    def on_token(token_id):
+        generated.append(token_id)
+        if len(generated) == 3:
+            deadline.cancel(DISCONNECTED)
+
+    result = await engine.generate(
+        encode(stub_client, PROMPTS[0]),
+        max_new_tokens=200,
+        do_sample=False,
+        on_token=on_token,
+        deadline=deadline
+    )
+
+    assert result["finish_reason"] == DISCONNECTED
+    assert result["generated_tokens"] == 3
+    assert deadline.interrupted
+
+
+@pytest.mark.asyncio
+async def test_expired_deadline_skips_prefill(stub_client, engine):
+    """受け入れ前に締め切りを過ぎたリクエストはprefillせずに完了する"""
+    deadline = GenerationDeadline(timeout=1e-6)
+    await asyncio.sleep(0.01)
+
+    result = await engine.generate(encode(stub_client, PROMPTS[0]), max_new_tokens=8, deadline=deadline)
+
+    assert result == {"generated_text": "", "generated_tokens": 0, "finish_reason": "deadline"}
+    assert engine.stats["admitted"] == 0
+
+
+@pytest.mark.asyncio
+async def test_prompt_longer_than_context_is_rejected(engine):
+    with pytest.raises(ValueError):
+        await engine.generate([0] * engine.max_positions, max_new_tokens=8)
+
+
+def test_engine_is_started_only_after_fork():
+    """start_engine=False でロードしたモデルはエンジンのスレッドを作らず、reset_after_fork() で起動する"""
+    from client.llm.model_client import ModelClient
+
+    client = ModelClient(start_engine=False)
+    try:
+        assert client.engine is None
+        client.reset_after_fork()
+        assert client.engine is not None and client.engine._running
+    finally:
+        client.unload()
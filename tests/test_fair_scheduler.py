@@ -0,0 +1,201 @@
+"""
+公平スケジューラーとトークン予算のテスト（チャンネル間の順序・重み・予算・待機数の上限・締め切り）
+"""
+import asyncio
+
+import pytest
+
+from client.llm.fair_scheduler import FairScheduler, QuotaExceededError, Tenant, TokenQuotas, parse_weights
+from client.llm.generation_deadline import GenerationDeadline
+from client.llm.inference_executor import InferenceExecutor, QueueFullError
+
+
+def make_scheduler(quotas=None, weights=None, max_queue_depth=16):
+    executor = InferenceExecutor(max_workers=1, max_queue_depth=max_queue_depth)
+    return FairScheduler(executor, quotas or TokenQuotas(), weights, poll_interval=0.01)
+
+
+async def run_in_order(scheduler, requests):
+    """実行枠を1つ占有した状態で requests（(名前, テナント, 見積もり)）を待たせ、解放後に実行された順を返す"""
+    order = []
+    release = asyncio.Event()
+
+    async def hold():
+        async with scheduler.slot({Tenant.of("holder", "holder"): 1}):
+            await release.wait()
+
+    async def request(name, tenant, tokens):
+        async with scheduler.slot({tenant: tokens}):
+            order.append(name)
+
+    holder = asyncio.ensure_future(hold())
+    await asyncio.sleep(0)
+    tasks = []
+    for name, tenant, tokens in requests:
+        tasks.append(asyncio.ensure_future(request(name, tenant, tokens)))
+        await asyncio.sleep(0)
+    assert scheduler.get_stats()["queued"] == len(requests)
+
+    release.set()
+    await asyncio.gather(holder, *tasks)
+    return order
+
+
+@pytest.mark.asyncio
+async def test_busy_channel_does_not_starve_others():
+    """大量に送ったチャンネルの後から来た別のチャンネルのリクエストが先に実行される"""
+    scheduler = make_scheduler()
+    busy, quiet = Tenant.of("u1", "busy"), Tenant.of("u2", "quiet")
+
+    order = await run_in_order(scheduler, [
+        ("busy-1", busy, 100),
+        ("busy-2", busy, 100),
+        ("busy-3", busy, 100),
+        ("quiet-1", quiet, 100),
+    ])
+
+    assert order == ["busy-1", "quiet-1", "busy-2", "busy-3"]
+
+
+@pytest.mark.asyncio
+async def test_weights_give_heavier_channel_more_turns():
+    scheduler = make_scheduler(weights=parse_weights("heavy=3, light=1"))
+    heavy, light = Tenant.of("u1", "heavy"), Tenant.of("u2", "light")
+
+    order = await run_in_order(scheduler, [
+        ("light-1", light, 100),
+        ("light-2", light, 100),
+        ("heavy-1", heavy, 100),
+        ("heavy-2", heavy, 100),
+        ("heavy-3", heavy, 100),
+    ])
+
+    assert order == ["light-1", "heavy-1", "heavy-2", "heavy-3", "light-2"]
+
+
+@pytest.mark.asyncio
+async def test_queue_full_raises():
+    scheduler = make_scheduler(max_queue_depth=1)
+    release = asyncio.Event()
+
+    async def hold(user):
+        async with scheduler.slot({Tenant.of(user, "c"): 1}):
+            await release.wait()
+
+    tasks = [asyncio.ensure_future(hold("u1")), asyncio.ensure_future(hold("u2"))]
+    await asyncio.sleep(0)
+
+    with pytest.raises(QueueFullError):
+        async with scheduler.slot({Tenant.of("u3", "c"): 1}):
+            pass
+
+    release.set()
+    await asyncio.gather(*tasks)
+
+
+@pytest.mark.asyncio
+async def test_deadline_while_queued_runs_without_a_slot():
+    """待っている間に締め切りを過ぎたリクエストは枠を待たずに実行し、枠の数は変わらない"""
+    scheduler = make_scheduler()
+    release = asyncio.Event()
+
+    async def hold():
+        async with scheduler.slot({Tenant.of("u1", "c"): 1}):
+            await release.wait()
+
+    holder = asyncio.ensure_future(hold())
+    await asyncio.sleep(0)
+
+    async with scheduler.slot({Tenant.of("u2", "c"): 1}, GenerationDeadline(timeout=0.05)):
+        assert scheduler.get_stats()["active"] == 1
+        assert scheduler.get_stats()["queued"] == 0
+
+    release.set()
+    await holder
+    assert scheduler.get_stats()["active"] == 0
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_is_removed_from_queue():
+    scheduler = make_scheduler()
+    release = asyncio.Event()
+
+    async def hold():
+        async with scheduler.slot({Tenant.of("u1", "c"): 1}):
+            await release.wait()
+
+    async def wait_for_slot():
+        async with scheduler.slot({Tenant.of("u2", "c"): 1}):
+            pass
+
+    holder = asyncio.ensure_future(hold())
+    await asyncio.sleep(0)
+    waiter = asyncio.ensure_future(wait_for_slot())
+    await asyncio.sleep(0)
+    assert scheduler.get_stats()["queued"] == 1
+
+    waiter.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+    assert scheduler.get_stats()["queued"] == 0
+
+    release.set()
+    await holder
+    assert scheduler.get_stats()["active"] == 0
+
+
+@pytest.mark.asyncio
+async def test_quota_exceeded_after_budget_is_used():
+    quotas = TokenQuotas(user_tokens_per_minute=600)
+    scheduler = make_scheduler(quotas)
+    tenant = Tenant.of("u1", "c")
+
+    # 予算が残っていれば見積もりを超えて受け付け、超えた分は以降の補充で返済する
+    async with scheduler.slot({tenant: 600}) as ticket:
+        ticket.charge(tenant, 700)
+
+    with pytest.raises(QuotaExceededError) as excinfo:
+        async with scheduler.slot({tenant: 10}):
+            pass
+    assert excinfo.value.scope == "user"
+    assert excinfo.value.headers["X-RateLimit-Limit-Tokens"] == "600"
+    assert int(excinfo.value.headers["Retry-After"]) >= 1
+
+    # 他のユーザーの予算は別
+    async with scheduler.slot({Tenant.of("u2", "c"): 10}):
+        pass
+
+
+@pytest.mark.asyncio
+async def test_unused_estimate_is_refunded():
+    """見積もりのうち実際に使わなかった分は予算に戻る"""
+    quotas = TokenQuotas(channel_tokens_per_minute=1000)
+    scheduler = make_scheduler(quotas)
+    tenant = Tenant.of("u1", "c")
+
+    async with scheduler.slot({tenant: 900}) as ticket:
+        assert quotas._buckets[("channel", "c")].tokens == pytest.approx(100, abs=1)
+        ticket.charge(tenant, 50)
+
+    assert quotas._buckets[("channel", "c")].tokens == pytest.approx(950, abs=1)
+
+
+def test_charge_without_slot_counts_against_quota():
+    quotas = TokenQuotas(user_tokens_per_minute=600)
+    scheduler = make_scheduler(quotas)
+    tenant = Tenant.of("u1", "c")
+
+    scheduler.charge(tenant, 700)
+    with pytest.raises(QuotaExceededError):
+        scheduler.check(tenant)
+
+
+def test_quota_buckets_are_bounded_by_lru_eviction():
+    quotas = TokenQuotas(user_tokens_per_minute=600, max_buckets=2)
+    quotas.consume(Tenant.of("u1", "c"), 100)
+    quotas.consume(Tenant.of("u2", "c"), 100)
+    quotas.check(Tenant.of("u1", "c"))
+    quotas.consume(Tenant.of("u3", "c"), 100)
+
+    assert list(quotas._buckets) == [("user", "u1"), ("user", "u3")]
+    assert quotas.get_stats()["tracked"] == 2
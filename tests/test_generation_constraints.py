@@ -0,0 +1,81 @@
+"""
+生成制約のテスト（停止条件の判定・禁止文字列の抑制と、デコードループでの早期停止）
+"""
+import pytest
+import torch
+
+from client.llm.generation_constraints import GenerationConstraints, banned_token_ids
+
+PROMPT = "なぜ遅刻したのですか"
+
+
+def test_max_sentences_counts_delimiters():
+    constraints = GenerationConstraints(max_sentences=2)
+    assert not constraints.is_complete("電車が遅れました。")
+    assert constraints.is_complete("電車が遅れました。申し訳ありません。")
+
+
+def test_max_chars_ignores_surrounding_whitespace():
+    constraints = GenerationConstraints(max_chars=5)
+    assert not constraints.is_complete("\n\n電車が\n")
+    assert constraints.is_complete("電車が遅れ")
+
+
+def test_line_end_waits_for_a_complete_non_ignored_line():
+    constraints = GenerationConstraints(stop_at_line_end=True, ignored_line_prefixes=("質問:",))
+    # 書きかけの行・空行・無視する接頭辞の行では停止しない
+    assert not constraints.is_complete("電車が遅れました")
+    assert not constraints.is_complete("\n\n質問: なぜですか\n")
+    assert constraints.is_complete("\n電車が遅れました\n")
+
+
+def test_stopping_criteria_waits_for_every_sequence(stub_client):
+    tokenizer = stub_client.tokenizer
+    constraints = GenerationConstraints(max_sentences=1)
+    prompt = tokenizer.encode("質問", add_special_tokens=False)
+    done, running = tokenizer.encode("遅れました。", add_special_tokens=False), tokenizer.encode("遅れ", add_special_tokens=False)
+    criteria = constraints.stopping_criteria(tokenizer, len(prompt))
+
+    def batch(*sequences):
+        width = max(map(len, sequences))
+        return torch.tensor([prompt + ids + [tokenizer.pad_token_id] * (width - len(ids)) for ids in sequences])
+
+    assert not criteria(batch(done, running), None)
+    assert criteria(batch(done, done), None)
+
+
+def test_banned_token_ids_match_pieces_containing_string(stub_client):
+    tokenizer = stub_client.tokenizer
+    banned = banned_token_ids(tokenizer, ("刻",))
+
+    assert banned
+    assert all("刻" in tokenizer.decode([token_id]) for token_id in banned)
+    assert banned_token_ids(tokenizer, ()) == []
+
+
+def test_backend_stops_early_and_avoids_banned_strings(stub_client):
+    input_ids = stub_client.tokenizer.encode(PROMPT)
+    unconstrained = stub_client.tokenizer.decode(stub_client.backend.generate(input_ids, 32, do_sample=False)[0])
+    assert "刻" in unconstrained
+
+    constraints = GenerationConstraints(max_chars=8, banned_strings=("刻",))
+    generated = stub_client.backend.generate(input_ids, 32, do_sample=False, constraints=constraints)[0]
+    text = stub_client.tokenizer.decode(generated, skip_special_tokens=True)
+
+    assert "刻" not in text
+    assert len(generated) < 32
+    assert constraints.is_complete(text)
+    # 停止条件を満たした時点で止まり、それ以上生成しない
+    assert not constraints.is_complete(stub_client.tokenizer.decode(generated[:-1], skip_special_tokens=True))
+
+
+@pytest.mark.asyncio
+async def test_batching_engine_applies_the_same_constraints(stub_client):
+    input_ids = stub_client.tokenizer.encode(PROMPT)
+    constraints = GenerationConstraints(max_chars=8, banned_strings=("刻",))
+
+    result = await stub_client.engine.generate(input_ids, max_new_tokens=32, do_sample=False, constraints=constraints)
+    expected = stub_client.backend.generate(input_ids, 32, do_sample=False, constraints=constraints)[0]
+
+    assert result["generated_tokens"] == len(expected)
+    assert result["generated_text"] == stub_client.tokenizer.decode(expected, skip_special_tokens=True)
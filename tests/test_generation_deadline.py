@@ -0,0 +1,108 @@
+"""
+生成の締め切りと打ち切りのテスト
+"""
+import asyncio
+import time
+
+import pytest
+import torch
+
+from client.llm.generation_deadline import CANCELLED, DEADLINE, DISCONNECTED, GenerationDeadline
+
+
+def test_no_timeout_never_expires():
+    deadline = GenerationDeadline()
+    assert deadline.remaining() is None
+    assert not deadline.expired()
+    assert not deadline.should_stop()
+
+
+def test_expired_deadline_stops_with_deadline_reason():
+    deadline = GenerationDeadline(timeout=0.01)
+    assert not deadline.should_stop()
+    time.sleep(0.02)
+
+    assert deadline.should_stop()
+    assert deadline.reason == DEADLINE
+    assert deadline.interrupted
+    assert deadline.remaining() == 0.0
+
+
+def test_first_cancel_reason_is_kept():
+    deadline = GenerationDeadline(timeout=60)
+    deadline.cancel(DISCONNECTED)
+    deadline.cancel(CANCELLED)
+
+    assert deadline.should_stop()
+    assert deadline.reason == DISCONNECTED
+
+
+def test_interrupted_only_when_decode_loop_observes_stop():
+    """生成完了後に打ち切っても、デコードループが確認するまでは interrupted にならない"""
+    deadline = GenerationDeadline()
+    deadline.cancel()
+    assert not deadline.interrupted
+    assert deadline.should_stop()
+    assert deadline.interrupted
+
+
+def test_limit_only_moves_deadline_earlier():
+    deadline = GenerationDeadline(timeout=10)
+    deadline.limit(60)
+    assert deadline.remaining() <= 10
+
+    deadline.limit(1)
+    assert deadline.remaining() <= 1
+
+    deadline.limit(None)
+    assert deadline.remaining() is not None
+
+
+def test_extend_to_latest_deadline():
+    shared = GenerationDeadline(timeout=1)
+    shared.extend(GenerationDeadline(timeout=10))
+    assert shared.remaining() > 1
+
+    shared.extend(GenerationDeadline(timeout=5))
+    assert shared.remaining() > 5
+
+    shared.extend(GenerationDeadline())
+    assert shared.expires_at is None
+
+
+def test_stopping_criteria_follows_deadline():
+    deadline = GenerationDeadline()
+    criteria = deadline.stopping_criteria()
+    input_ids, scores = torch.zeros((1, 1), dtype=torch.long), torch.zeros((1, 8))
+
+    assert not criteria(input_ids, scores)
+    deadline.cancel(DISCONNECTED)
+    assert criteria(input_ids, scores)
+
+
+@pytest.mark.asyncio
+async def test_watch_disconnect_cancels_on_disconnect():
+    deadline = GenerationDeadline()
+    checks = []
+
+    async def is_disconnected():
+        checks.append(1)
+        return len(checks) >= 3
+
+    await asyncio.wait_for(deadline.watch_disconnect(is_disconnected, interval=0.001), timeout=5)
+
+    assert deadline.reason == DISCONNECTED
+    assert len(checks) == 3
+
+
+@pytest.mark.asyncio
+async def test_watch_disconnect_stops_after_deadline():
+    deadline = GenerationDeadline(timeout=0.02)
+
+    async def is_disconnected():
+        return False
+
+    await asyncio.wait_for(deadline.watch_disconnect(is_disconnected, interval=0.005), timeout=5)
+
+    assert deadline.reason is None
+    assert deadline.expired()
@@ -0,0 +1,70 @@
+"""
+Prometheusメトリクスのテスト（生成のタイミングの記録と /metrics の出力）
+"""
+import os
+
+from prometheus_client import REGISTRY
+from prometheus_client.parser import text_string_to_metric_families
+
+from client.metrics.generation_metrics import GenerationTimer, observe_generation, record_fallback
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+def test_observe_generation_splits_queue_prefill_and_decode():
+    labels = {"endpoint": "metrics_test", "model": "stub"}
+    timer = GenerationTimer()
+    timer.queued_at, timer.started_at, timer.first_token_at, timer.finished_at = 10.0, 10.5, 11.0, 13.0
+
+    observe_generation("metrics_test", "stub", timer, prompt_tokens=20, generated_tokens=8)
+
+    assert sample("shachiku_queue_wait_seconds_sum", **labels) == 0.5
+    assert sample("shachiku_prefill_seconds_sum", **labels) == 0.5
+    assert sample("shachiku_decode_seconds_sum", **labels) == 2.0
+    assert sample("shachiku_prompt_tokens_total", **labels) == 20
+    assert sample("shachiku_generated_tokens_total", **labels) == 8
+
+
+def test_timer_records_first_token_only_once():
+    timer = GenerationTimer()
+    timer.on_token()
+    first = timer.first_token_at
+    timer.on_token()
+
+    assert timer.first_token_at == first
+    assert timer.steps == 2
+
+
+def test_metrics_endpoint_exposes_generation_metrics(api_client):
+    labels = {"endpoint": "excuse", "model": os.environ["MODEL_NAME"]}
+    before = sample("shachiku_prompt_tokens_total", **labels)
+    record_fallback("metrics_test", "stub", "deadline")
+
+    response = api_client.post("/v1/excuse/generate", json={"question": "なぜ会議に遅れたのですか？", "use_cache": False})
+    assert response.status_code == 200
+    metrics = api_client.get("/metrics")
+
+    assert metrics.status_code == 200
+    assert metrics.headers["content-type"].startswith("text/plain")
+    families = {family.name: family for family in text_string_to_metric_families(metrics.text)}
+    for name in (
+        "shachiku_queue_wait_seconds",
+        "shachiku_prefill_seconds",
+        "shachiku_decode_seconds",
+        "shachiku_postprocess_seconds",
+        "shachiku_generated_tokens",
+        "shachiku_in_flight_requests",
+        "shachiku_model_resident_memory_bytes"
+    ):
+        assert name in families, name
+    assert families["shachiku_prefill_seconds"].type == "histogram"
+
+    samples = {
+        (s.name, tuple(sorted(s.labels.items()))): s.value
+        for family in families.values() for s in family.samples
+    }
+    assert samples[("shachiku_prompt_tokens_total", tuple(sorted(labels.items())))] > before
+    assert samples[("shachiku_prefill_seconds_count", tuple(sorted(labels.items())))] >= 1
+    assert samples[("shachiku_fallbacks_total", (("endpoint", "metrics_test"), ("model", "stub"), ("reason", "deadline")))] >= 1
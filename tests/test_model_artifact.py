@@ -0,0 +1,104 @@
+"""
+モデル成果物のマニフェストのテスト（作成・検証・検証結果によるロード元の選択）
+"""
+import json
+import os
+import shutil
+
+import pytest
+
+from client.llm.inference_backend import resolve_model_source
+from client.llm.model_artifact import MANIFEST_FILE, config_hash, validate_manifest, write_manifest
+
+MODEL_NAME = "stub/gpt2"
+
+
+@pytest.fixture
+def model_dir(tmp_path):
+    """マニフェストを作成し直したスタブモデルのコピー"""
+    model_dir = str(tmp_path / "model")
+    shutil.copytree(os.environ["MODEL_PATH"], model_dir)
+    write_manifest(model_dir, MODEL_NAME)
+    return model_dir
+
+
+def flip_last_byte(path):
+    """サイズを変えずに内容だけを壊す"""
+    with open(path, "r+b") as f:
+        f.seek(-1, os.SEEK_END)
+        last = f.read(1)[0]
+        f.seek(-1, os.SEEK_END)
+        f.write(bytes([last ^ 0xFF]))
+
+
+def test_manifest_records_every_file(model_dir):
+    with open(os.path.join(model_dir, MANIFEST_FILE), encoding="utf-8") as f:
+        manifest = json.load(f)
+
+    assert manifest["model_name"] == MODEL_NAME
+    assert manifest["format"] == "safetensors"
+    assert manifest["dtype"] == "float32"
+    assert MANIFEST_FILE not in manifest["files"]
+    assert set(manifest["files"]) == set(os.listdir(model_dir)) - {MANIFEST_FILE}
+    assert validate_manifest(model_dir) == (True, "OK")
+
+
+def test_corrupted_weights_fail_checksum(model_dir):
+    flip_last_byte(os.path.join(model_dir, "model.safetensors"))
+
+    valid, reason = validate_manifest(model_dir)
+    assert not valid and "model.safetensors" in reason
+    # サイズのみの確認では同じサイズの破損は検出しない
+    assert validate_manifest(model_dir, verify_checksums=False)[0]
+
+
+def test_resized_or_missing_file_is_invalid(model_dir):
+    with open(os.path.join(model_dir, "tokenizer.json"), "a", encoding="utf-8") as f:
+        f.write(" ")
+    assert validate_manifest(model_dir, verify_checksums=False) == (False, "ファイルサイズが一致しません: tokenizer.json")
+
+    os.remove(os.path.join(model_dir, "tokenizer.json"))
+    assert validate_manifest(model_dir) == (False, "ファイルがありません: tokenizer.json")
+
+
+def test_missing_or_unsupported_manifest_is_invalid(model_dir):
+    manifest_path = os.path.join(model_dir, MANIFEST_FILE)
+    with open(manifest_path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump({**manifest, "version": 99}, f)
+    assert not validate_manifest(model_dir)[0]
+
+    os.remove(manifest_path)
+    assert validate_manifest(model_dir) == (False, "マニフェストがありません")
+
+
+def test_config_hash_ignores_formatting(model_dir):
+    config_path = os.path.join(model_dir, "config.json")
+    before = config_hash(model_dir)
+    with open(config_path, encoding="utf-8") as f:
+        config = json.load(f)
+    with open(config_path, "w", encoding="utf-8") as f:
+        json.dump(dict(reversed(list(config.items()))), f)
+    assert config_hash(model_dir) == before
+
+    with open(config_path, "w", encoding="utf-8") as f:
+        json.dump({**config, "n_layer": config["n_layer"] + 1}, f)
+    assert config_hash(model_dir) != before
+
+
+def test_resolve_model_source_uses_only_valid_local_artifacts(model_dir, monkeypatch):
+    monkeypatch.setenv("MODEL_ARTIFACT_VERIFY", "checksum")
+    assert resolve_model_source(MODEL_NAME, model_dir) == (model_dir, True)
+
+    # 検証に失敗したローカル成果物は使わずにHugging Faceから取得する
+    flip_last_byte(os.path.join(model_dir, "model.safetensors"))
+    assert resolve_model_source(MODEL_NAME, model_dir) == (MODEL_NAME, False)
+
+    # マニフェストのない既存のローカルモデルは未検証のまま使う
+    os.remove(os.path.join(model_dir, MANIFEST_FILE))
+    assert resolve_model_source(MODEL_NAME, model_dir) == (model_dir, True)
+
+
+def test_directory_without_weights_uses_hub(tmp_path):
+    assert resolve_model_source(MODEL_NAME, str(tmp_path)) == (MODEL_NAME, False)
@@ -0,0 +1,75 @@
+"""
+ONNXエクスポートの再利用判定のテスト（エクスポート元の設定・重みが変わったら作り直す）
+"""
+import json
+import os
+
+import pytest
+
+pytest.importorskip("onnxruntime")
+
+from client.llm.onnx_backend import EXPORT_INFO_FILE, ONNX_MODEL_FILE, OnnxRuntimeBackend, source_fingerprint
+
+
+def write_model(model_dir, weights=b"weights", hidden_size=64):
+    os.makedirs(model_dir, exist_ok=True)
+    with open(os.path.join(model_dir, "config.json"), "w", encoding="utf-8") as f:
+        json.dump({"model_type": "gpt2", "n_embd": hidden_size}, f)
+    with open(os.path.join(model_dir, "model.safetensors"), "wb") as f:
+        f.write(weights)
+
+
+@pytest.fixture
+def backend(tmp_path, monkeypatch):
+    monkeypatch.setenv("ONNX_MODEL_PATH", str(tmp_path / "onnx"))
+    return OnnxRuntimeBackend("stub", str(tmp_path / "model"), "cpu", "float32", "fp32")
+
+
+def mark_exported(backend, model_source):
+    os.makedirs(backend.onnx_path, exist_ok=True)
+    open(os.path.join(backend.onnx_path, ONNX_MODEL_FILE), "wb").close()
+    with open(os.path.join(backend.onnx_path, EXPORT_INFO_FILE), "w", encoding="utf-8") as f:
+        json.dump({"source": model_source, "fingerprint": source_fingerprint(model_source)}, f)
+
+
+def test_hub_model_name_is_its_own_fingerprint():
+    assert source_fingerprint("rinna/japanese-gpt2-medium") == "rinna/japanese-gpt2-medium"
+
+
+def test_export_is_reused_for_unchanged_model(backend, tmp_path):
+    model_dir = str(tmp_path / "model")
+    write_model(model_dir)
+    mark_exported(backend, model_dir)
+
+    assert backend._is_exported(model_dir)
+
+
+def test_replaced_weights_invalidate_export(backend, tmp_path):
+    model_dir = str(tmp_path / "model")
+    write_model(model_dir)
+    mark_exported(backend, model_dir)
+
+    write_model(model_dir, weights=b"retrained weights")
+
+    assert not backend._is_exported(model_dir)
+
+
+def test_changed_config_invalidates_export(backend, tmp_path):
+    model_dir = str(tmp_path / "model")
+    write_model(model_dir)
+    mark_exported(backend, model_dir)
+
+    write_model(model_dir, hidden_size=128)
+
+    assert not backend._is_exported(model_dir)
+
+
+def test_export_without_fingerprint_is_not_reused(backend, tmp_path):
+    """指紋を記録していない以前のエクスポートは作り直す"""
+    model_dir = str(tmp_path / "model")
+    write_model(model_dir)
+    mark_exported(backend, model_dir)
+    with open(os.path.join(backend.onnx_path, EXPORT_INFO_FILE), "w", encoding="utf-8") as f:
+        json.dump({"source": model_dir}, f)
+
+    assert not backend._is_exported(model_dir)
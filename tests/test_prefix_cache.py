@@ -0,0 +1,88 @@
+"""
+プレフィックスキャッシュのテスト（LRU・サイズ上限と、KVキャッシュを再利用した生成の出力一致）
+"""
+import pytest
+import torch
+
+from client.llm.prefix_cache import PrefixCache, PrefixEntry
+from config.llm.prompt_templates import EXCUSE_PROMPT_PREFIX, build_excuse_prompt
+
+QUESTIONS = ["なぜ遅刻したのですか？", "なぜ宿題を忘れたのですか？"]
+
+
+def make_entry(nbytes):
+    return PrefixEntry(token_ids=[0], past_key_values=((torch.zeros(1), torch.zeros(1)),), nbytes=nbytes)
+
+
+def test_hit_and_miss_are_counted():
+    cache = PrefixCache(max_bytes=100)
+    assert cache.get("a") is None
+
+    entry = make_entry(10)
+    cache.put("a", entry)
+
+    assert cache.get("a") is entry
+    stats = cache.get_stats()
+    assert (stats["hits"], stats["misses"], stats["entries"], stats["bytes"]) == (1, 1, 1, 10)
+
+
+def test_evicts_least_recently_used_over_max_bytes():
+    cache = PrefixCache(max_bytes=25)
+    cache.put("a", make_entry(10))
+    cache.put("b", make_entry(10))
+    cache.get("a")
+    cache.put("c", make_entry(10))
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    assert cache.get_stats()["evictions"] == 1
+
+
+def test_entry_larger_than_max_bytes_is_not_stored():
+    cache = PrefixCache(max_bytes=5)
+    cache.put("a", make_entry(10))
+    assert cache.get_stats()["entries"] == 0
+
+
+def test_get_or_create_builds_once():
+    cache = PrefixCache(max_bytes=100)
+    builds = []
+
+    def build():
+        builds.append(1)
+        return make_entry(10)
+
+    first = cache.get_or_create("a", build)
+    assert cache.get_or_create("a", build) is first
+    assert len(builds) == 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("use_engine", [True, False], ids=["engine", "generate"])
+async def test_prefix_cached_generation_matches_uncached(stub_client, monkeypatch, use_engine):
+    """プレフィックスのKVキャッシュを再利用した貪欲法の生成は、プロンプト全体をprefillした生成と一致する"""
+    if not use_engine:
+        monkeypatch.setattr(stub_client, "engine", None)
+    stub_client.prefix_cache.clear()
+
+    async def generate(question):
+        result = await stub_client.generate_text(
+            build_excuse_prompt(question),
+            max_new_tokens=12,
+            do_sample=False,
+            prefix=EXCUSE_PROMPT_PREFIX,
+            assisted=False
+        )
+        assert "error" not in result
+        return result
+
+    cached = [await generate(question) for question in QUESTIONS]
+    assert stub_client.prefix_cache.get_stats()["entries"] == 1
+    if not use_engine:
+        assert all(result["config"]["prefix_cached"] for result in cached)
+
+    monkeypatch.setattr(stub_client, "prefix_cache", None)
+    uncached = [await generate(question) for question in QUESTIONS]
+
+    assert [r["generated_text"] for r in cached] == [r["generated_text"] for r in uncached]
+    assert [r["generated_tokens"] for r in cached] == [r["generated_tokens"] for r in uncached]
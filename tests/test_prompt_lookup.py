@@ -0,0 +1,71 @@
+"""
+プロンプト参照の投機的デコードのテスト（候補の検索・候補の採用・通常のデコードとの出力一致）
+"""
+import pytest
+import torch
+
+from client.llm.generation_constraints import GenerationConstraints
+from client.llm.prompt_lookup import PromptLookupDecoder, find_candidate_tokens
+from config.llm.prompt_templates import build_excuse_prompt
+
+QUESTIONS = ["なぜ遅刻したのですか？", "なぜ宿題を忘れたのですか？"]
+
+
+def test_find_candidate_tokens_uses_longest_ngram_match():
+    token_ids = [1, 2, 3, 4, 5, 2, 3, 9, 3]
+    # 末尾の3-gram・2-gramは一致せず、1-gram (3) の最初の一致箇所の続きを返す
+    assert find_candidate_tokens(token_ids, max_ngram_size=3, num_pred_tokens=2) == [4, 5]
+    # 2-gram (2, 3) の一致を優先する
+    assert find_candidate_tokens([2, 3, 4, 5, 2, 3], max_ngram_size=3, num_pred_tokens=10) == [4, 5, 2, 3]
+    assert find_candidate_tokens([1, 2, 3], max_ngram_size=3) == []
+
+
+@pytest.fixture(scope="module")
+def decoder(stub_client):
+    return PromptLookupDecoder(stub_client.model, stub_client.tokenizer)
+
+
+@pytest.mark.parametrize("question", QUESTIONS)
+def test_greedy_output_matches_generate(stub_client, decoder, question):
+    input_ids = stub_client.tokenizer.encode(build_excuse_prompt(question))
+
+    generated, stats = decoder.generate(input_ids, max_new_tokens=32, do_sample=False)
+
+    with torch.inference_mode():
+        expected = stub_client.model.generate(
+            torch.tensor([input_ids]),
+            max_new_tokens=32,
+            do_sample=False,
+            pad_token_id=stub_client.tokenizer.pad_token_id
+        )[0, len(input_ids):].tolist()
+    if stub_client.tokenizer.eos_token_id in expected:
+        expected = expected[:expected.index(stub_client.tokenizer.eos_token_id)]
+    assert generated == expected
+    assert stats["steps"] <= len(generated)
+
+
+def test_repeated_prompt_accepts_candidates(stub_client, decoder):
+    """プロンプトを繰り返す出力では候補が採用され、1ステップで複数トークンを生成する"""
+    input_ids = stub_client.tokenizer.encode(build_excuse_prompt(QUESTIONS[0]))
+
+    generated, stats = decoder.generate(input_ids, max_new_tokens=32, do_sample=False)
+
+    assert stats["accepted"] > 0
+    assert stats["steps"] < len(generated)
+    assert stats["acceptance_rate"] == round(stats["accepted"] / stats["proposed"], 3)
+    assert decoder.get_stats()["requests"] >= 1
+
+
+def test_constraints_stop_at_same_point_as_backend(stub_client, decoder):
+    input_ids = stub_client.tokenizer.encode("なぜ遅刻したのですか")
+    constraints = GenerationConstraints(max_chars=10)
+
+    generated, _ = decoder.generate(input_ids, max_new_tokens=32, do_sample=False, constraints=constraints)
+    expected = stub_client.backend.generate(input_ids, max_new_tokens=32, do_sample=False, constraints=constraints)[0]
+
+    assert generated == expected
+    assert len(generated) < 32
+
+
+def test_uses_model_top_k(stub_client, decoder):
+    assert decoder.top_k == stub_client.model.generation_config.top_k
@@ -0,0 +1,161 @@
+"""
+準備状態のテスト（ロード・ウォームアップ・ready・失敗の遷移と、準備中の推論リクエストの拒否）
+"""
+import asyncio
+import threading
+
+import pytest
+from fastapi import HTTPException
+
+from api.v1.readiness import require_model_ready
+from service.excuse_generation.excuse_service import ExcuseService
+from service.readiness import readiness_service as readiness_module
+from service.readiness.readiness_service import (
+    FAILED,
+    LOADING,
+    READY,
+    STARTING,
+    WARMING_UP,
+    ModelNotReadyError,
+    ReadinessService
+)
+
+
+class FakeRegistry:
+    """release() されるまでロードが終わらないレジストリ"""
+
+    def __init__(self, client=None, error=None):
+        self.client = client
+        self.error = error
+        self._release = threading.Event()
+
+    def load(self):
+        self._release.wait(timeout=30)
+        if self.error is not None:
+            raise self.error
+        return self.client
+
+    def release(self):
+        self._release.set()
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    registry = FakeRegistry(client=object())
+    monkeypatch.setattr(readiness_module, "get_model_registry", lambda: registry)
+    return registry
+
+
+async def wait_for_state(readiness, state):
+    for _ in range(1000):
+        if readiness.state == state:
+            return
+        await asyncio.sleep(0.005)
+    raise AssertionError(f"状態が {state} になりません (現在: {readiness.state})")
+
+
+@pytest.mark.asyncio
+async def test_transitions_through_loading_and_warmup_to_ready(registry, monkeypatch):
+    warmed_up = asyncio.Event()
+    warmup_clients = []
+
+    async def warmup(client):
+        warmup_clients.append(client)
+        await warmed_up.wait()
+
+    readiness = ReadinessService(warmup_enabled=True, warmup_runs=1, retry_after=7)
+    monkeypatch.setattr(readiness, "_warmup", warmup)
+    assert readiness.state == STARTING
+
+    readiness.start()
+    await wait_for_state(readiness, LOADING)
+    with pytest.raises(ModelNotReadyError) as excinfo:
+        readiness.check_ready()
+    assert (excinfo.value.state, excinfo.value.retry_after) == (LOADING, 7)
+
+    registry.release()
+    await wait_for_state(readiness, WARMING_UP)
+    assert warmup_clients == [registry.client]
+    assert not readiness.is_ready
+
+    warmed_up.set()
+    await wait_for_state(readiness, READY)
+    readiness.check_ready()
+    status = readiness.get_status()
+    assert status["ready"] and status["warmup_runs"] == 1
+    assert {"load_seconds", "warmup_seconds", "ready_seconds"} <= set(status["timings"])
+
+
+@pytest.mark.asyncio
+async def test_warmup_disabled_goes_straight_to_ready(registry):
+    readiness = ReadinessService(warmup_enabled=False)
+    readiness.start()
+    registry.release()
+
+    await wait_for_state(readiness, READY)
+    assert "warmup_seconds" not in readiness.timings
+    assert readiness.get_status()["warmup_runs"] == 0
+
+
+@pytest.mark.asyncio
+async def test_load_failure_is_reported(monkeypatch):
+    registry = FakeRegistry(error=RuntimeError("weights not found"))
+    monkeypatch.setattr(readiness_module, "get_model_registry", lambda: registry)
+    readiness = ReadinessService(warmup_enabled=False)
+
+    readiness.start()
+    registry.release()
+    await wait_for_state(readiness, FAILED)
+
+    assert readiness.error == "weights not found"
+    with pytest.raises(ModelNotReadyError):
+        readiness.check_ready()
+
+
+@pytest.mark.asyncio
+async def test_without_preload_is_ready_immediately():
+    readiness = ReadinessService()
+    readiness.start(preload=False)
+    assert readiness.is_ready
+
+
+@pytest.mark.asyncio
+async def test_stop_cancels_pending_load(registry):
+    readiness = ReadinessService(warmup_enabled=False)
+    readiness.start()
+    await wait_for_state(readiness, LOADING)
+
+    await asyncio.wait_for(readiness.stop(), timeout=5)
+    registry.release()
+
+    assert readiness._task.cancelled()
+    assert readiness.state == LOADING
+
+
+@pytest.mark.asyncio
+async def test_warmup_errors_do_not_block_ready(stub_client, monkeypatch):
+    async def failing(*args, **kwargs):
+        raise RuntimeError("generation failed")
+
+    registry = FakeRegistry(client=stub_client)
+    monkeypatch.setattr(readiness_module, "get_model_registry", lambda: registry)
+    monkeypatch.setattr(ExcuseService, "generate_excuse", failing)
+    readiness = ReadinessService(warmup_enabled=True, warmup_runs=1)
+
+    readiness.start()
+    registry.release()
+    await wait_for_state(readiness, READY)
+    assert readiness.error is None
+
+
+def test_inference_requests_are_rejected_until_ready(monkeypatch):
+    readiness = ReadinessService(retry_after=3)
+    monkeypatch.setattr(readiness_module, "_readiness_service", readiness)
+
+    with pytest.raises(HTTPException) as excinfo:
+        require_model_ready()
+    assert excinfo.value.status_code == 503
+    assert excinfo.value.headers == {"Retry-After": "3"}
+
+    readiness.state = READY
+    require_model_ready()
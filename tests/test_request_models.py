@@ -0,0 +1,34 @@
+"""
+リクエストモデルの検証のテスト（バッチで使えない要素ごとのオプションの拒否）
+"""
+import pytest
+from pydantic import ValidationError
+
+from models.request_models import ExcuseBatchRequest, ReplyBatchRequest
+
+
+def reply_item(**options):
+    return {
+        "settings": {"userId": "u1", "channel": "general", "replyTo": "田中さん"},
+        "mission": {"instruction": "丁寧に断る", "goal": "断る"},
+        "message": {"content": "明日の飲み会に参加できますか？", "timestamp": "2024-01-01T09:00:00Z"},
+        **options
+    }
+
+
+def test_batch_accepts_single_candidate_items():
+    request = ExcuseBatchRequest(items=[{"question": "なぜ遅刻したのですか？"}, {"question": "なぜ宿題を忘れたのですか？", "num_candidates": 1}])
+    assert len(request.items) == 2
+    assert len(ReplyBatchRequest(items=[reply_item(), reply_item(use_cache=False)]).items) == 2
+
+
+@pytest.mark.parametrize("options", [{"num_candidates": 3}, {"return_alternatives": True}])
+def test_excuse_batch_rejects_candidate_options_per_item(options):
+    with pytest.raises(ValidationError, match=r"items\[1\]"):
+        ExcuseBatchRequest(items=[{"question": "なぜ遅刻したのですか？"}, {"question": "なぜ宿題を忘れたのですか？", **options}])
+
+
+@pytest.mark.parametrize("options", [{"num_candidates": 2}, {"return_alternatives": True}, {"prompt_lookup": True}])
+def test_reply_batch_rejects_unsupported_options_per_item(options):
+    with pytest.raises(ValidationError, match=r"items\[0\]"):
+        ReplyBatchRequest(items=[reply_item(**options), reply_item()])
@@ -0,0 +1,101 @@
+"""
+完全一致の応答キャッシュのテスト（ヒット・ミス・TTL・LRU・SQLiteの永続化）
+"""
+import os
+
+import pytest
+
+from client.cache import response_cache as response_cache_module
+from client.cache.response_cache import ResponseCache, SQLiteCacheBackend, make_cache_key
+
+
+class FakeClock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(response_cache_module.time, "time", clock.time)
+    return clock
+
+
+def test_cache_key_ignores_whitespace_and_width():
+    params = {"temperature": 0.7}
+    assert make_cache_key("excuse", "なぜ　遅刻したのですか？ ", params) == make_cache_key("excuse", "なぜ 遅刻したのですか?", params)
+    assert make_cache_key("excuse", "質問", params) != make_cache_key("excuse", "質問", {"temperature": 0.8})
+    assert make_cache_key("excuse", "質問", params) != make_cache_key("reply", "質問", params)
+
+
+def test_hit_and_miss(clock):
+    cache = ResponseCache(max_entries=8, ttl_seconds=60)
+    assert cache.get("excuse", "key") is None
+
+    cache.set("excuse", "key", {"text": "電車が遅れました"})
+    value = cache.get("excuse", "key")
+    assert value == {"text": "電車が遅れました"}
+
+    # 返した値を書き換えてもキャッシュには影響しない
+    value["text"] = "changed"
+    assert cache.get("excuse", "key") == {"text": "電車が遅れました"}
+    assert cache.get_stats()["endpoints"]["excuse"] == {"hits": 2, "misses": 1, "sets": 1}
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = ResponseCache(max_entries=8, ttl_seconds=60)
+    cache.set("excuse", "key", {"text": "a"})
+
+    clock.now += 59
+    assert cache.get("excuse", "key") is not None
+    clock.now += 1
+    assert cache.get("excuse", "key") is None
+    assert cache.get_stats()["entries"] == 0
+
+
+def test_evicts_least_recently_used(clock):
+    cache = ResponseCache(max_entries=2, ttl_seconds=60)
+    cache.set("excuse", "a", {"text": "a"})
+    cache.set("excuse", "b", {"text": "b"})
+    cache.get("excuse", "a")
+    cache.set("excuse", "c", {"text": "c"})
+
+    assert cache.get("excuse", "b") is None
+    assert cache.get("excuse", "a") is not None
+    assert cache.get("excuse", "c") is not None
+
+
+def test_sqlite_backend_is_shared_between_instances(clock, tmp_path):
+    path = str(tmp_path / "responses.sqlite3")
+    writer = ResponseCache(max_entries=8, ttl_seconds=60, backend=SQLiteCacheBackend(path, 8))
+    reader = ResponseCache(max_entries=8, ttl_seconds=60, backend=SQLiteCacheBackend(path, 8))
+
+    writer.set("excuse", "key", {"text": "a"})
+    assert reader.get("excuse", "key") == {"text": "a"}
+
+    clock.now += 61
+    other = ResponseCache(max_entries=8, ttl_seconds=60, backend=SQLiteCacheBackend(path, 8))
+    assert other.get("excuse", "key") is None
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="fork が使えない環境")
+def test_reset_after_fork_opens_a_new_connection(tmp_path):
+    """forkした子プロセスは親プロセスの接続を使わず、開き直した接続で同じファイルを読み書きする"""
+    cache = ResponseCache(max_entries=8, ttl_seconds=60, backend=SQLiteCacheBackend(str(tmp_path / "responses.sqlite3"), 8))
+    cache.set("excuse", "parent", {"text": "a"})
+    parent_conn = cache.backend._local.conn
+
+    pid = os.fork()
+    if pid == 0:
+        cache.reset_after_fork()
+        cache._entries.clear()
+        ok = cache.get("excuse", "parent") == {"text": "a"} and cache.backend._local.conn is not parent_conn
+        cache.set("excuse", "child", {"text": "b"})
+        os._exit(0 if ok else 1)
+
+    _, status = os.waitpid(pid, 0)
+    assert status == 0
+    assert cache.backend.get("child")[1] == {"text": "b"}
@@ -0,0 +1,116 @@
+"""
+セマンティックキャッシュのテスト（較正した空間での類似度検索・名前空間・保存と読み込み）
+"""
+import numpy as np
+import pytest
+
+from client.cache.semantic_cache import SemanticCache, SemanticCalibration, make_namespace
+
+DIM = 16
+MODEL_NAME = "stub-gpt2"
+NAMESPACE = make_namespace("excuse", {"temperature": 0.7})
+
+
+def unit(seed):
+    vector = np.random.default_rng(seed).normal(size=DIM).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+@pytest.fixture
+def calibration():
+    # 埋め込みが共通の方向に偏っている（異方性）状況を、平均ベクトルで再現する
+    return SemanticCalibration(MODEL_NAME, unit(0) * 3, threshold=0.9)
+
+
+def near(vector, seed, scale=0.05):
+    return vector + unit(seed) * scale
+
+
+def test_hit_for_similar_vector_and_miss_for_unrelated(calibration):
+    cache = SemanticCache(calibration, capacity=8)
+    question = calibration.mean + unit(1)
+    cache.insert("excuse", NAMESPACE, question, {"text": "電車が遅れました"})
+
+    match = cache.lookup("excuse", NAMESPACE, near(question, 2))
+    assert match is not None
+    value, similarity = match
+    assert value == {"text": "電車が遅れました"}
+    assert similarity >= 0.9
+
+    assert cache.lookup("excuse", NAMESPACE, calibration.mean + unit(3)) is None
+    assert cache.get_stats()["endpoints"]["excuse"] == {"hits": 1, "misses": 1, "inserts": 1}
+
+
+def test_mean_centering_separates_vectors_sharing_a_common_direction(calibration):
+    """中心化前は共通の成分で類似度が高くても、中心化後の閾値では別の質問として扱う"""
+    cache = SemanticCache(calibration, capacity=8)
+    a, b = calibration.mean + unit(1), calibration.mean + unit(3)
+    assert float(a @ b) / (np.linalg.norm(a) * np.linalg.norm(b)) > 0.8
+
+    cache.insert("excuse", NAMESPACE, a, {"text": "a"})
+    assert cache.lookup("excuse", NAMESPACE, b) is None
+
+
+def test_other_namespace_is_never_matched(calibration):
+    cache = SemanticCache(calibration, capacity=8)
+    question = calibration.mean + unit(1)
+    cache.insert("excuse", NAMESPACE, question, {"text": "a"})
+
+    other = make_namespace("excuse", {"temperature": 0.8})
+    assert cache.lookup("excuse", other, question) is None
+
+
+def test_threshold_override(calibration):
+    cache = SemanticCache(calibration, capacity=8, threshold=1.01)
+    question = calibration.mean + unit(1)
+    cache.insert("excuse", NAMESPACE, question, {"text": "a"})
+    assert cache.lookup("excuse", NAMESPACE, question) is None
+
+
+def test_supports_only_calibrated_model(calibration):
+    cache = SemanticCache(calibration)
+    assert cache.supports(MODEL_NAME)
+    assert not cache.supports("other-model")
+
+
+def test_capacity_overwrites_oldest(calibration):
+    cache = SemanticCache(calibration, capacity=2)
+    vectors = [calibration.mean + unit(seed) for seed in (1, 3, 5)]
+    for i, vector in enumerate(vectors):
+        cache.insert("excuse", NAMESPACE, vector, {"text": str(i)})
+
+    assert cache.lookup("excuse", NAMESPACE, vectors[0]) is None
+    assert cache.lookup("excuse", NAMESPACE, vectors[2])[0] == {"text": "2"}
+
+
+def test_save_and_load_roundtrip(calibration, tmp_path):
+    path = str(tmp_path / "semantic_cache.npz")
+    cache = SemanticCache(calibration, capacity=8, path=path)
+    question = calibration.mean + unit(1)
+    cache.insert("excuse", NAMESPACE, question, {"text": "a"})
+    cache.save()
+
+    restored = SemanticCache(calibration, capacity=8, path=path)
+    assert restored.lookup("excuse", NAMESPACE, question)[0] == {"text": "a"}
+
+
+def test_index_from_other_calibration_is_not_loaded(calibration, tmp_path):
+    path = str(tmp_path / "semantic_cache.npz")
+    cache = SemanticCache(calibration, capacity=8, path=path)
+    question = calibration.mean + unit(1)
+    cache.insert("excuse", NAMESPACE, question, {"text": "a"})
+    cache.save()
+
+    recalibrated = SemanticCache(calibration._replace(mean=unit(7)), capacity=8, path=path)
+    assert recalibrated.get_stats()["entries"] == 0
+
+
+def test_assign_worker_uses_separate_file(calibration, tmp_path):
+    path = str(tmp_path / "semantic_cache.npz")
+    cache = SemanticCache(calibration, capacity=8, path=path)
+    cache.insert("excuse", NAMESPACE, calibration.mean + unit(1), {"text": "a"})
+
+    cache.assign_worker(1)
+
+    assert cache.path == str(tmp_path / "semantic_cache.worker1.npz")
+    assert cache.get_stats()["entries"] == 0
@@ -0,0 +1,180 @@
+"""
+同じ生成をまとめる single-flight のテスト（合流・離脱・打ち切り・失敗）
+"""
+import asyncio
+
+import pytest
+
+from client.cache.single_flight import SingleFlight
+from client.llm.generation_deadline import CANCELLED, DEADLINE, GenerationDeadline
+
+
+class FakeGeneration:
+    """release() されるか共有の締め切りで打ち切られるまで待つ生成"""
+
+    def __init__(self):
+        self.calls = 0
+        self.deadlines = []
+        self._release = asyncio.Event()
+
+    async def __call__(self, deadline):
+        self.calls += 1
+        self.deadlines.append(deadline)
+        while not self._release.is_set():
+            if deadline.should_stop():
+                return {"text": "partial", "stopped": deadline.reason}
+            await asyncio.sleep(0.005)
+        return {"text": "done"}
+
+    def release(self):
+        self._release.set()
+
+
+@pytest.fixture
+def single_flight():
+    return SingleFlight(poll_interval=0.005)
+
+
+@pytest.mark.asyncio
+async def test_concurrent_requests_share_one_generation(single_flight):
+    generation = FakeGeneration()
+    first = asyncio.ensure_future(single_flight.run("excuse", "key", generation))
+    second = asyncio.ensure_future(single_flight.run("excuse", "key", generation))
+    await asyncio.sleep(0.02)
+    generation.release()
+
+    assert await first == await second == {"text": "done"}
+    assert generation.calls == 1
+    stats = single_flight.get_stats()
+    assert stats["in_flight"] == 0
+    assert stats["endpoints"]["excuse"]["generations"] == 1
+    assert stats["endpoints"]["excuse"]["coalesced"] == 1
+
+
+@pytest.mark.asyncio
+async def test_different_keys_generate_separately(single_flight):
+    generation = FakeGeneration()
+    generation.release()
+
+    await asyncio.gather(
+        single_flight.run("excuse", "a", generation),
+        single_flight.run("excuse", "b", generation)
+    )
+
+    assert generation.calls == 2
+
+
+@pytest.mark.asyncio
+async def test_on_join_is_called_only_for_joining_requests(single_flight):
+    generation = FakeGeneration()
+    joined = []
+    first = asyncio.ensure_future(single_flight.run("excuse", "key", generation, on_join=lambda: joined.append("first")))
+    await asyncio.sleep(0)
+    second = asyncio.ensure_future(single_flight.run("excuse", "key", generation, on_join=lambda: joined.append("second")))
+    await asyncio.sleep(0.02)
+    generation.release()
+    await asyncio.gather(first, second)
+
+    assert joined == ["second"]
+
+
+@pytest.mark.asyncio
+async def test_on_join_error_rejects_only_the_joining_request(single_flight):
+    generation = FakeGeneration()
+    first = asyncio.ensure_future(single_flight.run("excuse", "key", generation))
+    await asyncio.sleep(0)
+
+    def reject():
+        raise RuntimeError("quota exceeded")
+
+    with pytest.raises(RuntimeError, match="quota exceeded"):
+        await single_flight.run("excuse", "key", generation, on_join=reject)
+
+    generation.release()
+    assert await first == {"text": "done"}
+    assert single_flight.get_stats()["endpoints"]["excuse"]["coalesced"] == 0
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_does_not_stop_shared_generation(single_flight):
+    generation = FakeGeneration()
+    leaving = asyncio.ensure_future(single_flight.run("excuse", "key", generation))
+    staying = asyncio.ensure_future(single_flight.run("excuse", "key", generation))
+    await asyncio.sleep(0.02)
+
+    leaving.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await leaving
+    generation.release()
+
+    assert await staying == {"text": "done"}
+    assert generation.deadlines[0].reason is None
+
+
+@pytest.mark.asyncio
+async def test_last_waiter_leaving_abandons_generation(single_flight):
+    generation = FakeGeneration()
+    task = asyncio.ensure_future(single_flight.run("excuse", "key", generation))
+    await asyncio.sleep(0.02)
+
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    assert generation.deadlines[0].reason == CANCELLED
+    stats = single_flight.get_stats()
+    assert stats["in_flight"] == 0
+    assert stats["endpoints"]["excuse"]["abandoned"] == 1
+
+    # 打ち切った生成には合流せず、新たに生成する
+    generation.release()
+    assert await single_flight.run("excuse", "key", generation) == {"text": "done"}
+    assert generation.calls == 2
+
+
+@pytest.mark.asyncio
+async def test_waiter_past_its_deadline_leaves_while_others_wait(single_flight):
+    generation = FakeGeneration()
+    patient = asyncio.ensure_future(single_flight.run("excuse", "key", generation))
+    await asyncio.sleep(0)
+
+    result = await single_flight.run("excuse", "key", generation, GenerationDeadline(timeout=0.02))
+
+    assert result is None
+    assert single_flight.get_stats()["endpoints"]["excuse"]["left"] == 1
+    generation.release()
+    assert await patient == {"text": "done"}
+
+
+@pytest.mark.asyncio
+async def test_shared_deadline_is_the_latest_waiter_deadline(single_flight):
+    generation = FakeGeneration()
+    first = asyncio.ensure_future(single_flight.run("excuse", "key", generation, GenerationDeadline(timeout=0.02)))
+    await asyncio.sleep(0)
+    second = asyncio.ensure_future(single_flight.run("excuse", "key", generation, GenerationDeadline(timeout=0.1)))
+
+    first_result, second_result = await asyncio.gather(first, second)
+
+    # 最初のリクエストの締め切りでは打ち切らず、後のリクエストの締め切りで打ち切る
+    assert first_result is None
+    assert second_result == {"text": "partial", "stopped": DEADLINE}
+    assert generation.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_generation_error_is_raised_to_every_waiter(single_flight):
+    started = asyncio.Event()
+
+    async def failing(deadline):
+        started.set()
+        await asyncio.sleep(0.02)
+        raise RuntimeError("boom")
+
+    first = asyncio.ensure_future(single_flight.run("excuse", "key", failing))
+    await started.wait()
+    second = asyncio.ensure_future(single_flight.run("excuse", "key", failing))
+
+    results = await asyncio.gather(first, second, return_exceptions=True)
+
+    assert [str(result) for result in results] == ["boom", "boom"]
+    assert single_flight.get_stats()["in_flight"] == 0
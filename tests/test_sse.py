@@ -0,0 +1,107 @@
+"""
+Server-Sent Eventsのテスト（イベントの形式・レスポンス開始前のエラー・クライアント切断時の打ち切り）
+"""
+import asyncio
+import json
+import time
+from datetime import datetime, timezone
+
+import pytest
+
+from api.v1.sse import SSE_HEADERS, format_sse, open_sse_stream
+from client.llm.generation_deadline import DISCONNECTED, GenerationDeadline
+from client.llm.inference_executor import QueueFullError
+
+
+def parse_sse(body: str):
+    """SSEの本文を (event, data) のリストにする"""
+    events = []
+    for block in body.split("\n\n"):
+        if not block:
+            continue
+        lines = block.split("\n")
+        assert lines[0].startswith("event: ") and lines[1].startswith("data: ") and len(lines) == 2
+        events.append((lines[0][len("event: "):], json.loads(lines[1][len("data: "):])))
+    return events
+
+
+def test_format_sse_frames_one_event():
+    replied_at = datetime(2024, 1, 1, 9, 0, tzinfo=timezone.utc)
+
+    frame = format_sse("done", {"reply": "承知しました", "replyAt": replied_at})
+
+    assert frame == 'event: done\ndata: {"reply": "承知しました", "replyAt": "2024-01-01T09:00:00+00:00"}\n\n'
+
+
+def test_format_sse_keeps_newlines_inside_data():
+    """テキスト中の改行はJSONでエスケープされ、イベントの区切りにならない"""
+    frame = format_sse("token", {"text": "一行目\n\n二行目"})
+
+    assert parse_sse(frame) == [("token", {"text": "一行目\n\n二行目"})]
+
+
+async def events(*items, error=None):
+    if error is not None:
+        raise error
+    for event, data in items:
+        yield {"event": event, "data": data}
+
+
+@pytest.mark.asyncio
+async def test_open_sse_stream_streams_all_events():
+    response = await open_sse_stream(events(("token", {"text": "電車"}), ("token", {"text": "が"}), ("done", {"excuse": "電車が"})))
+
+    body = "".join([chunk async for chunk in response.body_iterator])
+
+    assert response.media_type == "text/event-stream"
+    assert all(response.headers[name] == value for name, value in SSE_HEADERS.items())
+    assert parse_sse(body) == [("token", {"text": "電車"}), ("token", {"text": "が"}), ("done", {"excuse": "電車が"})]
+
+
+@pytest.mark.asyncio
+async def test_error_before_first_event_is_raised_before_response():
+    with pytest.raises(QueueFullError):
+        await open_sse_stream(events(error=QueueFullError(in_flight=4, capacity=4, retry_after=1)))
+
+
+@pytest.mark.asyncio
+async def test_closing_stream_cancels_generation(stub_client, monkeypatch):
+    """最後まで読まずに閉じた場合（クライアントの切断）は生成を DISCONNECTED で打ち切る"""
+    original = stub_client.engine._decode_step
+
+    def slow_decode_step():
+        # 1トークン目を読んだ後、生成が終わる前に確実に閉じられるよう遅くする
+        time.sleep(0.01)
+        return original()
+
+    monkeypatch.setattr(stub_client.engine, "_decode_step", slow_decode_step)
+    completed = stub_client.engine.stats["completed"]
+    deadline = GenerationDeadline()
+    stream = stub_client.stream_text("なぜ遅刻したのですか", max_new_tokens=200, do_sample=False, deadline=deadline)
+
+    first = await asyncio.wait_for(stream.__anext__(), timeout=30)
+    await stream.aclose()
+
+    assert first
+    assert deadline.reason == DISCONNECTED
+    # エンジンは打ち切ったシーケンスを完了させ、バッチから外す
+    for _ in range(500):
+        if stub_client.engine.stats["completed"] > completed:
+            break
+        await asyncio.sleep(0.01)
+    assert stub_client.engine.stats["completed"] == completed + 1
+    assert not stub_client.engine._active
+
+
+def test_stream_endpoint_sends_tokens_then_done(api_client):
+    with api_client.stream("POST", "/v1/excuse/generate/stream", json={"question": "なぜ遅刻したのですか？"}) as response:
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        body = "".join(response.iter_text())
+
+    received = parse_sse(body)
+    assert {event for event, _ in received[:-1]} <= {"token"}
+    event, data = received[-1]
+    assert event == "done"
+    assert data["question"] == "なぜ遅刻したのですか？"
+    assert {"excuse", "confidence", "prompt_used"} <= set(data)